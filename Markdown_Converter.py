@@ -1,14 +1,27 @@
 import streamlit as st
+import io
 import os
 import base64
 from helpers.docx_converter import convert_to_docx
 from helpers.pdf_converter import convert_to_pdf
 from helpers.template_manager import TemplateManager
 from helpers.header_footer_processor import create_processor_from_preset
+from helpers.capabilities import get_capabilities
+from helpers.font_resolver import prepare_fonts
 
 # Page configuration
 st.set_page_config(page_title="Markdown Converter", page_icon="📄", layout="wide")
 
+
+# Resolve the PDF fonts and warm luaotfload's cache once per server process:
+# missing fonts are reported at startup instead of on every compile
+@st.cache_resource
+def prepare_pdf_fonts():
+    return prepare_fonts()
+
+
+prepare_pdf_fonts()
+
 # Title and description
 st.title("📄 Markdown to DOCX/PDF Converter")
 st.write("Upload your Markdown files and convert them to DOCX or PDF format")
@@ -183,13 +196,12 @@ if uploaded_files:
     if st.button("🔄 Convert Files", type="primary", use_container_width=True):
         with st.spinner("Converting files..."):
             for uploaded_file in uploaded_files:
-                # Read the markdown content
-                markdown_content = uploaded_file.read().decode('utf-8')
                 file_base_name = os.path.splitext(uploaded_file.name)[0]
 
                 try:
                     if "DOCX" in output_format:
-                        # Convert to DOCX
+                        # Read the markdown content and convert to DOCX
+                        markdown_content = uploaded_file.read().decode('utf-8')
                         output_buffer = convert_to_docx(markdown_content)
                         output_filename = f"{file_base_name}.docx"
                         mime_type = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
@@ -200,12 +212,20 @@ if uploaded_files:
                         if not file_custom_variables.get('title'):
                             file_custom_variables['title'] = file_base_name
 
+                        # Stream the upload through the pipeline line by line
+                        # (newline='\n' keeps line endings exactly as in the file).
+                        # The upload is seekable, so its Mermaid diagrams are
+                        # collected first and rendered in one concurrent batch
+                        uploaded_file.seek(0)
+                        markdown_stream = io.TextIOWrapper(uploaded_file, encoding='utf-8', newline='\n')
                         output_buffer = convert_to_pdf(
-                            markdown_content,
+                            markdown_stream,
                             use_header_footer=use_header_footer,
                             header_footer_preset=header_footer_preset,
                             custom_variables=file_custom_variables
                         )
+                        # Release the wrapper without closing the upload itself
+                        markdown_stream.detach()
                         output_filename = f"{file_base_name}.pdf"
                         mime_type = "application/pdf"
 
@@ -272,3 +292,17 @@ with st.sidebar:
     3. Click "Convert Files"
     4. Download your converted files
     """)
+
+    st.divider()
+
+    # External tools, probed once and cached (see helpers/capabilities.py)
+    st.header("🧰 Tools")
+    capabilities = get_capabilities()
+    if st.button("🔄 Re-check tools", use_container_width=True):
+        capabilities.invalidate()
+    for name, capability in capabilities.snapshot().items():
+        if capability.available:
+            st.write(f"✅ **{name}** {capability.version or ''}")
+        else:
+            st.write(f"❌ **{name}**")
+            st.caption(capability.detail)
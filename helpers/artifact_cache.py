@@ -0,0 +1,199 @@
+"""Cache of finished PDF/DOCX artifacts keyed by everything that shapes them
+
+Streamlit reruns and repeated API calls convert byte-identical inputs again
+and again. A conversion's output is determined by the Markdown, the options
+passed, the resolved header/footer preset, the LaTeX preamble, the logo
+file and the versions of the external tools, so a hash of all of them keys
+the finished bytes in a DiskCache (atomic writes, size- and age-bounded
+eviction, shared by every process using the directory). Identical
+conversions running at once are computed once.
+
+Only text sources are cached: a Markdown string, or a seekable file object
+(hashed in chunks, then rewound). Parsed Documents and line iterators are
+converted without the cache.
+"""
+
+import hashlib
+import json
+import os
+import threading
+from datetime import datetime
+from importlib import metadata
+from typing import Any, Callable, Dict, Optional, Tuple, Union
+
+from .disk_cache import DiskCache, content_key, default_cache_dir
+from .single_flight import SingleFlight
+
+
+# Bump when the conversion pipeline changes its output for the same inputs
+ARTIFACT_RECIPE_VERSION = '2'
+
+# Size and age limits of the artifact cache
+ARTIFACT_CACHE_MAX_BYTES = 256 * 1024 * 1024
+ARTIFACT_CACHE_MAX_AGE = 7 * 24 * 3600
+
+# Environment variables: cache directory, and '0' to disable the cache
+ARTIFACT_CACHE_DIR_ENV = 'ARTIFACT_CACHE_DIR'
+ARTIFACT_CACHE_ENV = 'ARTIFACT_CACHE'
+
+# Characters hashed per read of a streamed source
+HASH_CHUNK_SIZE = 1 << 16
+
+_artifact_cache = None
+_artifact_cache_lock = threading.Lock()
+_artifact_flights = SingleFlight()
+
+
+def artifact_cache_enabled() -> bool:
+    """Whether finished artifacts are cached ($ARTIFACT_CACHE=0 disables)"""
+    return os.environ.get(ARTIFACT_CACHE_ENV, '1') != '0'
+
+
+def get_artifact_cache() -> DiskCache:
+    """Return the process-wide artifact cache
+
+    The directory is $ARTIFACT_CACHE_DIR, or the "artifacts" directory of the
+    default cache root. Processes pointing at the same directory share it.
+    """
+    global _artifact_cache
+    with _artifact_cache_lock:
+        if _artifact_cache is None:
+            directory = os.environ.get(ARTIFACT_CACHE_DIR_ENV) or default_cache_dir('artifacts')
+            _artifact_cache = DiskCache(directory, max_bytes=ARTIFACT_CACHE_MAX_BYTES,
+                                        max_age=ARTIFACT_CACHE_MAX_AGE)
+        return _artifact_cache
+
+
+def source_digest(markdown_content: Any) -> Optional[str]:
+    """Hash a Markdown source, or return None when it cannot be hashed up front
+
+    A seekable file object is read to the end in chunks and rewound, so it
+    can still be streamed through the pipeline afterwards.
+    """
+    digest = hashlib.sha256()
+    if isinstance(markdown_content, str):
+        digest.update(markdown_content.encode('utf-8'))
+        return digest.hexdigest()
+
+    seekable = getattr(markdown_content, 'seekable', None)
+    if not callable(seekable) or not seekable():
+        return None
+    position = markdown_content.tell()
+    try:
+        while True:
+            # Text streams end with '', binary ones with b''
+            chunk = markdown_content.read(HASH_CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk.encode('utf-8') if isinstance(chunk, str) else chunk)
+    finally:
+        markdown_content.seek(position)
+    return digest.hexdigest()
+
+
+def clock_inputs(*texts: str) -> Dict[str, str]:
+    """Return the current date/time when the texts use {current_date}/{current_time}
+
+    Header/footer templates may print the conversion time, which must then
+    be part of the key.
+    """
+    joined = ''.join(texts)
+    now = datetime.now()
+    if 'current_time' in joined:
+        return {'clock': now.strftime('%Y-%m-%d %H:%M')}
+    if 'current_date' in joined:
+        return {'clock': now.strftime('%Y-%m-%d')}
+    return {}
+
+
+def package_versions(*names: str) -> str:
+    """Return the installed versions of Python packages the output depends on"""
+    versions = []
+    for name in names:
+        try:
+            versions.append(f'{name}=={metadata.version(name)}')
+        except metadata.PackageNotFoundError:
+            versions.append(f'{name} missing')
+    return ','.join(versions)
+
+
+def artifact_key(kind: str, digest: str, options: Dict[str, Any],
+                 inputs: Dict[str, Union[str, bytes, None]]) -> str:
+    """Return the cache key of a conversion
+
+    Args:
+        kind: Output format ('pdf', 'docx')
+        digest: source_digest of the Markdown
+        options: Conversion options (JSON-serializable)
+        inputs: Other files and texts the output depends on (preset JSON,
+            preamble, logo bytes, tool versions, ...); None marks an absent one
+    """
+    parts = [
+        'artifact', ARTIFACT_RECIPE_VERSION, kind, digest,
+        json.dumps(options, sort_keys=True, default=str),
+    ]
+    for name in sorted(inputs):
+        value = inputs[name]
+        parts.append(name)
+        parts.append(b'\0absent' if value is None else value)
+    return content_key(*parts)
+
+
+def cached_artifact(key: str, build: Callable[[], Tuple[bytes, Optional[dict]]],
+                    report: Optional[dict] = None, cache: Optional[DiskCache] = None) -> bytes:
+    """Return a cached artifact, building and storing it on a miss
+
+    Args:
+        key: artifact_key of the conversion
+        build: Runs the conversion; returns (artifact bytes, its report dict or None)
+        report: Optional dict receiving 'artifact_cache' ('hit', 'miss' or
+            'shared' when a concurrent identical conversion built it) and, on a
+            hit, the report of the conversion that built the artifact
+        cache: DiskCache to use (default: the shared artifact cache)
+
+    Returns:
+        The artifact bytes
+    """
+    cache = cache or get_artifact_cache()
+    report_key = content_key(key, 'report')
+
+    data = cache.get(key)
+    status = 'hit'
+    if data is None:
+        owned, waiting = _artifact_flights.begin([key])
+        if owned:
+            try:
+                # A flight for the key may have finished since the lookup
+                data = cache.get(key)
+                if data is None:
+                    status = 'miss'
+                    data, built_report = build()
+                    cache.put(key, data)
+                    cache.put(report_key, json.dumps(built_report or {}).encode('utf-8'))
+                else:
+                    built_report = _stored_report(cache, report_key)
+            except BaseException as e:
+                _artifact_flights.finish(key, error=e)
+                raise
+            _artifact_flights.finish(key, (data, built_report))
+        else:
+            status = 'shared'
+            data, built_report = waiting[key].wait()
+    else:
+        built_report = _stored_report(cache, report_key) if report is not None else None
+
+    if report is not None:
+        report.update(built_report or {})
+        report['artifact_cache'] = status
+    return data
+
+
+def _stored_report(cache: DiskCache, report_key: str) -> Optional[dict]:
+    """Return the report stored with an artifact, if still cached"""
+    stored = cache.get(report_key)
+    return json.loads(stored) if stored is not None else None
+
+
+def artifact_cache_stats() -> Dict[str, float]:
+    """Return the hit/miss counters of the shared artifact cache"""
+    return get_artifact_cache().stats()
@@ -0,0 +1,128 @@
+"""Block-level memoization for Obsidian preprocessing
+
+Re-exporting a lightly edited document re-runs the conversions (table width
+optimization, callout formatting, code block wrapping, inline markup) over
+blocks that have not changed. The emitters (see document_ir.py) keep the
+output of each top-level block (paragraph run, callout, code block) in a
+BlockCache, keyed by a hash of the block's content, the emitter settings and
+the pipeline version. Tables keep their column widths, as their rows are
+streamed.
+"""
+
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Optional, Union
+
+from .disk_cache import DiskCache
+
+
+# Bump whenever the output of any preprocessing stage changes, so stale
+# cached blocks (in memory or spilled to disk) are never reused
+PIPELINE_VERSION = '3'
+
+
+class BlockCache:
+    """Bounded LRU cache of converted blocks with optional spill to disk"""
+
+    def __init__(self, max_chars: int = 64 * 1024 * 1024,
+                 spill_dir: Optional[Union[str, Path]] = None,
+                 spill_max_bytes: int = 512 * 1024 * 1024):
+        """
+        Initialize cache
+
+        Args:
+            max_chars: Approximate in-memory size limit (characters of cached output)
+            spill_dir: Directory evicted entries are written to (None: no spill)
+            spill_max_bytes: Size limit of the spill directory
+        """
+        self.max_chars = max_chars
+        self.spill = DiskCache(spill_dir, max_bytes=spill_max_bytes) if spill_dir else None
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        """Return a cached block output, or None on a miss"""
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+
+        if self.spill is not None:
+            data = self.spill.get(key)
+            if data is not None:
+                value = data.decode('utf-8')
+                with self._lock:
+                    self.disk_hits += 1
+                self._store(key, value)
+                return value
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, value: str) -> None:
+        """Store a block output"""
+        self._store(key, value)
+
+    def clear(self) -> None:
+        """Drop every in-memory entry (spilled entries are kept)"""
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self) -> Dict[str, float]:
+        """Return hit/miss counters and current size"""
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'size_chars': self._size,
+                'hit_rate': (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+            }
+
+    def _store(self, key: str, value: str) -> None:
+        """Insert an entry and evict least recently used ones beyond max_chars"""
+        evicted = []
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= len(previous)
+            self._entries[key] = value
+            self._size += len(value)
+
+            while self._size > self.max_chars and len(self._entries) > 1:
+                old_key, old_value = self._entries.popitem(last=False)
+                self._size -= len(old_value)
+                self.evictions += 1
+                evicted.append((old_key, old_value))
+
+        if self.spill is not None:
+            for old_key, old_value in evicted:
+                self.spill.put(old_key, old_value.encode('utf-8'))
+
+
+_default_block_cache = None
+_default_block_cache_lock = threading.Lock()
+
+
+def get_default_block_cache() -> BlockCache:
+    """Return the process-wide block cache used by the converters"""
+    global _default_block_cache
+    with _default_block_cache_lock:
+        if _default_block_cache is None:
+            _default_block_cache = BlockCache()
+        return _default_block_cache
@@ -0,0 +1,184 @@
+"""Process-wide registry of external tool availability
+
+The converters depend on tools outside Python: mmdc for Mermaid diagrams,
+pandoc and lualatex (or pdflatex for plain documents) for PDF output, and the fonts the LaTeX header asks for.
+Each one is probed once (a subprocess per tool), and the result is cached
+for CAPABILITY_TTL seconds, so a conversion can skip a stage whose tool is
+missing without paying for a failing subprocess per diagram.
+"""
+
+import os
+import subprocess
+import threading
+import time
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+
+# Seconds a probe result is trusted (tools may be installed while running)
+CAPABILITY_TTL = float(os.environ.get('CAPABILITY_TTL') or 300)
+
+# A probe returns (available, version, detail)
+Probe = Callable[[], Tuple[bool, Optional[str], str]]
+
+
+class Capability:
+    """Availability of one tool at the time it was probed"""
+
+    __slots__ = ('name', 'available', 'version', 'detail', 'checked_at')
+
+    def __init__(self, name: str, available: bool, version: Optional[str] = None,
+                 detail: str = '', checked_at: float = 0.0):
+        self.name = name
+        self.available = available
+        self.version = version
+        self.detail = detail
+        self.checked_at = checked_at
+
+    def __repr__(self):
+        state = (self.version or 'available') if self.available else f'missing ({self.detail})'
+        return f'Capability({self.name}: {state})'
+
+
+def _run_version(command: Iterable[str], timeout: float = 30) -> Tuple[bool, Optional[str], str]:
+    """Run a --version command; the first output line is the version"""
+    try:
+        result = subprocess.run(list(command), capture_output=True, text=True, timeout=timeout)
+    except FileNotFoundError:
+        return False, None, 'not installed'
+    except subprocess.SubprocessError as e:
+        return False, None, str(e)
+    if result.returncode != 0:
+        return False, None, (result.stderr.strip() or f'exit status {result.returncode}')
+    lines = result.stdout.strip().splitlines()
+    return True, (lines[0].strip() if lines else 'unknown'), ''
+
+
+def probe_mmdc() -> Tuple[bool, Optional[str], str]:
+    """Probe mermaid-cli"""
+    return _run_version(['mmdc', '--version'])
+
+
+def probe_pandoc() -> Tuple[bool, Optional[str], str]:
+    """Probe the pandoc pypandoc uses (a system install or pypandoc's own)"""
+    try:
+        import pypandoc
+        return True, pypandoc.get_pandoc_version(), ''
+    except (ImportError, OSError) as e:
+        return False, None, str(e) or 'not installed'
+
+
+def probe_lualatex() -> Tuple[bool, Optional[str], str]:
+    """Probe the LuaLaTeX engine"""
+    return _run_version(['lualatex', '--version'])
+
+
+def probe_pdflatex() -> Tuple[bool, Optional[str], str]:
+    """Probe the pdfLaTeX engine"""
+    return _run_version(['pdflatex', '--version'])
+
+
+def probe_fonts() -> Tuple[bool, Optional[str], str]:
+    """Probe the fonts of the LaTeX header (see font_resolver.py)"""
+    from .font_resolver import get_font_map  # font_resolver imports this module
+    problems = get_font_map().problems()
+    if problems:
+        return False, None, '; '.join(problems)
+    return True, None, ''
+
+
+DEFAULT_PROBES: Dict[str, Probe] = {
+    'mmdc': probe_mmdc,
+    'pandoc': probe_pandoc,
+    'lualatex': probe_lualatex,
+    'pdflatex': probe_pdflatex,
+    'fonts': probe_fonts,
+}
+
+
+class CapabilityRegistry:
+    """Cached results of tool probes, refreshed after a TTL"""
+
+    def __init__(self, probes: Optional[Dict[str, Probe]] = None, ttl: float = CAPABILITY_TTL):
+        """
+        Initialize registry
+
+        Args:
+            probes: Tool name -> probe (default: DEFAULT_PROBES)
+            ttl: Seconds a probe result is trusted
+        """
+        self.probes = dict(DEFAULT_PROBES if probes is None else probes)
+        self.ttl = ttl
+        self._results: Dict[str, Capability] = {}
+        self._lock = threading.Lock()
+        self._probe_locks = {name: threading.Lock() for name in self.probes}
+
+    def get(self, name: str) -> Capability:
+        """Return the capability of a tool, probing it when unknown or stale"""
+        capability = self._fresh(name)
+        if capability is not None:
+            return capability
+
+        # One probe per tool at a time; concurrent callers wait for its result
+        with self._probe_locks[name]:
+            capability = self._fresh(name)
+            if capability is None:
+                available, version, detail = self.probes[name]()
+                capability = Capability(name, available, version, detail, time.monotonic())
+                with self._lock:
+                    self._results[name] = capability
+        return capability
+
+    def _fresh(self, name: str) -> Optional[Capability]:
+        """Return the cached capability of a tool if still within the TTL"""
+        with self._lock:
+            capability = self._results.get(name)
+        if capability is not None and time.monotonic() - capability.checked_at < self.ttl:
+            return capability
+        return None
+
+    def available(self, name: str) -> bool:
+        """Whether a tool is available"""
+        return self.get(name).available
+
+    def version(self, name: str) -> Optional[str]:
+        """Return the version of a tool, or None when it is unavailable"""
+        capability = self.get(name)
+        return capability.version if capability.available else None
+
+    def snapshot(self) -> Dict[str, Capability]:
+        """Return the capability of every tool (probing the unknown ones)"""
+        return {name: self.get(name) for name in self.probes}
+
+    def invalidate(self, name: Optional[str] = None):
+        """Forget one probe result (or all), so the next lookup probes again"""
+        with self._lock:
+            if name is None:
+                self._results.clear()
+            else:
+                self._results.pop(name, None)
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_capabilities() -> CapabilityRegistry:
+    """Return the process-wide capability registry"""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = CapabilityRegistry()
+        return _registry
+
+
+def require_tools(*names: str, purpose: str = 'this conversion'):
+    """Raise RuntimeError naming every unavailable tool among names
+
+    Raises:
+        RuntimeError: At least one tool is unavailable
+    """
+    registry = get_capabilities()
+    missing = [registry.get(name) for name in names if not registry.available(name)]
+    if missing:
+        reasons = '; '.join(f'{capability.name}: {capability.detail}' for capability in missing)
+        raise RuntimeError(f"{purpose} needs {', '.join(names)} ({reasons})")
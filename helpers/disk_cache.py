@@ -0,0 +1,199 @@
+"""Content-addressed on-disk cache shared between workers
+
+Entries are stored as files named by their key, sharded by the first two
+characters of the key. Writes go to a temporary file in the same directory
+and are moved into place with os.replace, so concurrent processes sharing one
+directory never see partial entries. Reads refresh the file's modification
+time, which eviction uses as the LRU order.
+"""
+
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Optional, Union
+
+
+def content_key(*parts: Union[str, bytes]) -> str:
+    """Hash any number of str/bytes parts into a hex cache key
+
+    Parts are length-prefixed so ('ab', 'c') and ('a', 'bc') differ.
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode('utf-8')
+        digest.update(str(len(part)).encode('ascii') + b':')
+        digest.update(part)
+    return digest.hexdigest()
+
+
+def default_cache_dir(name: str) -> Path:
+    """Return the default directory for a named cache
+
+    Uses $XDG_CACHE_HOME (or ~/.cache) /markdown-converter/<name>.
+    """
+    root = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return Path(root) / 'markdown-converter' / name
+
+
+class DiskCache:
+    """Size- and age-bounded file cache with atomic writes"""
+
+    # Rescan the directory after this many writes, since other processes
+    # sharing it also add entries
+    RESCAN_INTERVAL = 64
+
+    def __init__(self, directory: Union[str, Path], max_bytes: Optional[int] = None,
+                 max_age: Optional[float] = None, suffix: str = ''):
+        """
+        Initialize cache
+
+        Args:
+            directory: Cache directory (created if missing)
+            max_bytes: Total size limit; least recently used entries are evicted beyond it
+            max_age: Maximum entry age in seconds since last use
+            suffix: File suffix for entries (e.g. '.png')
+        """
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.suffix = suffix
+
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+
+        self._lock = threading.Lock()
+        self._approx_size = None
+        self._writes_since_scan = 0
+
+    def path_for(self, key: str) -> Path:
+        """Return the file path an entry is (or would be) stored at"""
+        return self.directory / key[:2] / (key + self.suffix)
+
+    def get_path(self, key: str) -> Optional[Path]:
+        """Return the path of a cached entry, or None on a miss"""
+        path = self.path_for(key)
+        try:
+            expired = (self.max_age is not None
+                       and path.stat().st_mtime < time.time() - self.max_age)
+            if not expired:
+                # Mark as recently used
+                os.utime(path)
+        except (FileNotFoundError, NotADirectoryError):
+            expired = True
+
+        with self._lock:
+            if expired:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return path
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Return a cached entry's bytes, or None on a miss"""
+        path = self.get_path(key)
+        if path is None:
+            return None
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            # Evicted by another process between lookup and read
+            with self._lock:
+                self.hits -= 1
+                self.misses += 1
+            return None
+
+    def put(self, key: str, data: bytes) -> Path:
+        """Store an entry atomically and return its path"""
+        path = self.path_for(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        fd, temp_path = tempfile.mkstemp(dir=path.parent, prefix='.tmp-', suffix=self.suffix)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+        with self._lock:
+            self.writes += 1
+            self._writes_since_scan += 1
+            if self._approx_size is not None:
+                self._approx_size += len(data)
+            needs_scan = (self._approx_size is None
+                          or self._writes_since_scan >= self.RESCAN_INTERVAL
+                          or (self.max_bytes is not None and self._approx_size > self.max_bytes))
+
+        if needs_scan and (self.max_bytes is not None or self.max_age is not None):
+            self.evict()
+        return path
+
+    def evict(self) -> int:
+        """Remove expired entries, then least recently used ones beyond max_bytes
+
+        Returns:
+            Number of entries removed
+        """
+        entries = []
+        for path in self.directory.glob('*/*' + self.suffix):
+            if path.name.startswith('.tmp-'):
+                continue
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        cutoff = time.time() - self.max_age if self.max_age is not None else None
+        removed = 0
+
+        for mtime, size, path in entries:
+            expired = cutoff is not None and mtime < cutoff
+            over_size = self.max_bytes is not None and total > self.max_bytes
+            if not expired and not over_size:
+                break
+            try:
+                os.remove(path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+            total -= size
+
+        with self._lock:
+            self.evictions += removed
+            self._approx_size = total
+            self._writes_since_scan = 0
+        return removed
+
+    def clear(self) -> None:
+        """Remove every entry"""
+        for path in self.directory.glob('*/*' + self.suffix):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        with self._lock:
+            self._approx_size = 0
+
+    def stats(self) -> Dict[str, float]:
+        """Return hit/miss counters and the hit rate"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'writes': self.writes,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
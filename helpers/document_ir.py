@@ -0,0 +1,696 @@
+"""Backend-neutral document representation for Obsidian markdown
+
+The PDF path converts Obsidian syntax with obsidian_preprocessor.py, the DOCX
+path converts it again with obsidian_to_html.py, and each then runs its own
+Mermaid and page break passes over the result. This module parses a document
+once into a flat list of blocks: text runs plus small slotted nodes for the
+Obsidian constructs (callouts, checkboxes, tables, Mermaid diagrams, page
+breaks, highlights). Each output format is an emitter walking that list
+(see MarkdownEmitter), so a document converted to both formats is parsed once
+and a new format only needs a new emitter.
+
+The parser applies the same line rules as the text pipelines (line breaks
+between consecutive bold lines, blank lines before lists, callout grouping,
+checkbox conversion) but it is structure-aware: fenced code blocks, Mermaid
+diagrams and YAML frontmatter are kept verbatim, and inline markup is resolved
+paragraph by paragraph, like the streaming pipelines.
+"""
+
+import itertools
+import re
+from abc import ABC, abstractmethod
+from typing import AbstractSet, Callable, Iterable, Iterator, List, Optional, TextIO, Union
+
+from .block_cache import PIPELINE_VERSION, BlockCache
+from .disk_cache import content_key
+from .feature_sniffer import select_stages, sniff_features
+from .inline_scanner import HIGHLIGHT, UNDERLINE, find_spans, resolve_links
+from .line_engine import CALLOUT_START_PATTERN, CODE_FENCES, LIST_ITEM_PATTERN, iter_source_lines
+from .page_break_handler import is_page_break_marker
+from .table_width_optimizer import (
+    calculate_column_widths,
+    is_table_separator,
+    iter_longtable_lines,
+    parse_pipe_table,
+)
+from .yaml_stripper import FRONTMATTER_MAX_LINES
+
+
+# Compiled checkbox pattern (shared with the text pipelines)
+CHECKBOX_PATTERN = re.compile(r'^(\s*)- \[(.)\] (.+)$')
+
+# Parser stages with the features that trigger them (see feature_sniffer.py).
+# Resolving links can join text into a new checkbox or inline span.
+IR_STAGES = (
+    ('parse_tables', ('tables',)),
+    ('parse_callouts', ('callouts',)),
+    ('parse_checkboxes', ('checkboxes', 'wikilinks')),
+    ('resolve_links', ('wikilinks',)),
+    ('parse_inline', ('highlights', 'underline', 'wikilinks')),
+    ('fix_consecutive_bold_lines', ('bold_lines',)),
+    ('fix_list_blank_lines', ()),
+    ('convert_page_breaks', ('page_breaks',)),
+)
+
+# Without Obsidian syntax only page breaks are recognized
+BASE_IR_STAGES = (
+    ('convert_page_breaks', ('page_breaks',)),
+)
+
+
+class Node:
+    """Base class of IR nodes: slotted, compared and printed by field"""
+
+    __slots__ = ()
+    tag = ''
+
+    @classmethod
+    def fields(cls) -> List[str]:
+        """Public field names (private slots are caches)"""
+        return [name for name in cls.__slots__ if not name.startswith('_')]
+
+    def __eq__(self, other):
+        return type(self) is type(other) and all(
+            getattr(self, name) == getattr(other, name) for name in self.fields())
+
+    def __repr__(self):
+        values = ', '.join(f'{name}={getattr(self, name)!r}' for name in self.fields())
+        return f'{type(self).__name__}({values})'
+
+
+# Inline content is a list of plain strings and Highlight/Underline nodes
+Inline = Union[str, 'Highlight', 'Underline']
+
+
+class Highlight(Node):
+    """==highlighted text=="""
+    __slots__ = ('parts',)
+    tag = 'highlight'
+
+    def __init__(self, parts: List[Inline]):
+        self.parts = parts
+
+
+class Underline(Node):
+    """<u>underlined text</u>"""
+    __slots__ = ('parts',)
+    tag = 'underline'
+
+    def __init__(self, parts: List[Inline]):
+        self.parts = parts
+
+
+INLINE_NODES = {HIGHLIGHT: Highlight, UNDERLINE: Underline}
+
+
+class Text(Node):
+    """A paragraph of plain markdown lines, followed by any blank lines"""
+    __slots__ = ('parts',)
+    tag = 'text'
+
+    def __init__(self, parts: List[Inline]):
+        self.parts = parts
+
+
+class Frontmatter(Node):
+    """YAML frontmatter at the start of the document, kept verbatim"""
+    __slots__ = ('lines',)
+    tag = 'frontmatter'
+
+    def __init__(self, lines: List[str]):
+        self.lines = lines
+
+
+class CodeBlock(Node):
+    """Fenced code block, fence lines included"""
+    __slots__ = ('lines',)
+    tag = 'code_block'
+
+    def __init__(self, lines: List[str]):
+        self.lines = lines
+
+
+class Mermaid(Node):
+    """```mermaid block; lines are kept for backends that do not render it"""
+    __slots__ = ('code', 'lines')
+    tag = 'mermaid'
+
+    def __init__(self, code: str, lines: List[str]):
+        self.code = code
+        self.lines = lines
+
+
+class Table(Node):
+    """Pipe table with at least one data row"""
+    __slots__ = ('headers', 'rows', 'lines', '_widths')
+    tag = 'table'
+
+    def __init__(self, headers: List[str], rows: List[List[str]], lines: List[str]):
+        self.headers = headers
+        self.rows = rows
+        self.lines = lines
+        self._widths = None
+
+    def column_widths(self, cache: Optional[BlockCache] = None) -> List[float]:
+        """Return the optimized column width ratios (computed once)
+
+        Args:
+            cache: Optional block cache shared between conversions
+        """
+        if self._widths is not None:
+            return self._widths
+
+        key = None
+        if cache is not None:
+            key = content_key(PIPELINE_VERSION, 'table-widths', '\n'.join(self.lines))
+            cached = cache.get(key)
+            if cached is not None:
+                self._widths = [float(width) for width in cached.split()]
+                return self._widths
+
+        self._widths = calculate_column_widths([self.headers] + self.rows)
+        if key is not None:
+            cache.put(key, ' '.join(str(width) for width in self._widths))
+        return self._widths
+
+    def iter_latex_lines(self, cache: Optional[BlockCache] = None) -> Iterator[str]:
+        """Yield the table as a raw LaTeX longtable block, row by row
+
+        Very large tables are split into chained longtables (see
+        table_width_optimizer.iter_longtable_lines).
+
+        Args:
+            cache: Optional block cache for the column widths
+        """
+        return iter_longtable_lines(self.headers, self.rows, self.column_widths(cache))
+
+
+class Callout(Node):
+    """> [!type] Title callout, with inline content of its > lines (empty list if none)"""
+    __slots__ = ('kind', 'title', 'content')
+    tag = 'callout'
+
+    def __init__(self, kind: str, title: List[Inline], content: List[Inline]):
+        self.kind = kind
+        self.title = title
+        self.content = content
+
+
+class Checkbox(Node):
+    """- [x] task line (any Obsidian checkbox type)"""
+    __slots__ = ('indent', 'mark', 'parts')
+    tag = 'checkbox'
+
+    def __init__(self, indent: str, mark: str, parts: List[Inline]):
+        self.indent = indent
+        self.mark = mark
+        self.parts = parts
+
+
+class LineBreak(Node):
+    """Explicit line break between two consecutive bold lines"""
+    __slots__ = ()
+    tag = 'line_break'
+
+
+class PageBreak(Node):
+    """Page break marker line (<!-- pagebreak -->, \\newpage, ...)
+
+    list_follows is set when a list item follows directly, in which case
+    backends keeping the marker line need a blank line after it.
+    """
+    __slots__ = ('marker', 'list_follows')
+    tag = 'page_break'
+
+    def __init__(self, marker: str, list_follows: bool = False):
+        self.marker = marker
+        self.list_follows = list_follows
+
+
+class Document(Node):
+    """Parsed document: top-level blocks in order
+
+    features holds the constructs detected by feature_sniffer.sniff_features
+    (None when the source was not sniffed).
+    """
+    __slots__ = ('blocks', 'obsidian', 'features')
+    tag = 'document'
+
+    def __init__(self, blocks: List[Node], obsidian: bool = True,
+                 features: Optional[AbstractSet[str]] = None):
+        self.blocks = blocks
+        self.obsidian = obsidian
+        self.features = features
+
+
+def mermaid_codes(document: Document) -> List[str]:
+    """Return the source of every Mermaid diagram of a document, in order"""
+    return [block.code for block in document.blocks if isinstance(block, Mermaid)]
+
+
+def prescan_mermaid_codes(source: TextIO, obsidian: bool = True) -> Optional[List[str]]:
+    """Return the source of every Mermaid diagram of a seekable stream, in order
+
+    The stream is parsed without the Obsidian stages (only fences and
+    frontmatter matter) and rewound, so it can still be streamed through the
+    pipeline afterwards with its diagrams rendered in one batch.
+
+    Args:
+        source: Text file object
+        obsidian: Obsidian setting the stream will be parsed with
+
+    Returns:
+        Diagram sources, or None when the stream cannot be rewound
+    """
+    seekable = getattr(source, 'seekable', None)
+    if not callable(seekable) or not seekable():
+        return None
+    position = source.tell()
+    try:
+        blocks = iter_blocks(iter_source_lines(source), obsidian, frozenset())
+        return [block.code for block in blocks if isinstance(block, Mermaid)]
+    finally:
+        source.seek(position)
+
+
+def parse_inline(text: str) -> List[Inline]:
+    """Split text into plain strings and Highlight/Underline nodes
+
+    Highlights and underlines may nest in either order. An underline crossing
+    a highlight boundary is left as plain text.
+
+    Args:
+        text: Text with wikilinks already resolved
+
+    Returns:
+        List of inline parts
+    """
+    highlights = '==' in text
+    underlines = '<u>' in text
+    spans = find_spans(text, highlights, underlines) if highlights or underlines else None
+    if not spans:
+        return [text]
+    return _build_inline(text, 0, len(text), spans)
+
+
+def _build_inline(text: str, start: int, end: int, spans: list) -> List[Inline]:
+    """Build inline parts for text[start:end] from spans sorted by start"""
+    parts = []
+    position = start
+    index = 0
+    while index < len(spans):
+        span_start, span_end, inner_start, inner_end, kind = spans[index]
+        # Spans starting inside this one are nested in it (or cross it and are dropped)
+        nested_end = index + 1
+        while nested_end < len(spans) and spans[nested_end][0] < span_end:
+            nested_end += 1
+        nested = [span for span in spans[index + 1:nested_end] if span[1] <= span_end]
+
+        if span_start > position:
+            parts.append(text[position:span_start])
+        parts.append(INLINE_NODES[kind](_build_inline(text, inner_start, inner_end, nested)))
+        position = span_end
+        index = nested_end
+
+    if position < end or not parts:
+        parts.append(text[position:end])
+    return parts
+
+
+def parse_stages(features: Optional[AbstractSet[str]], obsidian: bool = True) -> List[str]:
+    """Return the parser stages to run for the detected features
+
+    Args:
+        features: Detected features, or None when unknown (every stage runs)
+        obsidian: Whether Obsidian syntax is parsed
+
+    Returns:
+        Stage names in order (see IR_STAGES)
+    """
+    return select_stages(IR_STAGES if obsidian else BASE_IR_STAGES, features)
+
+
+def conversion_stages(features: Optional[AbstractSet[str]], obsidian: bool = True,
+                      render_mermaid: bool = True) -> List[str]:
+    """Return the parser stages plus 'render_mermaid' when diagrams are rendered
+
+    Args:
+        features: Detected features, or None when unknown
+        obsidian: Whether Obsidian syntax is parsed
+        render_mermaid: Whether the converter renders Mermaid diagrams
+
+    Returns:
+        Stage names in order
+    """
+    stages = parse_stages(features, obsidian)
+    if render_mermaid and (features is None or 'mermaid' in features):
+        stages.append('render_mermaid')
+    return stages
+
+
+def _make_text(paragraph: List[str], blanks: List[str], inline: bool) -> Text:
+    """Build a Text node from paragraph lines and the blank lines after them"""
+    if not paragraph:
+        return Text(['\n'.join(blanks)])
+
+    text = '\n'.join(paragraph)
+    parts = parse_inline(resolve_links(text)) if inline else [text]
+    if blanks:
+        parts.append(''.join('\n' + blank for blank in blanks))
+    return Text(parts)
+
+
+def _match_checkbox(line: str) -> Optional[Checkbox]:
+    """Return a Checkbox node if the line is a task line"""
+    match = CHECKBOX_PATTERN.match(resolve_links(line))
+    if not match:
+        return None
+    indent, mark, text = match.groups()
+    return Checkbox(indent, mark, parse_inline(text))
+
+
+class _BlockParser:
+    """Line rule state of iter_blocks between top-level blocks"""
+
+    def __init__(self, obsidian: bool, stages: List[str]):
+        self.obsidian = obsidian
+        self.inline = 'resolve_links' in stages or 'parse_inline' in stages
+        self.checkboxes = 'parse_checkboxes' in stages
+        self.bold_lines = 'fix_consecutive_bold_lines' in stages
+        self.page_breaks = 'convert_page_breaks' in stages
+        self.paragraph = []
+        self.blanks = []
+        self.prev_bold = False
+        self.prev_blank_or_list = False
+        self.has_prev = False
+
+    def flush(self) -> Iterator[Node]:
+        """Yield the pending paragraph, if any"""
+        if self.paragraph or self.blanks:
+            yield _make_text(self.paragraph, self.blanks, self.inline)
+            self.paragraph = []
+            self.blanks = []
+
+    def block(self, node: Node, ends_blank: bool = False) -> Iterator[Node]:
+        """Yield a block node after the pending paragraph
+
+        Args:
+            node: Block node
+            ends_blank: Whether the block's output ends with a blank line
+        """
+        yield from self.flush()
+        yield node
+        self.prev_bold = False
+        self.prev_blank_or_list = ends_blank
+        self.has_prev = True
+
+    def line(self, line: str, following: Optional[str]) -> Iterator[Node]:
+        """Handle a line outside code blocks, tables and callouts
+
+        Args:
+            line: Current line
+            following: Next line of the document, None at the end
+        """
+        stripped = line.strip()
+        if not stripped:
+            # Blank lines are kept as-is (they may hold whitespace)
+            self.blanks.append(line)
+            self.prev_bold = False
+            self.prev_blank_or_list = True
+            self.has_prev = True
+            return
+
+        if self.page_breaks and stripped[:1] in ('<', '\\') and is_page_break_marker(line):
+            list_follows = (self.obsidian and following is not None
+                            and LIST_ITEM_PATTERN.match(following) is not None)
+            yield from self.block(PageBreak(line, list_follows), ends_blank=True)
+            return
+
+        if not self.obsidian:
+            if self.blanks:
+                yield from self.flush()
+            self.paragraph.append(line)
+            return
+
+        # Explicit line break between consecutive bold lines
+        is_bold_start = self.bold_lines and line.startswith('**') and line.find('**', 3) != -1
+        if is_bold_start and self.prev_bold:
+            yield from self.flush()
+            yield LineBreak()
+
+        # Blank line before a list that follows other content
+        is_list_item = LIST_ITEM_PATTERN.match(line) is not None
+        if is_list_item and self.has_prev and not self.prev_blank_or_list:
+            self.blanks.append('')
+
+        self.prev_bold = is_bold_start
+        self.prev_blank_or_list = is_list_item
+        self.has_prev = True
+
+        if self.checkboxes and '- [' in line:
+            checkbox = _match_checkbox(line)
+            if checkbox is not None:
+                yield from self.flush()
+                yield checkbox
+                return
+
+        if self.blanks:
+            yield from self.flush()
+        self.paragraph.append(line)
+
+
+def iter_blocks(lines: Iterable[str], obsidian: bool = True,
+                features: Optional[AbstractSet[str]] = None) -> Iterator[Node]:
+    """Parse markdown lines into top-level IR blocks
+
+    Only the block being collected is held in memory, so this also serves
+    the streaming conversions.
+
+    Args:
+        lines: Markdown lines (without trailing newlines)
+        obsidian: Whether to parse Obsidian syntax. When False only code
+            blocks, Mermaid diagrams and page breaks are recognized.
+        features: Features detected in the whole document; the stages they
+            do not trigger are skipped. None runs every stage.
+
+    Yields:
+        Block nodes
+    """
+    lines = iter(lines)
+    stages = parse_stages(features, obsidian)
+    parser = _BlockParser(obsidian, stages)
+    tables = 'parse_tables' in stages
+    callouts = 'parse_callouts' in stages
+
+    line = next(lines, None)
+    if line is not None and line.strip() == '---':
+        # Frontmatter only when closed within FRONTMATTER_MAX_LINES, otherwise
+        # the buffered lines are parsed as ordinary content
+        frontmatter = [line]
+        for next_line in itertools.islice(lines, FRONTMATTER_MAX_LINES):
+            frontmatter.append(next_line)
+            if next_line.strip() == '---':
+                yield from parser.block(Frontmatter(frontmatter))
+                line = next(lines, None)
+                break
+        else:
+            lines = itertools.chain(frontmatter[1:], lines)
+
+    following = next(lines, None) if line is not None else None
+    while line is not None:
+        stripped = line.strip()
+
+        if stripped.startswith(CODE_FENCES):
+            # Fenced code block, closed by a fence starting with the same characters
+            fence = stripped[:3]
+            block = [line]
+            closed = False
+            while following is not None and not closed:
+                block.append(following)
+                closed = following.strip().startswith(fence)
+                following = next(lines, None)
+
+            if closed and stripped == '```mermaid':
+                node = Mermaid('\n'.join(block[1:-1]).strip(), block)
+            else:
+                node = CodeBlock(block)
+            yield from parser.block(node)
+
+        elif (tables and stripped.startswith('|')
+              and following is not None and is_table_separator(following)):
+            table_lines = [line, following]
+            following = next(lines, None)
+            while following is not None and following.strip().startswith('|'):
+                table_lines.append(following)
+                following = next(lines, None)
+
+            headers, rows = parse_pipe_table('\n'.join(table_lines))
+            if headers and rows:
+                yield from parser.block(Table(headers, rows, table_lines), ends_blank=True)
+            else:
+                # Failed to parse, keep the lines as text
+                for index, table_line in enumerate(table_lines):
+                    next_line = table_lines[index + 1] if index + 1 < len(table_lines) else following
+                    yield from parser.line(table_line, next_line)
+
+        elif callouts and line.startswith('>') and CALLOUT_START_PATTERN.match(line):
+            match = CALLOUT_START_PATTERN.match(line)
+            kind = match.group(1).lower()
+            title = match.group(2) or kind.capitalize()
+
+            # Collect > lines up to the next non-quote line or callout start
+            content = []
+            while (following is not None and following.startswith('>')
+                   and not CALLOUT_START_PATTERN.match(following)):
+                content.append(following[1:].lstrip())
+                following = next(lines, None)
+
+            content = parse_inline(resolve_links('\n'.join(content))) if content else []
+            callout = Callout(kind, parse_inline(resolve_links(title)), content)
+            yield from parser.block(callout)
+
+        else:
+            yield from parser.line(line, following)
+
+        line = following
+        following = next(lines, None) if line is not None else None
+
+    yield from parser.flush()
+
+
+def parse_document(source: Union[str, TextIO, Iterable[str]], obsidian: bool = True) -> Document:
+    """Parse a document into its IR
+
+    A document string is sniffed first (see feature_sniffer.py) so the parser
+    skips the stages it does not need; other sources run every stage.
+
+    Args:
+        source: Document string, text file object or iterable of lines
+        obsidian: Whether to parse Obsidian syntax
+
+    Returns:
+        Parsed Document
+    """
+    features = sniff_features(source) if isinstance(source, str) else None
+    blocks = list(iter_blocks(iter_source_lines(source), obsidian, features))
+    return Document(blocks, obsidian, features)
+
+
+# Callback rendering a Mermaid diagram: (code, diagram_id) -> replacement
+# markdown, or None to keep the code block
+MermaidRenderer = Callable[[str, int], Optional[str]]
+
+
+class MarkdownEmitter(ABC):
+    """Walk IR blocks and produce the markdown one backend feeds its renderer
+
+    Subclasses set the inline markup and implement the Obsidian constructs
+    their backend renders differently (line breaks, checkboxes, callouts,
+    page breaks). Text, frontmatter, code and tables are shared.
+    """
+
+    HIGHLIGHT = ('==', '==')
+    UNDERLINE = ('<u>', '</u>')
+
+    # Blocks whose emitted lines are memoized in the block cache. Tables
+    # cache their column widths instead (their rows are streamed), rendered
+    # Mermaid diagrams have their own cache and the other nodes are one line.
+    CACHED_BLOCKS = frozenset({'text', 'callout', 'code_block'})
+
+    def __init__(self, obsidian: bool = True, mermaid: Optional[MermaidRenderer] = None,
+                 cache: Optional[BlockCache] = None):
+        """
+        Initialize emitter
+
+        Args:
+            obsidian: Whether Obsidian syntax is converted (must match the parse)
+            mermaid: Optional callback replacing Mermaid diagrams
+            cache: Optional block cache; unchanged blocks reuse their output
+        """
+        self.obsidian = obsidian
+        self.mermaid = mermaid
+        self.cache = cache
+        self.diagram_count = 0
+
+    def emit(self, document: Document) -> str:
+        """Return the whole document as markdown text"""
+        return '\n'.join(self.iter_lines(document.blocks))
+
+    def iter_lines(self, blocks: Iterable[Node]) -> Iterator[str]:
+        """Yield the markdown lines of a stream of blocks"""
+        for block in blocks:
+            if self.cache is not None and block.tag in self.CACHED_BLOCKS:
+                yield from self._emit_cached(block)
+            else:
+                yield from getattr(self, 'emit_' + block.tag)(block)
+
+    def cache_scope(self) -> str:
+        """Return the emitter settings a block's output depends on (part of its cache key)"""
+        return f'{type(self).__name__}:{self.obsidian}'
+
+    def _emit_cached(self, block: Node) -> List[str]:
+        """Emit a block through the block cache, keyed by its content and the pipeline version"""
+        key = content_key(PIPELINE_VERSION, self.cache_scope(), repr(block))
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached.split('\n')
+        lines = getattr(self, 'emit_' + block.tag)(block)
+        self.cache.put(key, '\n'.join(lines))
+        return lines
+
+    def render_inline(self, parts: List[Inline]) -> str:
+        """Render inline parts with this backend's markup"""
+        if len(parts) == 1 and isinstance(parts[0], str):
+            return parts[0]
+
+        rendered = []
+        for part in parts:
+            if isinstance(part, str):
+                rendered.append(part)
+            else:
+                opening, closing = self.HIGHLIGHT if isinstance(part, Highlight) else self.UNDERLINE
+                rendered.append(opening + self.render_inline(part.parts) + closing)
+        return ''.join(rendered)
+
+    def emit_text(self, node: Text) -> List[str]:
+        return self.render_inline(node.parts).split('\n')
+
+    def emit_frontmatter(self, node: Frontmatter) -> List[str]:
+        return node.lines
+
+    def emit_code_block(self, node: CodeBlock) -> List[str]:
+        return node.lines
+
+    def emit_mermaid(self, node: Mermaid) -> List[str]:
+        diagram_id = self.diagram_count
+        self.diagram_count += 1
+
+        replacement = self.mermaid(node.code, diagram_id) if self.mermaid else None
+        if replacement is None:
+            return self.emit_code_block(node)
+        return replacement.split('\n')
+
+    def emit_table(self, node: Table) -> Iterator[str]:
+        # Rows are streamed, so a huge table is never held as text
+        for line in self.table_lines(node.iter_latex_lines(self.cache)):
+            yield self.render_inline(parse_inline(resolve_links(line)))
+
+    def table_lines(self, lines: Iterable[str]) -> Iterable[str]:
+        """Hook adjusting a converted table's lines before inline markup"""
+        return lines
+
+    @abstractmethod
+    def emit_line_break(self, node: LineBreak) -> List[str]:
+        """Lines of a LineBreak node in this backend's markup"""
+
+    @abstractmethod
+    def emit_checkbox(self, node: Checkbox) -> List[str]:
+        """Lines of a Checkbox node in this backend's markup"""
+
+    @abstractmethod
+    def emit_callout(self, node: Callout) -> List[str]:
+        """Lines of a Callout node in this backend's markup"""
+
+    @abstractmethod
+    def emit_page_break(self, node: PageBreak) -> List[str]:
+        """Lines of a PageBreak node in this backend's markup"""
@@ -7,42 +7,77 @@ from docx.shared import Pt, Inches
 from bs4 import BeautifulSoup
 from io import BytesIO
 from .text_formatter import add_formatted_text
-from .mermaid_docx_handler import extract_mermaid_and_render
-from .page_break_handler import convert_page_breaks_to_placeholder
-from .obsidian_to_html import preprocess_obsidian_for_html
+from .mermaid_docx_handler import mermaid_placeholder_renderer
+from .mermaid_renderer import get_renderer_version, mermaid_renderer_available
+from .artifact_cache import (artifact_cache_enabled, artifact_key, cached_artifact, package_versions,
+                             source_digest)
+from .obsidian_to_html import HtmlMarkdownEmitter
+from .document_ir import Document as ParsedDocument, conversion_stages, mermaid_codes, parse_document
+from .feature_sniffer import record_report
+from .block_cache import get_default_block_cache
 
 
-def convert_to_docx(markdown_content, render_mermaid=True, obsidian_mode=True):
+def convert_to_docx(markdown_content, render_mermaid=True, obsidian_mode=True, report=None):
     """Convert Markdown content to DOCX format
 
     Args:
-        markdown_content: The markdown content to convert
+        markdown_content: The markdown content to convert, or a Document parsed
+            with document_ir.parse_document (its obsidian setting is used)
         render_mermaid: Whether to render Mermaid diagrams (default: True)
         obsidian_mode: Whether to preprocess Obsidian syntax (default: True)
+        report: Optional dict receiving the detected 'features' and the 'stages' that
+            ran, and 'artifact_cache': 'hit', 'miss', 'shared' or 'bypass'
 
     Returns:
-        BytesIO buffer containing the DOCX document
+        BytesIO buffer containing the DOCX document (cached for Markdown
+        strings, see artifact_cache)
     """
-    # Preprocess Obsidian syntax if enabled (like PDF converter)
-    if obsidian_mode:
-        # Note: We use HTML-specific preprocessing for DOCX output
-        # (unlike PDF which uses LaTeX-based preprocessing)
-        # This ensures callouts, checkboxes, etc. render properly in Word
-        markdown_content = preprocess_obsidian_for_html(markdown_content)
-
-    # Handle Mermaid diagrams if enabled
+    digest = source_digest(markdown_content) if artifact_cache_enabled() else None
+    if digest is None:
+        if report is not None:
+            report['artifact_cache'] = 'bypass'
+        return _convert_to_docx(markdown_content, render_mermaid, obsidian_mode, report)
+
+    key = artifact_key('docx', digest, {'render_mermaid': render_mermaid, 'obsidian_mode': obsidian_mode}, {
+        'packages': package_versions('python-docx', 'Markdown', 'beautifulsoup4', 'Pygments'),
+        'mermaid': get_renderer_version() if render_mermaid else None,
+    })
+
+    def build():
+        build_report = {}
+        buffer = _convert_to_docx(markdown_content, render_mermaid, obsidian_mode, build_report)
+        return buffer.getvalue(), build_report
+
+    return BytesIO(cached_artifact(key, build, report))
+
+
+def _convert_to_docx(markdown_content, render_mermaid, obsidian_mode, report):
+    """Run the DOCX pipeline (see convert_to_docx)"""
+    if isinstance(markdown_content, ParsedDocument):
+        document = markdown_content
+    else:
+        document = parse_document(markdown_content, obsidian=obsidian_mode)
+
+    stages = conversion_stages(document.features, document.obsidian, render_mermaid)
+    if 'render_mermaid' in stages and not mermaid_renderer_available():
+        print("Warning: No Mermaid renderer available (mmdc not installed); diagrams are kept as code blocks")
+        stages.remove('render_mermaid')
+    record_report(report, document.features, stages)
+
+    # Obsidian syntax, Mermaid diagrams and page break markers are converted
+    # by one walk of the IR. We use HTML-specific output for DOCX (unlike PDF
+    # which uses LaTeX) so callouts, checkboxes, etc. render properly in Word
     diagram_images = {}
-    if render_mermaid:
-        try:
-            markdown_content, diagram_images = extract_mermaid_and_render(markdown_content)
-            if diagram_images:
-                print(f"Rendered {len(diagram_images)} Mermaid diagrams")
-        except Exception as e:
-            print(f"Warning: Mermaid rendering disabled due to error: {e}")
-
-    # Preprocess page break markers before HTML conversion
-    # Using shared module for consistency with PDF converter
-    markdown_content = convert_page_breaks_to_placeholder(markdown_content)
+    emitter = HtmlMarkdownEmitter(
+        obsidian=document.obsidian,
+        mermaid=(mermaid_placeholder_renderer(diagram_images, mermaid_codes(document))
+                 if 'render_mermaid' in stages else None),
+        cache=get_default_block_cache(),
+        page_break='|||PAGEBREAK|||'
+    )
+    markdown_content = emitter.emit(document)
+    if diagram_images:
+        print(f"Rendered {len(diagram_images)} Mermaid diagrams")
 
     # Convert markdown to HTML first
     html_content = markdown.markdown(
@@ -0,0 +1,269 @@
+"""Replace emoji with cached images in the PDF pipeline
+
+Typesetting emoji through LuaLaTeX's color font fallback (mode=harf) is one
+of the slowest parts of a compile, and the checkbox and callout mappings
+inject many of them. With $PDF_EMOJI_IMAGES=1 every emoji of the
+preprocessed text becomes an inline \\includegraphics of a small PNG, so the
+document needs no emoji font (and plain text otherwise compiles with
+pdfLaTeX, see latex_engine.py).
+
+Each PNG is made once, from the local emoji image set in $EMOJI_IMAGE_DIR
+(Twemoji, Noto or OpenMoji style names such as 1f4a1.png or
+emoji_u1f4a1.png) or else rasterized from the emoji font font_resolver
+found, and kept in a DiskCache shared by every document and process.
+Emoji without an image are left as text for the font fallback, and so is
+everything inside code.
+"""
+
+import os
+import re
+import threading
+from io import BytesIO
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from PIL import Image, ImageDraw, ImageFont, features
+
+from .disk_cache import DiskCache, content_key, default_cache_dir
+from .font_resolver import get_font_map
+from .line_engine import CODE_FENCES
+
+
+# Bump when the way images are made changes
+EMOJI_RECIPE_VERSION = '1'
+
+# Environment variables: '1' enables the mode, the image set, the cache directory
+EMOJI_IMAGES_ENV = 'PDF_EMOJI_IMAGES'
+EMOJI_IMAGE_DIR_ENV = 'EMOJI_IMAGE_DIR'
+EMOJI_CACHE_DIR_ENV = 'EMOJI_CACHE_DIR'
+
+# Height of the cached images in pixels (crisp at 1em up to ~20pt)
+EMOJI_IMAGE_SIZE = 72
+
+# Bitmap strike sizes of color emoji fonts (Noto: 109, Apple: 160, ...)
+EMOJI_FONT_SIZES = (109, 160, 137, 96, 64, 48, 40, 32, 20)
+
+# LaTeX replacing an emoji, sized and placed like a glyph
+EMOJI_LATEX = '\\texorpdfstring{\\raisebox{-0.15em}{\\includegraphics[height=1em]{%s}}}{}'
+
+# Characters below U+1F000 shown as emoji without a variation selector
+BMP_EMOJI = (
+    '⌚⌛⏩-⏬⏰⏳◽◾☔☕♈-♓♿⚓'
+    '⚡⚪⚫⚽⚾⛄⛅⛎⛔⛪⛲⛳⛵⛺⛽'
+    '✅✊✋✨❌❎❓-❕❗➕-➗➰➿'
+    '⬛⬜⭐⭕'
+)
+_EMOJI_UNIT = (
+    f'(?:[\U0001F000-\U0001FAFF{BMP_EMOJI}]|[\u00a9\u00ae\u2000-\u33ff](?=\ufe0f))'
+    '\ufe0f?[\U0001F3FB-\U0001F3FF]?'
+)
+# Flags, keycaps, and emoji with their modifiers and ZWJ sequences
+EMOJI_PATTERN = re.compile(
+    f'[\U0001F1E6-\U0001F1FF]{{2}}|[#*0-9]\ufe0f?\u20e3|{_EMOJI_UNIT}(?:\u200d{_EMOJI_UNIT})*')
+
+INLINE_CODE_PATTERN = re.compile(r'(`+).*?\1')
+RAW_BLOCK_PATTERN = re.compile(r'^\s*(?:```|~~~)\{=latex\}')
+
+
+def emoji_images_enabled() -> bool:
+    """Whether PDFs use emoji images ($PDF_EMOJI_IMAGES=1)"""
+    return os.environ.get(EMOJI_IMAGES_ENV, '0') == '1'
+
+
+def emoji_codepoints(emoji: str) -> List[str]:
+    """Return the lowercase hex code points of an emoji sequence"""
+    return [f'{ord(character):x}' for character in emoji]
+
+
+def find_emoji_image(emoji: str, directory: str) -> Optional[str]:
+    """Find the PNG of an emoji in an image set directory
+
+    Tries the Twemoji/OpenMoji ('1f44d-1f3fb.png') and Noto
+    ('emoji_u1f44d_1f3fb.png') names, with and without variation selectors.
+    """
+    codepoints = emoji_codepoints(emoji)
+    variants = [codepoints, [point for point in codepoints if point != 'fe0f']]
+    for points in variants:
+        for name in ('-'.join(points), 'emoji_u' + '_'.join(points), '-'.join(points).upper()):
+            path = os.path.join(directory, name + '.png')
+            if os.path.exists(path):
+                return path
+    return None
+
+
+def _scaled_png(image: Image.Image) -> bytes:
+    """Crop an emoji image to its content and scale it to EMOJI_IMAGE_SIZE high"""
+    image = image.convert('RGBA')
+    box = image.getbbox()
+    if box:
+        image = image.crop(box)
+    width = max(1, round(image.width * EMOJI_IMAGE_SIZE / image.height))
+    buffer = BytesIO()
+    image.resize((width, EMOJI_IMAGE_SIZE), Image.Resampling.LANCZOS).save(buffer, 'PNG', optimize=True)
+    return buffer.getvalue()
+
+
+def rasterize_emoji(emoji: str, font_path: str, index: int = 0) -> Optional[bytes]:
+    """Draw an emoji with a color emoji font
+
+    Multi-character sequences need text shaping (Pillow built with raqm).
+
+    Returns:
+        PNG bytes, or None when the font cannot draw it
+    """
+    base = emoji.replace('\ufe0f', '')
+    layout = ImageFont.Layout.RAQM if features.check('raqm') else ImageFont.Layout.BASIC
+    if len(base) > 1 and layout != ImageFont.Layout.RAQM:
+        return None
+    for size in EMOJI_FONT_SIZES:
+        try:
+            font = ImageFont.truetype(font_path, size, index=index, layout_engine=layout)
+            box = font.getbbox(emoji)
+        except OSError:
+            # Color bitmap fonts only open at their strike sizes
+            continue
+        if box[2] <= box[0] or box[3] <= box[1]:
+            return None
+        image = Image.new('RGBA', (box[2] - box[0], box[3] - box[1]))
+        ImageDraw.Draw(image).text((-box[0], -box[1]), emoji, font=font, embedded_color=True)
+        if image.getbbox() is None:
+            return None
+        return _scaled_png(image)
+    return None
+
+
+class EmojiImages:
+    """Cached emoji images, made once per emoji and image source"""
+
+    def __init__(self, cache: DiskCache, image_dir: Optional[str] = None,
+                 font_file: Optional[tuple] = None):
+        """
+        Initialize emoji images
+
+        Args:
+            cache: DiskCache holding the PNGs
+            image_dir: Local emoji image set, looked up first
+            font_file: (path, index) of a color emoji font to rasterize from
+        """
+        self.cache = cache
+        self.image_dir = image_dir
+        self.font_file = font_file
+        self._paths: Dict[str, Optional[str]] = {}
+        self._lock = threading.Lock()
+
+    def source_id(self) -> str:
+        """Identify the image sources (a different set or font makes new images)"""
+        return f'{self.image_dir}|{self.font_file}'
+
+    def path(self, emoji: str) -> Optional[str]:
+        """Return the path of an emoji's cached PNG, making it on first use
+
+        Returns:
+            Absolute path, or None when no source has the emoji
+        """
+        with self._lock:
+            if emoji in self._paths:
+                return self._paths[emoji]
+
+        key = content_key('emoji', EMOJI_RECIPE_VERSION, self.source_id(), emoji)
+        cached = self.cache.get_path(key)
+        if cached is None:
+            data = self._make(emoji)
+            cached = self.cache.put(key, data) if data is not None else None
+        path = str(cached) if cached is not None else None
+
+        with self._lock:
+            self._paths[emoji] = path
+        return path
+
+    def _make(self, emoji: str) -> Optional[bytes]:
+        """Make the PNG of an emoji from the image set or the font"""
+        if self.image_dir:
+            source = find_emoji_image(emoji, self.image_dir)
+            if source is not None:
+                try:
+                    with Image.open(source) as image:
+                        return _scaled_png(image)
+                except OSError as e:
+                    print(f"Warning: Could not read emoji image {source}: {e}")
+        if self.font_file:
+            return rasterize_emoji(emoji, *self.font_file)
+        return None
+
+    def iter_lines(self, lines: Iterable[str], stats: Optional[dict] = None) -> Iterator[str]:
+        """Replace the emoji of Markdown lines with image includes
+
+        Code blocks and inline code keep their emoji. Inside raw LaTeX blocks
+        (callouts) the include is written as LaTeX, elsewhere as an inline
+        raw LaTeX span.
+
+        Args:
+            lines: Lines of the preprocessed Markdown
+            stats: Optional dict receiving counts of 'replaced' and 'kept' emoji
+        """
+        fence = None
+        raw = False
+        for line in lines:
+            stripped = line.lstrip()
+            if fence is not None:
+                if stripped.startswith(fence):
+                    fence = None
+                elif raw:
+                    line = self._replace(line, stats, raw=True)
+                yield line
+                continue
+            if stripped.startswith(CODE_FENCES):
+                fence = stripped[:3]
+                raw = RAW_BLOCK_PATTERN.match(line) is not None
+                yield line
+                continue
+
+            # Leave inline code spans alone
+            parts = []
+            position = 0
+            for match in INLINE_CODE_PATTERN.finditer(line):
+                parts.append(self._replace(line[position:match.start()], stats))
+                parts.append(match.group(0))
+                position = match.end()
+            parts.append(self._replace(line[position:], stats))
+            yield ''.join(parts)
+
+    def _replace(self, text: str, stats: Optional[dict], raw: bool = False) -> str:
+        """Replace the emoji of a text with includes of their images"""
+        def replace(match):
+            path = self.path(match.group(0))
+            if stats is not None:
+                counter = 'replaced' if path is not None else 'kept'
+                stats[counter] = stats.get(counter, 0) + 1
+            if path is None:
+                return match.group(0)
+            latex = EMOJI_LATEX % path.replace('\\', '/')
+            return latex if raw else f'`{latex}`{{=latex}}'
+
+        if not EMOJI_PATTERN.search(text):
+            return text
+        return EMOJI_PATTERN.sub(replace, text)
+
+
+_emoji_images = None
+_emoji_images_lock = threading.Lock()
+
+
+def get_emoji_images() -> EmojiImages:
+    """Return the process-wide emoji images
+
+    Images come from $EMOJI_IMAGE_DIR, then from the resolved emoji font, and
+    are cached in $EMOJI_CACHE_DIR (or the "emoji" directory of the default
+    cache root). The cache has no size limit, so an image never disappears
+    between writing the LaTeX and compiling it; one PNG per distinct emoji
+    is a few MB at most.
+    """
+    global _emoji_images
+    with _emoji_images_lock:
+        emoji_font = get_font_map()['emoji']
+        font_file = emoji_font.files.get('regular') if emoji_font.files else None
+        image_dir = os.environ.get(EMOJI_IMAGE_DIR_ENV) or None
+        if (_emoji_images is None or _emoji_images.image_dir != image_dir
+                or _emoji_images.font_file != font_file):
+            directory = os.environ.get(EMOJI_CACHE_DIR_ENV) or default_cache_dir('emoji')
+            _emoji_images = EmojiImages(DiskCache(directory, suffix='.png'), image_dir, font_file)
+        return _emoji_images
@@ -0,0 +1,87 @@
+"""Up-front detection of the Obsidian constructs a document uses
+
+Most documents use only a few Obsidian constructs, yet every preprocessing
+stage walks the whole text. sniff_features scans the raw document once for
+the substrings each construct needs (a callout needs "[!", a highlight "==",
+...) so the pipelines can skip the stages whose trigger never appears.
+
+A trigger being present does not mean the construct is (a "==" may be an
+operator in a code block), so a stage that runs may still change nothing.
+A missing trigger does guarantee the stage has nothing to do.
+"""
+
+import re
+from typing import AbstractSet, FrozenSet, Iterable, List, Optional, Sequence, Tuple, Union
+
+
+# Feature name -> substrings, any of which may start the construct
+FEATURE_TRIGGERS = {
+    'callouts': ('[!',),
+    'highlights': ('==',),
+    'wikilinks': ('[[',),
+    'checkboxes': ('- [',),
+    'underline': ('<u>',),
+    'bold_lines': ('**',),
+    'code_blocks': ('```', '~~~'),
+    'mermaid': ('```mermaid',),
+    'page_breaks': ('<!--', '\\newpage'),
+}
+
+# Tables need a line starting with "|", which a substring cannot express
+TABLE_ROW_PATTERN = re.compile(r'^\s*\|', re.MULTILINE)
+
+ALL_FEATURES = frozenset(FEATURE_TRIGGERS) | {'tables'}
+
+# Pipeline stage description: (stage name, features triggering it). A stage
+# with no features always runs.
+StageTriggers = Sequence[Tuple[str, Tuple[str, ...]]]
+
+
+def sniff_features(content: str) -> FrozenSet[str]:
+    """Return the names of the constructs whose trigger appears in content
+
+    Each trigger is a plain substring search, which runs at C speed and is
+    much cheaper than any stage it lets the pipeline skip.
+
+    Args:
+        content: Raw markdown content
+
+    Returns:
+        Frozen set of feature names (see FEATURE_TRIGGERS, plus 'tables')
+    """
+    features = {name for name, triggers in FEATURE_TRIGGERS.items()
+                if any(trigger in content for trigger in triggers)}
+    if '|' in content and TABLE_ROW_PATTERN.search(content):
+        features.add('tables')
+    return frozenset(features)
+
+
+def select_stages(stages: StageTriggers, features: Optional[AbstractSet[str]]) -> List[str]:
+    """Return the names of the stages to run for a set of features
+
+    Args:
+        stages: Stage names with their triggering features, in pipeline order
+        features: Detected features, or None when unknown (every stage runs)
+
+    Returns:
+        Stage names in pipeline order
+    """
+    if features is None:
+        return [name for name, _ in stages]
+    return [name for name, triggers in stages
+            if not triggers or any(feature in features for feature in triggers)]
+
+
+def record_report(report: Optional[dict], features: Optional[Iterable[str]],
+                  stages: Union[List[str], Tuple[str, ...]]) -> None:
+    """Store the detected features and the stages that ran in a report dict
+
+    Args:
+        report: Dict to update, or None to skip reporting
+        features: Detected features, or None when the input was not sniffed
+        stages: Names of the stages that ran
+    """
+    if report is None:
+        return
+    report['features'] = sorted(features) if features is not None else None
+    report['stages'] = list(stages)
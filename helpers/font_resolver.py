@@ -0,0 +1,301 @@
+"""Resolve the PDF header's fonts to files once, and share luaotfload's cache
+
+The LuaLaTeX header asks for Helvetica Neue with an Apple Color Emoji
+fallback. Where a requested name is not installed (any Linux worker),
+luaotfload rescans the system fonts on every compile before giving up,
+which costs seconds per document and sometimes fails it.
+
+Each font role (FONT_ROLES) is instead resolved once per process, from one
+fc-list run, to the first installed family among its candidates, and the
+header loads that family's files by path: no name is looked up while
+compiling. Roles resolved to a substitute, or not at all, are reported when
+the app starts (prepare_fonts) rather than discovered by every compile.
+
+Every LuaLaTeX run (compiles, format builds, warm workers) shares one
+luaotfload cache directory ($TEXMFCACHE), whose font names database is
+brought up to date once per process by warm_font_cache.
+"""
+
+import os
+import subprocess
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from .capabilities import CAPABILITY_TTL
+from .disk_cache import default_cache_dir
+
+
+# Font role -> candidate families, the requested one first
+FONT_ROLES = {
+    'main': ('Helvetica Neue', 'Helvetica', 'TeX Gyre Heros', 'Nimbus Sans', 'Liberation Sans', 'Arial'),
+    'mono': ('Latin Modern Mono',),
+    'emoji': ('Apple Color Emoji', 'Noto Color Emoji', 'Twemoji Mozilla', 'Segoe UI Emoji'),
+}
+
+# Families every TeX installation has, loaded by name (luaotfload finds
+# them in the TeX tree without scanning system fonts)
+TEX_TREE_FAMILIES = frozenset({'Latin Modern Mono'})
+
+# fontconfig style names -> fontspec shapes
+STYLE_SHAPES = {
+    'regular': 'regular', 'roman': 'regular', 'book': 'regular', 'normal': 'regular',
+    'bold': 'bold',
+    'italic': 'italic', 'oblique': 'italic',
+    'bold italic': 'bolditalic', 'bold oblique': 'bolditalic',
+}
+SHAPE_OPTIONS = (('bold', 'BoldFont'), ('italic', 'ItalicFont'), ('bolditalic', 'BoldItalicFont'))
+
+# Environment variable: shared luaotfload cache directory ($TEXMFCACHE of
+# every LuaLaTeX run unless TEXMFCACHE is already set)
+FONT_CACHE_DIR_ENV = 'LATEX_FONT_CACHE_DIR'
+
+# Seconds the names database update may take (a first run scans every font)
+FONT_CACHE_TIMEOUT = 600
+
+# (path, face index in a collection)
+FontFile = Tuple[str, int]
+
+
+class ResolvedFont:
+    """The installed family chosen for a font role"""
+
+    __slots__ = ('role', 'requested', 'family', 'files')
+
+    def __init__(self, role: str, requested: str, family: Optional[str],
+                 files: Optional[Dict[str, FontFile]] = None):
+        """
+        Initialize resolved font
+
+        Args:
+            role: Key of FONT_ROLES
+            requested: Family the header asks for
+            family: Installed family used instead (None when no candidate is)
+            files: Shape ('regular', 'bold', ...) -> font file, or None to
+                load the family by name (TEX_TREE_FAMILIES)
+        """
+        self.role = role
+        self.requested = requested
+        self.family = family
+        self.files = files
+
+    def __repr__(self):
+        return f'ResolvedFont({self.role}: {self.requested} -> {self.family})'
+
+    def fontspec(self) -> Tuple[str, List[str]]:
+        """Return the fontspec font argument and options loading this font"""
+        if not self.files:
+            return self.family, []
+        path, index = self.files['regular']
+        directory, name = os.path.split(path)
+        options = [f'Path={directory}/']
+        if index:
+            options.append(f'FontIndex={index}')
+        for shape, option in SHAPE_OPTIONS:
+            shape_file = self.files.get(shape)
+            # Path= applies to every shape, so only same-directory faces are usable
+            if shape_file and os.path.dirname(shape_file[0]) == directory and not shape_file[1]:
+                options.append(f'{option}={os.path.basename(shape_file[0])}')
+        return name, options
+
+    def luaotfload_request(self) -> str:
+        """Return the luaotfload request loading this font by path"""
+        if not self.files:
+            return self.family
+        path, index = self.files['regular']
+        return f'[{path}]' + (f'({index})' if index else '')
+
+
+class FontMap:
+    """Resolved fonts of every role"""
+
+    def __init__(self, fonts: Dict[str, ResolvedFont]):
+        self.fonts = fonts
+
+    def __getitem__(self, role: str) -> ResolvedFont:
+        return self.fonts[role]
+
+    def problems(self) -> List[str]:
+        """Describe the roles not resolved to the requested family"""
+        problems = []
+        for font in self.fonts.values():
+            if font.family is None:
+                problems.append(f'{font.requested} is missing')
+            elif font.family != font.requested:
+                problems.append(f'{font.requested} is missing, using {font.family}')
+        return problems
+
+    def describe(self) -> str:
+        """Return a stable description of the resolution (for cache keys)"""
+        return '; '.join(f'{role}={font.family}:{sorted((font.files or {}).items())}'
+                         for role, font in sorted(self.fonts.items()))
+
+    def latex(self, emoji: bool = True) -> str:
+        """Return the LaTeX loading the resolved fonts
+
+        Args:
+            emoji: Whether the main font gets the emoji fallback
+        """
+        lines = ['', '% Fonts resolved to files once (font_resolver.py), so luaotfload looks up no names']
+        main_options = []
+        emoji_font = self.fonts['emoji']
+        if emoji and emoji_font.family is not None:
+            lines += [
+                '\\directlua{',
+                '  luaotfload.add_fallback("emojifallback", {',
+                f'    "{emoji_font.luaotfload_request()}:mode=harf"',
+                '  })',
+                '}',
+            ]
+            main_options.append('RawFeature={fallback=emojifallback}')
+
+        main_font = self.fonts['main']
+        if main_font.family is not None:
+            name, options = main_font.fontspec()
+            lines.append(f'\\setmainfont{{{name}}}[{", ".join(options + main_options)}]')
+        elif main_options:
+            lines.append(f'\\setmainfont{{Latin Modern Roman}}[{", ".join(main_options)}]')
+
+        mono_font = self.fonts['mono']
+        if mono_font.family is not None:
+            lines += [
+                '',
+                '% Use default monospace font for better line breaking in code blocks',
+                "% Custom fonts can interfere with fvextra's character width calculations",
+            ]
+            name, options = mono_font.fontspec()
+            lines.append(f'\\setmonofont{{{name}}}[{", ".join(options + ["Scale=0.9"])}]')
+        return '\n'.join(lines) + '\n'
+
+
+def probe_font_files() -> Dict[str, Dict[str, FontFile]]:
+    """List the installed font files by family and shape (one fc-list run)
+
+    Returns:
+        Family -> shape -> (path, index); empty when fontconfig is missing
+    """
+    try:
+        result = subprocess.run(['fc-list', '--format', '%{family}\t%{style}\t%{file}\t%{index}\n'],
+                                capture_output=True, text=True, timeout=30)
+    except (subprocess.SubprocessError, FileNotFoundError):
+        return {}
+    return parse_font_list(result.stdout.splitlines())
+
+
+def parse_font_list(lines: Iterable[str]) -> Dict[str, Dict[str, FontFile]]:
+    """Parse fc-list lines of 'families<TAB>styles<TAB>file<TAB>index'"""
+    installed: Dict[str, Dict[str, FontFile]] = {}
+    for line in lines:
+        parts = line.split('\t')
+        if len(parts) != 4:
+            continue
+        families, styles, path, index = parts
+        shapes = [STYLE_SHAPES.get(style.strip().lower()) for style in styles.split(',')]
+        shape = next((shape for shape in shapes if shape), None)
+        if shape is None:
+            continue
+        for family in families.split(','):
+            faces = installed.setdefault(family.strip(), {})
+            # The first face listed for a shape wins; fc-list output is stable
+            faces.setdefault(shape, (path, int(index) if index.isdigit() else 0))
+    return installed
+
+
+def resolve_fonts(installed: Optional[Dict[str, Dict[str, FontFile]]] = None) -> FontMap:
+    """Resolve every font role to its first installed candidate
+
+    Args:
+        installed: Result of probe_font_files (probed when None)
+    """
+    if installed is None:
+        installed = probe_font_files()
+    fonts = {}
+    for role, candidates in FONT_ROLES.items():
+        fonts[role] = ResolvedFont(role, candidates[0], None)
+        for family in candidates:
+            faces = installed.get(family, {})
+            if 'regular' in faces:
+                fonts[role] = ResolvedFont(role, candidates[0], family, faces)
+                break
+            if family in TEX_TREE_FAMILIES:
+                fonts[role] = ResolvedFont(role, candidates[0], family)
+                break
+    return FontMap(fonts)
+
+
+_font_map = (None, 0.0)
+_font_map_lock = threading.Lock()
+
+
+def get_font_map() -> FontMap:
+    """Return the process-wide font resolution, refreshed after CAPABILITY_TTL"""
+    global _font_map
+    with _font_map_lock:
+        font_map, resolved_at = _font_map
+        if font_map is None or time.monotonic() - resolved_at >= CAPABILITY_TTL:
+            font_map = resolve_fonts()
+            _font_map = (font_map, time.monotonic())
+        return font_map
+
+
+def font_cache_dir() -> str:
+    """Return the luaotfload cache directory shared by every LuaLaTeX run"""
+    return os.environ.get(FONT_CACHE_DIR_ENV) or str(default_cache_dir('luaotfload'))
+
+
+def latex_environment() -> Dict[str, str]:
+    """Return the environment of LuaLaTeX runs, with the shared font cache"""
+    environment = dict(os.environ)
+    environment.setdefault('TEXMFCACHE', font_cache_dir())
+    return environment
+
+
+_font_cache_state = None
+_font_cache_lock = threading.Lock()
+
+
+def warm_font_cache() -> bool:
+    """Bring the shared luaotfload names database up to date, once per process
+
+    Concurrent callers wait for the one update. Later compiles and workers
+    then find every font without a rescan.
+
+    Returns:
+        Whether the database is up to date (False when luaotfload-tool is
+        missing or failed)
+    """
+    global _font_cache_state
+    with _font_cache_lock:
+        if _font_cache_state is None:
+            _font_cache_state = _update_font_cache()
+        return _font_cache_state
+
+
+def _update_font_cache() -> bool:
+    """Run luaotfload-tool --update on the shared cache directory"""
+    environment = latex_environment()
+    try:
+        os.makedirs(environment['TEXMFCACHE'], exist_ok=True)
+        result = subprocess.run(['luaotfload-tool', '--update'], env=environment,
+                                capture_output=True, text=True, timeout=FONT_CACHE_TIMEOUT)
+    except (OSError, subprocess.SubprocessError) as e:
+        print(f"Warning: Could not update the luaotfload font cache: {e}")
+        return False
+    if result.returncode != 0:
+        print(f"Warning: Could not update the luaotfload font cache: {result.stderr.strip()}")
+        return False
+    return True
+
+
+def prepare_fonts(warm: bool = True) -> FontMap:
+    """Resolve the fonts and warm the font cache at startup, reporting problems
+
+    Args:
+        warm: Also update the shared luaotfload cache (in the background)
+    """
+    font_map = get_font_map()
+    for problem in font_map.problems():
+        print(f"Warning: PDF font {problem}")
+    if warm:
+        threading.Thread(target=warm_font_cache, name='luaotfload-warm', daemon=True).start()
+    return font_map
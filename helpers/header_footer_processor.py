@@ -177,29 +177,16 @@ class HeaderFooterProcessor:
         # Handle logo if enabled
         logo_config = self.preset_config.get('logo', {})
         if logo_config.get('enabled', False):
-            logo_path = logo_config.get('path', 'config/logo.svg')
             logo_position = logo_config.get('position', 'header_left')
             logo_height = logo_config.get('height', '0.5cm')
             logo_width = logo_config.get('width', '')
 
-            # Convert relative path to absolute path for LaTeX
-            if not os.path.isabs(logo_path):
-                # Get the project root (3 levels up from this file)
-                project_root = Path(__file__).parent.parent
-                logo_abs_path = (project_root / logo_path).resolve()
-                logo_path = str(logo_abs_path)
-
-            # Check if logo is SVG and convert to PNG if needed (LaTeX doesn't support SVG)
-            logo_enabled = True
-            if logo_path.lower().endswith('.svg'):
-                # Try to find a PNG version
-                png_path = logo_path[:-4] + '.png'
-                if os.path.exists(png_path):
-                    logo_path = png_path
-                    print(f"Info: Using PNG version of logo: {png_path}")
-                else:
-                    print(f"Warning: Logo is SVG which LaTeX doesn't support. Please convert {logo_path} to PNG.")
-                    logo_enabled = False
+            configured_path, logo_path = resolve_logo_path(logo_config)
+            logo_enabled = logo_path is not None
+            if not logo_enabled:
+                print(f"Warning: Logo is SVG which LaTeX doesn't support. Please convert {configured_path} to PNG.")
+            elif logo_path != configured_path:
+                print(f"Info: Using PNG version of logo: {logo_path}")
 
             if logo_enabled:
                 # Generate LaTeX includegraphics command
@@ -335,6 +322,32 @@ class HeaderFooterProcessor:
         }
 
 
+def resolve_logo_path(logo_config: Dict[str, Any]) -> Tuple[str, Optional[str]]:
+    """
+    Resolve the logo file LaTeX includes for a logo configuration
+
+    Args:
+        logo_config: Logo configuration of a preset
+
+    Returns:
+        (configured path made absolute, path of the file to include or None
+        when it is an SVG without a PNG version, which LaTeX cannot include)
+    """
+    logo_path = logo_config.get('path', 'config/logo.svg')
+
+    # Convert relative path to absolute path for LaTeX
+    if not os.path.isabs(logo_path):
+        # Get the project root (3 levels up from this file)
+        project_root = Path(__file__).parent.parent
+        logo_path = str((project_root / logo_path).resolve())
+
+    # LaTeX doesn't support SVG: use a PNG version next to it if there is one
+    if logo_path.lower().endswith('.svg'):
+        png_path = logo_path[:-4] + '.png'
+        return logo_path, (png_path if os.path.exists(png_path) else None)
+    return logo_path, logo_path
+
+
 def create_processor_from_preset(preset_name: str, template_manager) -> HeaderFooterProcessor:
     """
     Create a HeaderFooterProcessor from a preset name
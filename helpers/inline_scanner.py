@@ -0,0 +1,289 @@
+"""Linear-time scanner for Obsidian inline syntax
+
+The inline conversions used to be chains of re.sub passes with lazy patterns
+(``!\\[\\[([^\\]|]+?)...``). On long single-line paragraphs full of stray
+brackets those patterns backtrack: every unclosed ``[[`` rescans the rest of
+the line, and the section embed pattern is cubic. This module replaces them
+with left-to-right scanners that never look at a character more than a
+constant number of times:
+
+- link tokens (image embeds, section embeds, wikilinks) are found by
+  jumping between bracket positions, with the next "]", "|" and "#" after the
+  cursor cached so an unclosed token costs no rescan
+- highlight and underline spans are found together by one state machine over
+  the "=" and "<" characters of the link-resolved text
+
+Each single-construct scanner matches exactly what its former regex matched
+(same spans, leftmost and non-overlapping), so the staged conversions keep
+their output. resolve_links scans all three link kinds at once, leftmost
+token first; its replacement text is never rescanned for links.
+"""
+
+import re
+from typing import Callable, Iterator, List, Optional, Tuple
+
+
+# Span kinds
+HIGHLIGHT = 'highlight'
+UNDERLINE = 'underline'
+
+# (start, end, inner start, inner end, kind) of a highlight or underline
+Span = Tuple[int, int, int, int, str]
+
+# Characters that can start or end a highlight/underline span
+SPAN_CHARS = re.compile(r'[=<]')
+HIGHLIGHT_CHARS = re.compile(r'=')
+UNDERLINE_CHARS = re.compile(r'<')
+
+
+class _NextChar:
+    """Next occurrence of one character, for non-decreasing query positions
+
+    The last answer is reused while queries stay before it, so the text is
+    searched at most once in total.
+    """
+
+    __slots__ = ('text', 'char', 'found')
+
+    def __init__(self, text: str, char: str):
+        self.text = text
+        self.char = char
+        self.found = -1
+
+    def at_or_after(self, index: int) -> int:
+        """Return the first position >= index holding the character, or len(text)"""
+        if index > self.found:
+            found = self.text.find(self.char, index)
+            self.found = len(self.text) if found == -1 else found
+        return self.found
+
+
+def _match_link_body(text: str, start: int, close: _NextChar, bar: _NextChar) -> Tuple[int, int]:
+    """Match ``target(|alias)?]]`` at start, like ``([^\\]|]+?)(?:\\|([^\\]]+))?\\]\\]``
+
+    Returns:
+        (end, alias start) with alias start -1 when there is no alias, or
+        (-1, -1) when there is no match
+    """
+    close_at = close.at_or_after(start)
+    bar_at = bar.at_or_after(start)
+    if bar_at < close_at:
+        # target|alias]]: the alias runs to the next "]"
+        if bar_at > start and close_at > bar_at + 1 and text.startswith(']]', close_at):
+            return close_at + 2, bar_at + 1
+    elif close_at > start and text.startswith(']]', close_at):
+        return close_at + 2, -1
+    return -1, -1
+
+
+def _match_section_body(text: str, start: int, close: _NextChar, hash_mark: _NextChar) -> int:
+    """Match ``note#section]]`` at start, like ``([^\\]]+?)#([^\\]]+?)\\]\\]``
+
+    Returns:
+        End of the match, or -1 when there is no match
+    """
+    close_at = close.at_or_after(start)
+    if not text.startswith(']]', close_at):
+        return -1
+    # The note part is at least one character and the section is not empty
+    hash_at = hash_mark.at_or_after(start + 1)
+    return close_at + 2 if hash_at <= close_at - 2 else -1
+
+
+def iter_link_tokens(text: str, images: bool = True, sections: bool = True,
+                     wikilinks: bool = True) -> Iterator[Tuple[int, int, str]]:
+    """Yield link tokens, leftmost first and non-overlapping
+
+    Image embeds become ``![](target)``, section embeds are removed and
+    wikilinks are replaced by their alias (like the former ``\\2``
+    substitution, a link without alias becomes empty).
+
+    Args:
+        text: Text to scan
+        images: Whether to match ``![[image]]`` embeds
+        sections: Whether to match ``![[note#section]]`` embeds
+        wikilinks: Whether to match ``[[link]]``
+
+    Yields:
+        (start, end, replacement) tuples
+    """
+    close = _NextChar(text, ']')
+    bar = _NextChar(text, '|')
+    hash_mark = _NextChar(text, '#')
+
+    position = text.find('[[')
+    while position != -1:
+        if close.at_or_after(position + 2) == len(text):
+            # Every token ends with "]]": nothing after the last "]" can match
+            return
+
+        end = -1
+        # An embed is tried from its "!", before the wikilink starting at "[["
+        # (tokens end with "]]", so the "!" never belongs to the previous one)
+        if position > 0 and text[position - 1] == '!' and (images or sections):
+            start = position + 2
+            if images:
+                end, alias_start = _match_link_body(text, start, close, bar)
+                if end != -1:
+                    target_end = alias_start - 1 if alias_start != -1 else end - 2
+                    yield position - 1, end, f'![]({text[start:target_end]})'
+            if end == -1 and sections:
+                end = _match_section_body(text, start, close, hash_mark)
+                if end != -1:
+                    yield position - 1, end, ''
+
+        if end == -1 and wikilinks:
+            end, alias_start = _match_link_body(text, position + 2, close, bar)
+            if end != -1:
+                yield position, end, text[alias_start:end - 2] if alias_start != -1 else ''
+
+        position = text.find('[[', end if end != -1 else position + 1)
+
+
+def replace_links(text: str, images: bool = True, sections: bool = True,
+                  wikilinks: bool = True) -> str:
+    """Replace the selected link tokens (see iter_link_tokens)"""
+    if '[[' not in text:
+        return text
+
+    pieces = []
+    position = 0
+    for start, end, replacement in iter_link_tokens(text, images, sections, wikilinks):
+        pieces.append(text[position:start])
+        pieces.append(replacement)
+        position = end
+    if not pieces:
+        return text
+    pieces.append(text[position:])
+    return ''.join(pieces)
+
+
+def resolve_links(text: str) -> str:
+    """Convert image embeds to markdown images, drop section embeds and
+    replace wikilinks by their alias, in one scan"""
+    return replace_links(text)
+
+
+def find_spans(text: str, highlights: bool = True, underlines: bool = True) -> List[Span]:
+    """Find ``==highlight==`` and ``<u>underline</u>`` spans in one scan
+
+    Each kind gets exactly the matches of its former regex (``==([^=]+)==``
+    and ``<u>([^<]+)</u>``): leftmost, non-overlapping, never empty. Spans of
+    different kinds may nest or cross.
+
+    Args:
+        text: Text to scan (with links already resolved)
+        highlights: Whether to find highlights
+        underlines: Whether to find underlines
+
+    Returns:
+        Spans sorted by start position
+    """
+    if highlights and underlines:
+        delimiters = SPAN_CHARS
+    elif highlights or underlines:
+        delimiters = HIGHLIGHT_CHARS if highlights else UNDERLINE_CHARS
+    else:
+        return []
+
+    spans = []
+    length = len(text)
+    highlight_open = -1
+    underline_open = -1
+
+    match = delimiters.search(text)
+    while match is not None:
+        index = match.start()
+        position = index + 1
+
+        if text[index] == '=':
+            if index + 1 < length and text[index + 1] == '=':
+                if highlight_open != -1:
+                    # The first "=" after an opener decides: "==" closes it
+                    spans.append((highlight_open - 2, index + 2, highlight_open, index, HIGHLIGHT))
+                    highlight_open = -1
+                    position = index + 2
+                elif index + 2 < length and text[index + 2] != '=':
+                    highlight_open = index + 2
+                    position = index + 2
+            else:
+                # ...and a lone "=" cancels it
+                highlight_open = -1
+
+        else:
+            if underline_open != -1 and text.startswith('</u>', index):
+                spans.append((underline_open - 3, index + 4, underline_open, index, UNDERLINE))
+                underline_open = -1
+                position = index + 4
+            else:
+                # Any other "<" cancels the open underline, and may open a new one
+                underline_open = -1
+                if text.startswith('<u>', index) and index + 3 < length and text[index + 3] != '<':
+                    underline_open = index + 3
+                    position = index + 3
+
+        match = delimiters.search(text, position)
+
+    # Spans are appended when they close; openers of the two kinds interleave
+    spans.sort()
+    return spans
+
+
+def render_spans(text: str, spans: List[Span], markup: Callable[[str], Tuple[str, str]]) -> str:
+    """Replace the delimiters of each span by its markup
+
+    Crossing spans are rendered delimiter by delimiter, like the former
+    sequential re.sub passes.
+
+    Args:
+        text: Scanned text
+        spans: Spans from find_spans
+        markup: Returns the (opening, closing) markup of a span kind
+
+    Returns:
+        Converted text
+    """
+    if not spans:
+        return text
+
+    cuts = []
+    for start, end, inner_start, inner_end, kind in spans:
+        opening, closing = markup(kind)
+        cuts.append((start, inner_start, opening))
+        cuts.append((inner_end, end, closing))
+    cuts.sort()
+
+    pieces = []
+    position = 0
+    for start, end, replacement in cuts:
+        pieces.append(text[position:start])
+        pieces.append(replacement)
+        position = end
+    pieces.append(text[position:])
+    return ''.join(pieces)
+
+
+def convert_inline(text: str, highlight: Optional[Tuple[str, str]],
+                   underline: Optional[Tuple[str, str]] = None, links: bool = True) -> str:
+    """Resolve links, then convert highlights and underlines in one scan
+
+    Args:
+        text: Text to convert
+        highlight: (opening, closing) markup replacing ``==`` delimiters, or
+            None to keep highlights as they are
+        underline: (opening, closing) markup replacing ``<u>`` tags, or None
+            to keep underlines as they are
+        links: Whether to resolve link tokens first
+
+    Returns:
+        Converted text
+    """
+    if links:
+        text = resolve_links(text)
+    highlights = highlight is not None and '==' in text
+    underlines = underline is not None and '<u>' in text
+    if not highlights and not underlines:
+        return text
+
+    spans = find_spans(text, highlights, underlines)
+    return render_spans(text, spans, lambda kind: highlight if kind == HIGHLIGHT else underline)
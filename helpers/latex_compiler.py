@@ -0,0 +1,487 @@
+"""Compile Pandoc's LaTeX output with LuaLaTeX (or pdfLaTeX), starting from a cached format
+
+Loading the preamble (tcolorbox and PGF, longtable, fancyhdr, ...) costs
+seconds on every PDF before page one. The font-independent package loads of
+a preamble are dumped once into a custom LuaLaTeX format with mylatexformat,
+stored in a DiskCache keyed by a hash of those lines and of the installed
+TeX, and later compiles of any document with the same preamble start from it.
+
+Fonts cannot live in a LuaTeX format (luaotfload's Lua state is not dumped),
+so only packages in FORMAT_SAFE_PACKAGES are hoisted into it. The complete
+preamble still runs at compile time, where the hoisted loads are no-ops. When
+a format cannot be built or used, the document is compiled without one.
+
+Passes are planned by PassController rather than by rerunning while the log
+says so: a document that reads back its .aux (LastPage, longtable widths,
+cross-references) gets a first pass in draft mode, which writes no PDF, and
+another pass only runs when the auxiliary files changed.
+
+Documents that latex_engine.select_engine finds plain enough compile with
+pdfLaTeX instead, which starts much faster; they use neither formats nor
+the worker pool, both of which are LuaLaTeX-specific.
+"""
+
+import hashlib
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from .capabilities import CAPABILITY_TTL, get_capabilities
+from .disk_cache import DiskCache, content_key, default_cache_dir
+from .font_resolver import latex_environment
+from .single_flight import SingleFlight
+
+
+# Bump when the way formats are built changes
+FORMAT_RECIPE_VERSION = '1'
+
+# Size limit of the format cache (a format is a few tens of MB)
+LATEX_FORMAT_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+# Environment variables: cache directory, and '0' to compile without formats
+LATEX_FORMAT_CACHE_DIR_ENV = 'LATEX_FORMAT_CACHE_DIR'
+LATEX_FORMAT_ENV = 'LATEX_PRECOMPILED_FORMAT'
+
+# Most LuaLaTeX runs per document
+MAX_LATEX_PASSES = 3
+
+# Engines compile_latex can run, with the names used in messages
+LATEX_ENGINE_NAMES = {'lualatex': 'LuaLaTeX', 'pdflatex': 'pdfLaTeX'}
+
+# Files a pass writes and the next one reads back
+AUX_EXTENSIONS = ('.aux', '.toc', '.lof', '.lot')
+
+# Seconds one LuaLaTeX run may take
+LATEX_TIMEOUT = 300
+
+# Packages that load no OpenType font and register no Lua code at load time
+FORMAT_SAFE_PACKAGES = frozenset({
+    'amsmath', 'amssymb', 'amsfonts', 'array', 'booktabs', 'calc', 'caption',
+    'enumitem', 'environ', 'etoolbox', 'fancyhdr', 'fancyvrb', 'float', 'footnote',
+    'framed', 'fvextra', 'geometry', 'graphicx', 'iftex', 'lastpage', 'longtable',
+    'multirow', 'needspace', 'parskip', 'pgf', 'placeins', 'setspace', 'tabularx',
+    'tcolorbox', 'tikz', 'ulem', 'upquote', 'url', 'xcolor', 'xurl',
+})
+
+PACKAGE_LINE_PATTERN = re.compile(
+    r'\\(?:usepackage|RequirePackage)\s*(?:\[[^\]]*\])?\s*\{([^}]*)\}\s*(?:\[[^\]]*\])?\s*$')
+PASS_OPTIONS_PATTERN = re.compile(r'\\PassOptionsToPackage\s*\{[^}]*\}\s*\{([^}]*)\}\s*$')
+LIBRARY_PATTERN = re.compile(r'\\(?:tcbuselibrary|usetikzlibrary)\s*\{[^}]*\}\s*$')
+DOCUMENTCLASS_PATTERN = re.compile(r'\\documentclass\s*(?:\[[^\]]*\])?\s*\{[^}]*\}')
+CONDITIONAL_OPEN_PATTERN = re.compile(r'\\if[a-zA-Z@]*')
+CONDITIONAL_CLOSE_PATTERN = re.compile(r'\\fi(?![a-zA-Z@])')
+RERUN_PATTERN = re.compile(r'Rerun to get|Label\(s\) may have changed|Please \(?re\)?run')
+# Content whose output depends on what the previous pass wrote to the .aux
+AUX_READER_PATTERN = re.compile(
+    r'\\(?:page|eq|auto|name)?ref\s*\{|\\cite[a-z]*\s*[\[{]|\\begin\s*\{longtable\}'
+    r'|\\tableofcontents|\\listof(?:figures|tables)|LastPage')
+
+
+def format_enabled() -> bool:
+    """Whether compiles use precompiled formats ($LATEX_PRECOMPILED_FORMAT != '0')"""
+    return os.environ.get(LATEX_FORMAT_ENV, '1') != '0'
+
+
+def _strip_comment(line: str) -> str:
+    """Remove a LaTeX comment (an unescaped %) from a line"""
+    match = re.search(r'(?<!\\)%', line)
+    return line[:match.start()] if match else line
+
+
+def _is_format_safe(code: str) -> bool:
+    """Whether a preamble statement can be dumped into a format"""
+    match = PACKAGE_LINE_PATTERN.fullmatch(code) or PASS_OPTIONS_PATTERN.fullmatch(code)
+    if match is None:
+        return LIBRARY_PATTERN.fullmatch(code) is not None
+    return {name.strip() for name in match.group(1).split(',')} <= FORMAT_SAFE_PACKAGES
+
+
+def split_format_preamble(tex: str) -> Optional[Tuple[str, str]]:
+    """Split a standalone LaTeX document into the part to dump and the rest
+
+    The dumped part is the \\documentclass statement (with the
+    \\PassOptionsToPackage lines Pandoc puts before it) followed by the
+    format-safe package loads of the preamble, in their original order along
+    with the libraries they rely on. Only lines outside any group or
+    conditional are hoisted.
+
+    Args:
+        tex: Complete LaTeX document
+
+    Returns:
+        (dumped, rest), where rest is the document after its \\documentclass
+        statement, or None when the document has no hoistable preamble
+    """
+    preamble_end = tex.find('\\begin{document}')
+    if preamble_end == -1:
+        return None
+    lines = [(line, _strip_comment(line).strip()) for line in tex[:preamble_end].split('\n')]
+
+    # The \documentclass statement may span lines ("\documentclass[" ... "]{article}")
+    start = next((index for index, (_, code) in enumerate(lines) if code.startswith('\\documentclass')), None)
+    if start is None or any(code and not PASS_OPTIONS_PATTERN.fullmatch(code) for _, code in lines[:start]):
+        return None
+    end = start
+    while not DOCUMENTCLASS_PATTERN.match(' '.join(code for _, code in lines[start:end + 1])):
+        end += 1
+        if end == len(lines):
+            return None
+
+    dumped = [line for line, _ in lines[:end + 1]]
+    rest = []
+    hoisted = 0
+    depth = 0
+    for line, code in lines[end + 1:]:
+        if depth == 0 and code and _is_format_safe(code):
+            dumped.append(line)
+            hoisted += 1
+        # Hoisted loads stay in place too, where they are no-ops
+        rest.append(line)
+
+        if not code.startswith('\\newif'):
+            depth += len(CONDITIONAL_OPEN_PATTERN.findall(code)) - len(CONDITIONAL_CLOSE_PATTERN.findall(code))
+        depth += code.count('{') - code.count('\\{') - code.count('}') + code.count('\\}')
+        depth = max(depth, 0)
+
+    if not hoisted:
+        return None
+    return '\n'.join(dumped) + '\n', '\n'.join(rest) + tex[preamble_end:]
+
+
+def format_document(dumped: str, rest: str) -> str:
+    """Assemble the document compiled with a format built from dumped
+
+    mylatexformat skips everything up to \\endofdump when the format is loaded.
+    """
+    return dumped + '\\endofdump\n' + rest
+
+
+_installation_id = (None, 0.0)
+_installation_lock = threading.Lock()
+
+
+def tex_installation_id() -> Optional[str]:
+    """Identify the installed TeX (engine version and base format), cached with a TTL
+
+    Returns:
+        Identifier string, or None when LuaLaTeX or mylatexformat is missing
+    """
+    global _installation_id
+    with _installation_lock:
+        value, checked_at = _installation_id
+        if checked_at and time.monotonic() - checked_at < CAPABILITY_TTL:
+            return value
+
+    version = get_capabilities().version('lualatex')
+    value = None
+    if version is not None:
+        try:
+            result = subprocess.run(
+                ['kpsewhich', '-engine=luahbtex', 'lualatex.fmt', 'mylatexformat.ltx'],
+                capture_output=True, text=True, timeout=30)
+            paths = result.stdout.split()
+        except (subprocess.SubprocessError, FileNotFoundError):
+            paths = []
+        if len(paths) == 2:
+            # tlmgr updates regenerate lualatex.fmt, changing its mtime
+            value = f'{version}|{paths[0]}|{os.path.getmtime(paths[0])}'
+
+    with _installation_lock:
+        _installation_id = (value, time.monotonic())
+    return value
+
+
+_format_cache = None
+_format_cache_lock = threading.Lock()
+_format_builds = SingleFlight()
+_broken_formats = set()
+
+
+def get_format_cache() -> DiskCache:
+    """Return the process-wide cache of LuaLaTeX formats
+
+    The directory is $LATEX_FORMAT_CACHE_DIR, or the "latex-formats" directory
+    of the default cache root.
+    """
+    global _format_cache
+    with _format_cache_lock:
+        if _format_cache is None:
+            directory = os.environ.get(LATEX_FORMAT_CACHE_DIR_ENV) or default_cache_dir('latex-formats')
+            _format_cache = DiskCache(directory, max_bytes=LATEX_FORMAT_CACHE_MAX_BYTES, suffix='.fmt')
+        return _format_cache
+
+
+def format_key(dumped: str, installation_id: str) -> str:
+    """Return the cache key of the format built from a dumped preamble"""
+    return content_key('lualatex-format', FORMAT_RECIPE_VERSION, installation_id, dumped)
+
+
+def ensure_format(dumped: str, cache: Optional[DiskCache] = None) -> Optional[Tuple[str, str]]:
+    """Return the cached format for a dumped preamble, building it if needed
+
+    Args:
+        dumped: \\documentclass line plus the hoisted package loads
+        cache: DiskCache to use (default: the shared format cache)
+
+    Returns:
+        (key, path of the .fmt file), or None when no format can be used
+    """
+    installation_id = tex_installation_id()
+    if installation_id is None:
+        return None
+    cache = cache or get_format_cache()
+    key = format_key(dumped, installation_id)
+    if key in _broken_formats:
+        return None
+
+    path = cache.get_path(key)
+    if path is None:
+        # Concurrent conversions of the same preamble build it once
+        path = _format_builds.do(key, lambda: cache.get_path(key) or _build_format(key, dumped, cache))
+    if path is None:
+        _broken_formats.add(key)
+        return None
+    return key, str(path)
+
+
+def _build_format(key: str, dumped: str, cache: DiskCache):
+    """Dump a format with mylatexformat and store it in the cache
+
+    Returns:
+        Path of the cached .fmt file, or None when the build failed
+    """
+    workdir = tempfile.mkdtemp(prefix='latex-format-')
+    try:
+        source = os.path.join(workdir, 'preamble.tex')
+        with open(source, 'w', encoding='utf-8') as f:
+            f.write(format_document(dumped, '\\begin{document}\n\\end{document}\n'))
+        try:
+            result = subprocess.run(
+                ['lualatex', '-ini', '-interaction=nonstopmode', '-halt-on-error', f'-jobname={key}',
+                 '&lualatex', 'mylatexformat.ltx', 'preamble.tex'],
+                cwd=workdir, env=latex_environment(), capture_output=True, encoding='utf-8', errors='replace',
+                timeout=LATEX_TIMEOUT)
+        except (subprocess.SubprocessError, FileNotFoundError) as e:
+            print(f"Warning: LuaLaTeX format build failed: {e}")
+            return None
+        fmt_path = os.path.join(workdir, key + '.fmt')
+        if result.returncode != 0 or not os.path.exists(fmt_path):
+            print(f"Warning: LuaLaTeX format build failed: {latex_log_excerpt(result.stdout)}")
+            return None
+        try:
+            with open(fmt_path, 'rb') as f:
+                return cache.put(key, f.read())
+        except OSError as e:
+            print(f"Warning: Could not cache the LuaLaTeX format: {e}")
+            return None
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def compile_latex(tex: str, output_path: str, use_format: Optional[bool] = None,
+                  cache: Optional[DiskCache] = None, workers=None, engine: str = 'lualatex') -> List[Dict]:
+    """Compile a standalone LaTeX document to PDF
+
+    Args:
+        tex: Complete LaTeX document (e.g. Pandoc's --standalone output)
+        output_path: Where to write the PDF
+        use_format: Start from a cached preamble format (default: format_enabled())
+        cache: Format DiskCache to use (default: the shared format cache)
+        workers: Optional LatexWorkerPool whose warm processes run the first pass
+        engine: 'lualatex', or 'pdflatex' (compiled without format or workers)
+
+    Returns:
+        One record per pass run (see PassController.record)
+
+    Raises:
+        RuntimeError: The engine failed (the message holds the log's errors)
+    """
+    if engine != 'lualatex':
+        return _compile(tex, output_path, None, engine=engine)
+    if use_format is None:
+        use_format = format_enabled()
+
+    split = split_format_preamble(tex) if use_format else None
+    fmt = ensure_format(split[0], cache) if split is not None else None
+    if fmt is None:
+        return _compile(tex, output_path, None, workers)
+
+    try:
+        return _compile(format_document(*split), output_path, fmt, workers)
+    except (RuntimeError, OSError) as e:
+        format_error = e
+
+    # Never let a bad format fail a document that compiles without it
+    passes = _compile(tex, output_path, None, workers)
+    print(f"Warning: Compiling with the precompiled format failed, dropping it: {format_error}")
+    _broken_formats.add(fmt[0])
+    try:
+        (cache or get_format_cache()).path_for(fmt[0]).unlink()
+    except OSError:
+        pass
+    return passes
+
+
+def _compile(tex: str, output_path: str, fmt: Optional[Tuple[str, str]], workers=None,
+             engine: str = 'lualatex') -> List[Dict]:
+    """Compile on a warm worker if one is ready, else in a private directory"""
+    if workers is not None:
+        passes = workers.compile(tex, output_path, fmt)
+        if passes is not None:
+            return passes
+
+    workdir = tempfile.mkdtemp(prefix='latex-compile-')
+    try:
+        with open(os.path.join(workdir, 'document.tex'), 'w', encoding='utf-8') as f:
+            f.write(tex)
+        if fmt is not None:
+            link_format(fmt, workdir)
+        passes = run_passes(workdir, fmt, PassController(tex), engine)
+        shutil.copyfile(os.path.join(workdir, 'document.pdf'), output_path)
+        return passes
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+class PassController:
+    """Decides whether a document needs another LuaLaTeX pass
+
+    A pass reads the auxiliary files (AUX_EXTENSIONS) the previous one wrote.
+    Once a pass writes them back unchanged, another pass would typeset the
+    same pages, so it is skipped even when the log asks for a rerun.
+    """
+
+    def __init__(self, tex: str, max_passes: int = MAX_LATEX_PASSES):
+        """
+        Initialize controller
+
+        Args:
+            tex: Document being compiled
+            max_passes: Most passes to run
+        """
+        self.reads_aux = bool(AUX_READER_PATTERN.search(tex))
+        self.max_passes = max_passes
+        self.passes: List[Dict] = []
+        self._aux_digest = None
+
+    def next_pass(self) -> Optional[bool]:
+        """Return whether the next pass is a draft, or None when the PDF is final"""
+        if not self.passes:
+            # The .aux will change, so the first pass's pages are thrown away
+            return self.reads_aux and self.max_passes > 1
+        last = self.passes[-1]
+        if last['draft']:
+            return False
+        if len(self.passes) >= self.max_passes or not last['aux_changed']:
+            return None
+        return False if self.reads_aux or last['rerun_requested'] else None
+
+    def record(self, workdir: str, draft: bool, seconds: float, log: str) -> Dict:
+        """Record a finished pass
+
+        Returns:
+            The pass record: draft, seconds, aux_changed (its auxiliary files
+            differ from those it read) and rerun_requested (the log asks for one)
+        """
+        digest = aux_digest(workdir)
+        record = {
+            'draft': draft,
+            'seconds': round(seconds, 3),
+            'aux_changed': digest != self._aux_digest,
+            'rerun_requested': bool(RERUN_PATTERN.search(log)),
+        }
+        self._aux_digest = digest
+        self.passes.append(record)
+        return record
+
+
+def aux_digest(workdir: str) -> Optional[str]:
+    """Hash the auxiliary files of document.tex in workdir (None when there are none)"""
+    digest = hashlib.sha256()
+    found = False
+    for extension in AUX_EXTENSIONS:
+        try:
+            with open(os.path.join(workdir, 'document' + extension), 'rb') as f:
+                data = f.read()
+        except OSError:
+            continue
+        found = True
+        digest.update(extension.encode() + b'\0' + data + b'\0')
+    return digest.hexdigest() if found else None
+
+
+def latex_command(fmt: Optional[Tuple[str, str]], draft: bool = False, engine: str = 'lualatex') -> List[str]:
+    """Return the command compiling document.tex (with a linked format)"""
+    command = [engine, '-interaction=nonstopmode', '-halt-on-error']
+    if draft:
+        command.append('-draftmode')
+    if fmt is not None:
+        command.append(f'-fmt={fmt[0]}')
+    return command + ['document.tex']
+
+
+def link_format(fmt: Tuple[str, str], workdir: str):
+    """Make a cached format visible to LuaLaTeX in workdir (formats are looked up there)"""
+    key, fmt_path = fmt
+    target = os.path.join(workdir, key + '.fmt')
+    try:
+        os.link(fmt_path, target)
+    except OSError:
+        shutil.copyfile(fmt_path, target)
+
+
+def run_passes(workdir: str, fmt: Optional[Tuple[str, str]], controller: PassController,
+               engine: str = 'lualatex') -> List[Dict]:
+    """Run the engine on document.tex in workdir until the controller is done
+
+    Args:
+        workdir: Directory holding document.tex (and the format, if any)
+        fmt: (key, path) of the format to start from, or None
+        controller: PassController of the document (with any passes already run)
+        engine: 'lualatex' or 'pdflatex'
+
+    Returns:
+        The records of every pass run
+
+    Raises:
+        RuntimeError: The engine failed or timed out
+    """
+    name = LATEX_ENGINE_NAMES[engine]
+    draft = controller.next_pass()
+    while draft is not None:
+        started = time.monotonic()
+        try:
+            result = subprocess.run(latex_command(fmt, draft, engine), cwd=workdir, env=latex_environment(),
+                                    capture_output=True, encoding='utf-8', errors='replace', timeout=LATEX_TIMEOUT)
+        except subprocess.TimeoutExpired as e:
+            raise RuntimeError(f"{name} timed out after {LATEX_TIMEOUT} s") from e
+        log = read_latex_log(workdir, result.stdout)
+        if result.returncode != 0:
+            raise RuntimeError(f"{name} failed: {latex_log_excerpt(log)}")
+        controller.record(workdir, draft, time.monotonic() - started, log)
+        draft = controller.next_pass()
+    return controller.passes
+
+
+def read_latex_log(workdir: str, fallback: str) -> str:
+    """Return the LaTeX log of the last run (its stdout if no log was written)"""
+    try:
+        with open(os.path.join(workdir, 'document.log'), encoding='utf-8', errors='replace') as f:
+            return f.read()
+    except OSError:
+        return fallback
+
+
+def latex_log_excerpt(log: str, max_lines: int = 20) -> str:
+    """Return the error lines of a LaTeX log (or its tail)"""
+    lines = log.splitlines()
+    errors: List[str] = []
+    for index, line in enumerate(lines):
+        if line.startswith('!'):
+            errors.extend(lines[index:index + 3])
+    return '\n'.join((errors or lines)[-max_lines:])
@@ -0,0 +1,74 @@
+"""Choose between pdfLaTeX and LuaLaTeX for a PDF conversion
+
+LuaLaTeX is only needed for what pdfLaTeX cannot typeset: the emoji the
+checkbox mapping injects (and any in the text), scripts beyond Latin, and
+raw LaTeX calling on fontspec or Lua. It starts several times slower, so a
+document whose preprocessed text uses none of them is compiled with
+pdfLaTeX and the non-Lua branch of the Obsidian header instead.
+
+pdfLaTeX typesets, through Pandoc's T1/TS1 font encodings, ASCII, Latin-1,
+most of Latin Extended-A and the usual typographic punctuation
+(PDFLATEX_CHARACTERS). Anything else selects LuaLaTeX.
+"""
+
+import os
+import re
+from typing import Iterable, Optional, Tuple
+
+from .capabilities import get_capabilities
+
+
+# Environment variable: 'auto' (default), or 'lualatex'/'pdflatex' to force one
+LATEX_ENGINE_ENV = 'LATEX_ENGINE'
+LATEX_ENGINES = ('lualatex', 'pdflatex')
+
+# Characters pdfLaTeX's utf8 input encoding maps to T1/TS1 glyphs
+PDFLATEX_CHARACTERS = (
+    '\t\n\r\x20-\x7e'
+    '\xa0-\xff'
+    # Latin Extended-A, without H and T with stroke (T1 has no glyphs for
+    # them), kra, 'n preceded by apostrophe, L with middle dot and long s
+    '\u0100-\u0125\u0128-\u0137\u0139-\u013e\u0141-\u0148\u014a-\u0165\u0168-\u017e'
+    '\u2013\u2014\u2018\u2019\u201a\u201c\u201d\u201e\u2020\u2021\u2022\u2026'
+    '\u2030\u2039\u203a\u20ac\u2122\u2212'
+)
+LUALATEX_CHARACTER_PATTERN = re.compile(f'[^{PDFLATEX_CHARACTERS}]')
+
+# Raw LaTeX that only runs on LuaLaTeX
+LUALATEX_COMMAND_PATTERN = re.compile(
+    r'\\(?:directlua|luaexec|luadirect|setmainfont|setsansfont|setmonofont|newfontfamily|fontspec)\b'
+    r'|\\(?:usepackage|begin)\s*(?:\[[^\]]*\])?\s*\{(?:fontspec|luacode\*?|luatexja|emoji)\}')
+
+
+def requested_engine() -> Optional[str]:
+    """Return the engine forced with $LATEX_ENGINE, or None for automatic selection"""
+    engine = os.environ.get(LATEX_ENGINE_ENV, 'auto').strip().lower()
+    return engine if engine in LATEX_ENGINES else None
+
+
+def select_engine(lines: Iterable[str]) -> Tuple[str, str]:
+    """Pick the LaTeX engine for a preprocessed document
+
+    Args:
+        lines: Lines of the preprocessed Markdown handed to Pandoc, then of
+            any LaTeX added to its preamble (header/footer)
+
+    Returns:
+        (engine, reason): 'lualatex' or 'pdflatex', and why it was chosen
+    """
+    forced = requested_engine()
+    if forced is not None:
+        return forced, f'{LATEX_ENGINE_ENV}={forced}'
+
+    for line in lines:
+        match = LUALATEX_COMMAND_PATTERN.search(line)
+        if match:
+            return 'lualatex', f'uses {match.group(0)}, which needs LuaLaTeX'
+        match = LUALATEX_CHARACTER_PATTERN.search(line)
+        if match:
+            character = match.group(0)
+            return 'lualatex', f'uses U+{ord(character):04X} ({character}), which pdfLaTeX cannot typeset'
+
+    if not get_capabilities().available('pdflatex'):
+        return 'lualatex', 'plain Latin text, but pdflatex is not installed'
+    return 'pdflatex', 'plain Latin text'
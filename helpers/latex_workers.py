@@ -0,0 +1,240 @@
+"""Pool of pre-started LuaLaTeX processes waiting past the preamble
+
+Even from a precompiled format, every LuaLaTeX run starts a process, loads
+the fonts and runs the rest of the preamble before page one. A warm worker
+has done all of that for a known preamble and sits at \\begin{document},
+blocked in Lua on its standard input until a job sends the name of the body
+file to \\input. Only body typesetting is left on the request's critical
+path. Each worker serves one job (TeX cannot be reset); a replacement is
+started as soon as it is taken, and warms up while the job runs.
+
+Enabled with $LATEX_WORKERS (warm workers per preamble, default 0 = off).
+Workers start for a preamble the first time it is compiled, so that first
+compile (and any compile finding no ready worker) runs the usual way.
+"""
+
+import atexit
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from .disk_cache import content_key
+from .font_resolver import latex_environment
+from .latex_compiler import (LATEX_TIMEOUT, PassController, latex_command, latex_log_excerpt,
+                             link_format, read_latex_log, run_passes)
+
+
+# Environment variable: warm workers kept per preamble (0 disables the pool)
+LATEX_WORKERS_ENV = 'LATEX_WORKERS'
+
+# Distinct preambles kept warm at once (the least recently used is stopped)
+MAX_WARM_PREAMBLES = 2
+
+# Replaces the body of the worker's document: wait for a file name, input it.
+# \directlua expands its argument, so the Lua escape \\ is written \string\\
+WAIT_FOR_BODY = r'''\begin{document}
+\directlua{
+  local body = io.read('*l')
+  if body then tex.print('\string\\input{' .. body .. '}') end
+}
+\end{document}
+'''
+
+
+def split_document_body(tex: str) -> Optional[Tuple[str, str]]:
+    """Split a LaTeX document into its preamble and its body
+
+    Returns:
+        (preamble, body) without the \\begin{document}/\\end{document} lines,
+        or None when the document has no body
+    """
+    start = tex.find('\\begin{document}')
+    end = tex.rfind('\\end{document}')
+    if start == -1 or end < start:
+        return None
+    return tex[:start], tex[start + len('\\begin{document}'):end]
+
+
+class LatexWorker:
+    """One LuaLaTeX process waiting at \\begin{document} for a body"""
+
+    def __init__(self, preamble: str, fmt: Optional[Tuple[str, str]]):
+        """
+        Start the process (it loads the preamble in the background)
+
+        Args:
+            preamble: Document preamble (up to \\begin{document})
+            fmt: (key, path) of the format to start from, or None
+        """
+        self.fmt = fmt
+        self.workdir = tempfile.mkdtemp(prefix='latex-worker-')
+        with open(os.path.join(self.workdir, 'document.tex'), 'w', encoding='utf-8') as f:
+            f.write(preamble + WAIT_FOR_BODY)
+        if fmt is not None:
+            link_format(fmt, self.workdir)
+        self.process = subprocess.Popen(
+            latex_command(fmt), cwd=self.workdir, env=latex_environment(), stdin=subprocess.PIPE,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    def alive(self) -> bool:
+        """Whether the process is still waiting (it exits if the preamble fails)"""
+        return self.process.poll() is None
+
+    def typeset(self, body: str) -> str:
+        """Hand the body to the process and wait for the first pass to finish
+
+        Returns:
+            The pass's LaTeX log
+
+        Raises:
+            RuntimeError: LuaLaTeX failed or timed out
+        """
+        with open(os.path.join(self.workdir, 'body.tex'), 'w', encoding='utf-8') as f:
+            f.write(body)
+        try:
+            self.process.stdin.write(b'body.tex\n')
+            self.process.stdin.close()
+            returncode = self.process.wait(timeout=LATEX_TIMEOUT)
+        except subprocess.TimeoutExpired as e:
+            raise RuntimeError(f"LuaLaTeX timed out after {LATEX_TIMEOUT} s") from e
+        except OSError as e:
+            raise RuntimeError(f"LuaLaTeX worker died: {e}") from e
+        log = read_latex_log(self.workdir, '')
+        if returncode != 0:
+            raise RuntimeError(f"LuaLaTeX failed: {latex_log_excerpt(log)}")
+        return log
+
+    def close(self):
+        """Stop the process and remove its directory"""
+        if self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+        if self.process.stdin and not self.process.stdin.closed:
+            self.process.stdin.close()
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+class LatexWorkerPool:
+    """Warm LaTeX workers per preamble"""
+
+    def __init__(self, size: int, max_preambles: int = MAX_WARM_PREAMBLES):
+        """
+        Initialize pool
+
+        Args:
+            size: Warm workers kept per preamble
+            max_preambles: Distinct preambles kept warm at once
+        """
+        self.size = size
+        self.max_preambles = max_preambles
+        self._workers: 'OrderedDict[str, List[LatexWorker]]' = OrderedDict()
+        self._failed = set()
+        self._lock = threading.Lock()
+        self.stats: Dict[str, int] = {'warm': 0, 'cold': 0}
+
+    def compile(self, tex: str, output_path: str, fmt: Optional[Tuple[str, str]]) -> Optional[List[Dict]]:
+        """Compile on a warm worker, running any rerun passes in its directory
+
+        Args:
+            tex: Complete document (as compiled without workers)
+            output_path: Where to write the PDF
+            fmt: (key, path) of the format the document starts from, or None
+
+        Returns:
+            The pass records (the worker's pass is never a draft: it started
+            before the body was known), or None when no worker was ready (the
+            caller compiles the usual way; workers are started for next time)
+
+        Raises:
+            RuntimeError: LuaLaTeX failed
+        """
+        split = split_document_body(tex)
+        if split is None:
+            return None
+        preamble, body = split
+        key = content_key('latex-worker', fmt[0] if fmt else '', preamble)
+
+        worker = self._take(key)
+        self._replenish(key, preamble, fmt)
+        if worker is None:
+            return None
+
+        try:
+            controller = PassController(tex)
+            started = time.monotonic()
+            log = worker.typeset(body)
+            controller.record(worker.workdir, False, time.monotonic() - started, log)
+            # Later passes read the .aux of the first: run them in place
+            with open(os.path.join(worker.workdir, 'document.tex'), 'w', encoding='utf-8') as f:
+                f.write(tex)
+            passes = run_passes(worker.workdir, fmt, controller)
+            shutil.copyfile(os.path.join(worker.workdir, 'document.pdf'), output_path)
+            return passes
+        finally:
+            worker.close()
+
+    def _take(self, key: str) -> Optional[LatexWorker]:
+        """Remove and return a live worker for a preamble"""
+        dead = []
+        worker = None
+        with self._lock:
+            workers = self._workers.get(key, [])
+            if key in self._workers:
+                self._workers.move_to_end(key)
+            while workers and worker is None:
+                candidate = workers.pop(0)
+                if candidate.alive():
+                    worker = candidate
+                else:
+                    # The preamble itself fails: stop warming it
+                    dead.append(candidate)
+                    self._failed.add(key)
+            self.stats['warm' if worker else 'cold'] += 1
+        for candidate in dead:
+            candidate.close()
+        return worker
+
+    def _replenish(self, key: str, preamble: str, fmt: Optional[Tuple[str, str]]):
+        """Top the workers of a preamble up to size, stopping the least recent preamble's"""
+        retired = []
+        with self._lock:
+            if key in self._failed:
+                return
+            workers = self._workers.setdefault(key, [])
+            self._workers.move_to_end(key)
+            while len(workers) < self.size:
+                workers.append(LatexWorker(preamble, fmt))
+            while len(self._workers) > self.max_preambles:
+                retired.extend(self._workers.popitem(last=False)[1])
+        for worker in retired:
+            worker.close()
+
+    def shutdown(self):
+        """Stop every worker"""
+        with self._lock:
+            workers = [worker for group in self._workers.values() for worker in group]
+            self._workers.clear()
+        for worker in workers:
+            worker.close()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_worker_pool() -> Optional[LatexWorkerPool]:
+    """Return the process-wide worker pool, or None when $LATEX_WORKERS is 0"""
+    global _pool
+    size = int(os.environ.get(LATEX_WORKERS_ENV) or 0)
+    if size <= 0:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            _pool = LatexWorkerPool(size)
+            atexit.register(_pool.shutdown)
+        return _pool
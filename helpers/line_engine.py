@@ -0,0 +1,129 @@
+"""Fused single-pass line engine for Obsidian preprocessing
+
+The staged functions in obsidian_preprocessor.py each split the whole document,
+run their own regexes on every line and join the result back together.
+iter_fused_lines walks the lines once instead: the document IR parser
+(document_ir.py) classifies each line once (fence, YAML delimiter, page break
+marker, bold start, list item, callout marker, table row) and applies the
+line rules as it goes, and each block is emitted as soon as it is complete.
+The output is identical to running the stages one after another.
+
+The module also holds the line classifiers and code line wrapping the parser
+uses, and the small generator stages of the streaming conversions:
+normalizing a text source into lines and writing lines back out.
+"""
+
+import re
+import textwrap
+from typing import TYPE_CHECKING, AbstractSet, Iterable, Iterator, List, Optional, TextIO, Union
+
+if TYPE_CHECKING:
+    from .document_ir import MarkdownEmitter
+
+
+CODE_FENCES = ('```', '~~~')
+
+# Compiled line classifiers (shared with the staged functions' patterns)
+LIST_ITEM_PATTERN = re.compile(r'\s*(?:[-*+]|\d+\.)\s')
+CALLOUT_START_PATTERN = re.compile(r'>\s*\[!(\w+)\](?:\s+(.+))?')
+
+
+def wrap_code_line(line: str, max_width: int = 100) -> List[str]:
+    """Wrap a single code block line at spaces, preserving its indentation
+
+    Args:
+        line: Code line longer than max_width
+        max_width: Maximum line width in characters
+
+    Returns:
+        List of wrapped lines (the original line if it cannot be wrapped)
+    """
+    # Preserve leading whitespace
+    leading_space = len(line) - len(line.lstrip())
+    indent = line[:leading_space]
+
+    # Use break_long_words=False to avoid breaking in the middle of words
+    # Use break_on_hyphens=False to keep hyphenated words together
+    wrapped = textwrap.wrap(
+        line[leading_space:],
+        width=max_width - leading_space,
+        break_long_words=False,
+        break_on_hyphens=False,
+        replace_whitespace=False,
+        drop_whitespace=False
+    )
+
+    if not wrapped:
+        # If wrapping failed (e.g., single word longer than max_width), keep original
+        return [line]
+    return [indent + wrapped_line for wrapped_line in wrapped]
+
+
+def iter_fused_lines(lines: Iterable[str], emitter: 'MarkdownEmitter',
+                     features: Optional[AbstractSet[str]] = None) -> Iterator[str]:
+    """Apply the Obsidian conversions to a stream of lines in one pass
+
+    Only the block being collected is held in memory.
+
+    Args:
+        lines: Markdown lines (without trailing newlines)
+        emitter: document_ir.MarkdownEmitter of the output format; its
+            obsidian setting selects the rules the parser applies
+        features: Features detected in the whole document; the stages they
+            do not trigger are skipped. None runs every stage.
+
+    Yields:
+        Converted lines
+    """
+    from .document_ir import iter_blocks  # document_ir imports this module
+    yield from emitter.iter_lines(iter_blocks(lines, emitter.obsidian, features))
+
+
+def iter_source_lines(source: Union[str, TextIO, Iterable[str]]) -> Iterator[str]:
+    """Normalize a text source into lines without trailing newlines
+
+    Accepts a whole document string, a text file object or any iterable of
+    lines. Lines read from a file keep their content exactly as
+    ``content.split('\\n')`` would, including the empty last line of a
+    document that ends with a newline.
+
+    Args:
+        source: Document string, text file object or iterable of lines
+
+    Yields:
+        Lines without their trailing newline
+    """
+    if isinstance(source, str):
+        yield from source.split('\n')
+        return
+
+    ends_with_newline = True
+    for line in source:
+        ends_with_newline = line.endswith('\n')
+        yield line[:-1] if ends_with_newline else line
+
+    # An empty source, like an empty string, is a single empty line
+    if ends_with_newline:
+        yield ''
+
+
+def write_lines(lines: Iterable[str], file_obj: TextIO) -> int:
+    """Write lines to a text file, separated by newlines
+
+    Writing the output of a streaming pipeline this way produces the same
+    file as writing ``'\\n'.join(lines)``.
+
+    Args:
+        lines: Lines without trailing newlines
+        file_obj: Text file object to write to
+
+    Returns:
+        Number of lines written
+    """
+    count = 0
+    for line in lines:
+        if count:
+            file_obj.write('\n')
+        file_obj.write(line)
+        count += 1
+    return count
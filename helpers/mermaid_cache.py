@@ -0,0 +1,78 @@
+"""Persistent cache of rendered Mermaid diagrams
+
+Rendering a diagram starts mmdc (Node plus headless Chromium), which takes
+seconds, while documents are often converted again (the DOCX after the PDF,
+a re-upload after a small edit). Rendered PNGs and PDFs are stored in a
+DiskCache per format, keyed by a hash of the normalized diagram source, the
+render options and the mermaid-cli version, so any conversion in any worker
+process reuses them.
+"""
+
+import os
+import threading
+from typing import Dict, Optional
+
+from .disk_cache import DiskCache, content_key, default_cache_dir
+
+
+# Size limit of the shared cache directory
+MERMAID_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+# Environment variable overriding the cache directory
+MERMAID_CACHE_DIR_ENV = 'MERMAID_CACHE_DIR'
+
+
+def normalize_mermaid_source(code: str) -> str:
+    """Normalize diagram source so cosmetic differences share a cache entry
+
+    Line endings become "\\n", trailing whitespace is removed from every line
+    and leading/trailing blank lines are dropped. None of these change the
+    rendered diagram.
+    """
+    lines = code.replace('\r\n', '\n').replace('\r', '\n').split('\n')
+    return '\n'.join(line.rstrip() for line in lines).strip('\n')
+
+
+def mermaid_cache_key(code: str, scale: float, background: str, renderer_version: str,
+                      output_format: str = 'png') -> str:
+    """Return the cache key of a diagram rendering
+
+    Args:
+        code: Normalized diagram source
+        scale: mmdc scale factor
+        background: mmdc background color
+        renderer_version: mermaid-cli version (a new version re-renders)
+        output_format: Image format ('png' or 'pdf')
+    """
+    return content_key(f'mermaid-{output_format}', renderer_version, str(scale), background, code)
+
+
+_mermaid_caches: Dict[str, DiskCache] = {}
+_mermaid_cache_lock = threading.Lock()
+
+
+def get_mermaid_cache(output_format: str = 'png') -> DiskCache:
+    """Return the process-wide cache of diagrams rendered in one format
+
+    The directory is $MERMAID_CACHE_DIR, or the "mermaid" directory of the
+    default cache root. Processes pointing at the same directory share it;
+    each format's entries carry its suffix and have their own size limit.
+
+    Args:
+        output_format: Image format ('png' or 'pdf')
+    """
+    with _mermaid_cache_lock:
+        if output_format not in _mermaid_caches:
+            directory = os.environ.get(MERMAID_CACHE_DIR_ENV) or default_cache_dir('mermaid')
+            _mermaid_caches[output_format] = DiskCache(
+                directory, max_bytes=MERMAID_CACHE_MAX_BYTES, suffix='.' + output_format)
+        return _mermaid_caches[output_format]
+
+
+def mermaid_cache_stats(cache: Optional[DiskCache] = None) -> Dict[str, float]:
+    """Return the hit/miss counters and hit rate of a diagram cache
+
+    Args:
+        cache: Cache to report on (default: the process-wide cache)
+    """
+    return (cache or get_mermaid_cache()).stats()
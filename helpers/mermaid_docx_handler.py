@@ -1,50 +1,65 @@
 """Handle Mermaid diagrams in DOCX conversion"""
 
 import re
+from io import BytesIO
 from docx.shared import Inches
-from .mermaid_detector import detect_mermaid_blocks
-from .mermaid_renderer import render_mermaid_to_png
+from .document_ir import mermaid_codes, parse_document
+from .mermaid_renderer import render_mermaid_batch, render_mermaid_to_png
+from .obsidian_to_html import HtmlMarkdownEmitter
 
 
 def extract_mermaid_and_render(markdown_content):
     """
     Extract Mermaid diagrams and render them to images
 
+    The document is parsed without Obsidian syntax, so everything but the
+    diagrams is kept as-is. Every diagram is rendered in one batch; one that
+    fails to render keeps its code block.
+
     Returns:
         modified_markdown: Markdown with Mermaid blocks replaced with placeholders
         diagram_images: Dict mapping placeholder IDs to image buffers
     """
-    mermaid_blocks = detect_mermaid_blocks(markdown_content)
-
-    print(f"DEBUG: Found {len(mermaid_blocks)} Mermaid blocks")
-
-    if not mermaid_blocks:
+    document = parse_document(markdown_content, obsidian=False)
+    codes = mermaid_codes(document)
+    if not codes:
         return markdown_content, {}
 
     diagram_images = {}
-    modified_content = markdown_content
+    renderer = mermaid_placeholder_renderer(diagram_images, codes)
+    return HtmlMarkdownEmitter(obsidian=False, mermaid=renderer).emit(document), diagram_images
 
-    # Process blocks in reverse to maintain positions
-    for idx, (start, end, code) in enumerate(reversed(mermaid_blocks)):
-        diagram_id = len(mermaid_blocks) - idx - 1
 
-        try:
-            print(f"DEBUG: Rendering Mermaid diagram {diagram_id}...")
-            # Render to PNG
-            image_buffer = render_mermaid_to_png(code)
-            diagram_images[f"mermaid_{diagram_id}"] = image_buffer
+def mermaid_placeholder_renderer(diagram_images, batch_codes=None):
+    """
+    Build a document IR Mermaid callback producing placeholders
+
+    Rendered image buffers are stored in diagram_images under mermaid_<id>.
+    A diagram that fails to render keeps its code block.
 
-            # Replace with placeholder
-            placeholder = f"__MERMAID_DIAGRAM_{diagram_id}__"
-            modified_content = modified_content[:start] + placeholder + modified_content[end:]
-            print(f"DEBUG: Replaced diagram {diagram_id} with placeholder: {placeholder}")
+    Args:
+        diagram_images: Dict receiving the image buffers
+        batch_codes: Optional sources of every diagram in emission order,
+            rendered up front in one renderer session
+
+    Returns:
+        Callback taking (code, diagram_id) and returning the placeholder or None
+    """
+    rendered = render_mermaid_batch(batch_codes) if batch_codes else []
 
+    def render(code, diagram_id):
+        try:
+            if diagram_id < len(rendered) and batch_codes[diagram_id] == code:
+                if isinstance(rendered[diagram_id], Exception):
+                    raise rendered[diagram_id]
+                diagram_images[f"mermaid_{diagram_id}"] = BytesIO(rendered[diagram_id])
+            else:
+                diagram_images[f"mermaid_{diagram_id}"] = render_mermaid_to_png(code)
         except Exception as e:
-            # If rendering fails, keep the code block
             print(f"Warning: Failed to render Mermaid diagram {diagram_id}: {e}")
-
-    print(f"DEBUG: Modified content includes: {modified_content[:200]}...")
-    return modified_content, diagram_images
+            return None
+        return f"__MERMAID_DIAGRAM_{diagram_id}__"
+    return render
 
 
 def insert_mermaid_images_in_doc(doc, diagram_images):
@@ -1,46 +1,130 @@
 """Handle Mermaid diagrams in PDF conversion via Pandoc"""
 
+import re
 import tempfile
 import os
 from PIL import Image
-from .mermaid_detector import detect_mermaid_blocks
-from .mermaid_renderer import render_mermaid_to_png
+from .document_ir import mermaid_codes, parse_document
+from .mermaid_renderer import render_mermaid_batch, render_mermaid_to_pdf, render_mermaid_to_png
+from .obsidian_preprocessor import LatexMarkdownEmitter
 
 
-def prepare_markdown_with_mermaid_images(markdown_content):
+# PDF text width is ~504pt (7 inches at 72pt/inch); diagrams use at most 85%
+MAX_DIAGRAM_WIDTH_PT = 504 * 0.85
+
+PDF_MEDIABOX_PATTERN = re.compile(
+    rb'/MediaBox\s*\[\s*(-?[\d.]+)\s+(-?[\d.]+)\s+(-?[\d.]+)\s+(-?[\d.]+)\s*\]')
+
+
+def prepare_markdown_with_mermaid_images(markdown_content, output_format='png'):
     """
     Replace Mermaid code blocks with image references for Pandoc
 
+    The document is parsed without Obsidian syntax, so everything but the
+    diagrams is kept as-is. Every diagram is rendered in one batch.
+
+    Args:
+        markdown_content: Markdown text
+        output_format: 'png', or 'pdf' to include vector diagrams
+
     Returns:
         modified_markdown: Markdown with image references
         image_files: List of temporary image file paths to clean up later
     """
-    mermaid_blocks = detect_mermaid_blocks(markdown_content)
-
-    if not mermaid_blocks:
+    document = parse_document(markdown_content, obsidian=False)
+    codes = mermaid_codes(document)
+    if not codes:
         return markdown_content, []
 
     image_files = []
-    modified_content = markdown_content
+    renderer = mermaid_reference_renderer(image_files, codes, output_format)
+    return LatexMarkdownEmitter(obsidian=False, mermaid=renderer).emit(document), image_files
+
+
+def mermaid_reference_renderer(image_files, batch_codes=None, output_format='png'):
+    """
+    Build a document IR Mermaid callback producing image references
+
+    Rendered image paths are appended to image_files as they are produced.
+
+    Args:
+        image_files: List receiving the temporary image paths
+        batch_codes: Optional sources of every diagram in emission order,
+            rendered up front in one renderer session
+        output_format: 'png', or 'pdf' to include vector diagrams
+
+    Returns:
+        Callback taking (code, diagram_id) and returning the replacement markdown
+    """
+    rendered = render_mermaid_batch(batch_codes, output_format=output_format) if batch_codes else []
+
+    def render(code, diagram_id):
+        if diagram_id < len(rendered) and batch_codes[diagram_id] == code:
+            return _mermaid_reference(rendered[diagram_id], diagram_id, image_files, output_format)
+        return _render_mermaid_reference(code, diagram_id, image_files, output_format)
+    return render
+
 
-    # Process blocks in reverse to maintain positions
-    for idx, (start, end, code) in enumerate(reversed(mermaid_blocks)):
-        diagram_id = len(mermaid_blocks) - idx - 1
+def _render_mermaid_reference(code, diagram_id, image_files, output_format='png'):
+    """
+    Render one diagram and return the markdown that replaces its code block
+
+    Returns:
+        Image reference on success, an italic error message on failure
+    """
+    render = render_mermaid_to_pdf if output_format == 'pdf' else render_mermaid_to_png
+    try:
+        image_data = render(code).getvalue()
+    except Exception as e:
+        image_data = e
+    return _mermaid_reference(image_data, diagram_id, image_files, output_format)
+
+
+def pdf_page_width_pt(pdf_data):
+    """
+    Return the width in points of the first page (MediaBox) of a PDF
+
+    Returns:
+        Width in points, or None when no MediaBox is found
+    """
+    match = PDF_MEDIABOX_PATTERN.search(pdf_data)
+    if match is None:
+        return None
+    x0, _, x1, _ = (float(value) for value in match.groups())
+    return abs(x1 - x0)
 
-        try:
-            # Create temporary PNG file
-            temp_png = tempfile.NamedTemporaryFile(suffix='.png', delete=False)
-            temp_png_path = temp_png.name
-            temp_png.close()
 
-            # Render Mermaid to PNG
-            render_mermaid_to_png(code, output_path=temp_png_path)
-            image_files.append(temp_png_path)
+def _mermaid_reference(image_data, diagram_id, image_files, output_format='png'):
+    """
+    Save a rendered diagram and return the markdown that replaces its code block
+
+    Args:
+        image_data: Image bytes in output_format, or the Exception raised while rendering
+        output_format: 'png' or 'pdf'
 
+    Returns:
+        Image reference on success, an italic error message on failure
+    """
+    try:
+        if isinstance(image_data, Exception):
+            raise image_data
+
+        # Create temporary image file
+        temp_image = tempfile.NamedTemporaryFile(suffix='.' + output_format, delete=False)
+        temp_image_path = temp_image.name
+        with temp_image:
+            temp_image.write(image_data)
+        image_files.append(temp_image_path)
+
+        if output_format == 'pdf':
+            # Vector diagrams are cropped to their natural size: the MediaBox
+            # width is the display width in points, no image decoding needed
+            natural_width_pt = pdf_page_width_pt(image_data)
+        else:
             # Check diagram dimensions to prevent upscaling
             # With scale=2 rendering (2x resolution), images are 2x their natural size
             # Strategy: Display at half the pixel width (natural size), with max constraints
-            img = Image.open(temp_png_path)
+            img = Image.open(temp_image_path)
             img_width = img.width
             img.close()
 
@@ -48,26 +132,19 @@ def prepare_markdown_with_mermaid_images(markdown_content):
             # Then convert to points for LaTeX (assuming 96 DPI: 1px = 0.75pt)
             natural_width_pt = (img_width / 2) * 0.75
 
-            # PDF text width is ~504pt (7 inches at 72pt/inch)
-            max_width_pt = 504 * 0.85  # Use max 85% of text width
-
-            if natural_width_pt > max_width_pt:
-                # Large diagram - scale down to fit page (use percentage)
-                size_attr = "{width=85%}"
-            else:
-                # Small/medium diagram - use natural size in points (prevents upscaling)
-                size_attr = f"{{width={natural_width_pt:.0f}pt}}"
-
-            # Replace with markdown image syntax using Pandoc's attribute format
-            image_reference = f"\n\n![Figure {diagram_id + 1}: Mermaid Diagram]({temp_png_path}){size_attr}\n\n"
-            modified_content = modified_content[:start] + image_reference + modified_content[end:]
+        if natural_width_pt is None or natural_width_pt > MAX_DIAGRAM_WIDTH_PT:
+            # Large diagram - scale down to fit page (use percentage)
+            size_attr = "{width=85%}"
+        else:
+            # Small/medium diagram - use natural size in points (prevents upscaling)
+            size_attr = f"{{width={natural_width_pt:.0f}pt}}"
 
-        except Exception as e:
-            # If rendering fails, replace with error message
-            error_msg = f"\n\n*[Mermaid diagram rendering failed: {e}]*\n\n"
-            modified_content = modified_content[:start] + error_msg + modified_content[end:]
+        # Replace with markdown image syntax using Pandoc's attribute format
+        return f"\n\n![Figure {diagram_id + 1}: Mermaid Diagram]({temp_image_path}){size_attr}\n\n"
 
-    return modified_content, image_files
+    except Exception as e:
+        # If rendering fails, replace with error message
+        return f"\n\n*[Mermaid diagram rendering failed: {e}]*\n\n"
 
 
 def cleanup_temp_images(image_files):
@@ -1,19 +1,190 @@
 """Mermaid diagram rendering to images"""
 
+import base64
+import json
+import socket
 import tempfile
+import threading
+import time
 import os
+import shutil
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
-from PIL import Image
+from .capabilities import get_capabilities
+from .mermaid_cache import get_mermaid_cache, mermaid_cache_key, normalize_mermaid_source
+from .single_flight import SingleFlight
 
 
-def render_mermaid_to_png(mermaid_code, output_path=None):
+# Renders (mmdc processes or daemon requests) running at once, process-wide,
+# so a big batch cannot start dozens of Chromiums
+MERMAID_MAX_CONCURRENCY = int(os.environ.get('MERMAID_MAX_CONCURRENCY') or min(4, os.cpu_count() or 1))
+
+# Output formats a diagram can be rendered to (pdf is vector, for LaTeX)
+MERMAID_OUTPUT_FORMATS = ('png', 'pdf')
+
+# Fewest diagrams worth their own mmdc process (each one starts a Chromium)
+MIN_DIAGRAMS_PER_MMDC = 4
+
+_render_slots = threading.BoundedSemaphore(MERMAID_MAX_CONCURRENCY)
+_render_pool = None
+_render_pool_lock = threading.Lock()
+_pool_thread = threading.local()
+
+# Renders in progress, shared by concurrent requests for the same diagram
+_render_flights = SingleFlight()
+
+# Unix socket of the optional warm render service (mermaid_daemon/server.mjs)
+MERMAID_DAEMON_SOCKET_ENV = 'MERMAID_DAEMON_SOCKET'
+DEFAULT_MERMAID_DAEMON_SOCKET = '/tmp/markdown-converter-mermaid.sock'
+
+
+class MermaidDaemonError(Exception):
+    """The render daemon is unreachable or misbehaving (callers fall back to mmdc)"""
+
+
+class MermaidRenderError(Exception):
+    """The render daemon rendered the diagram and it failed (e.g. a syntax error)"""
+
+
+class MermaidDaemonClient:
+    """Client of the warm Mermaid render daemon, over a Unix socket"""
+
+    # Seconds a health check result is trusted
+    HEALTH_TTL = 5.0
+
+    def __init__(self, socket_path, timeout=30.0):
+        """
+        Initialize client
+
+        Args:
+            socket_path: Path of the daemon's Unix socket
+            timeout: Default per-request render timeout in seconds
+        """
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._health = None
+        self._health_checked = 0.0
+        self._lock = threading.Lock()
+
+    def _request(self, request, timeout):
+        """Send one JSON request and return the decoded JSON response"""
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+                connection.settimeout(timeout)
+                connection.connect(self.socket_path)
+                connection.sendall(json.dumps(request).encode('utf-8') + b'\n')
+                chunks = []
+                while True:
+                    chunk = connection.recv(65536)
+                    if not chunk:
+                        break
+                    chunks.append(chunk)
+            return json.loads(b''.join(chunks))
+        except (OSError, ValueError) as e:
+            raise MermaidDaemonError(f"Mermaid daemon request failed: {e}") from e
+
+    def health(self):
+        """Return the daemon's health report (raises MermaidDaemonError)"""
+        response = self._request({'op': 'health'}, timeout=2.0)
+        if not response.get('ok'):
+            raise MermaidDaemonError(f"Mermaid daemon unhealthy: {response}")
+        return response
+
+    def available(self):
+        """Whether the daemon answers health checks (cached for HEALTH_TTL seconds)"""
+        with self._lock:
+            if time.monotonic() - self._health_checked < self.HEALTH_TTL:
+                return self._health is not None
+        health = None
+        if os.path.exists(self.socket_path):
+            try:
+                health = self.health()
+            except MermaidDaemonError:
+                pass
+        with self._lock:
+            self._health = health
+            self._health_checked = time.monotonic()
+        return health is not None
+
+    def version(self):
+        """Return the renderer version reported by the daemon, or None if unavailable"""
+        if not self.available():
+            return None
+        return f"daemon-mermaid-{self._health.get('version', 'unknown')}"
+
+    def render(self, mermaid_code, scale=2, background='transparent', timeout=None, output_format='png'):
+        """
+        Render one diagram on a warm page
+
+        Returns:
+            Image bytes in output_format
+
+        Raises:
+            MermaidRenderError: The diagram failed to render
+            MermaidDaemonError: The daemon could not render it (fall back to mmdc)
+        """
+        timeout = timeout or self.timeout
+        response = self._request({
+            'op': 'render',
+            'code': mermaid_code,
+            'scale': scale,
+            'background': background,
+            'timeout_ms': int(timeout * 1000),
+            'format': output_format,
+        }, timeout=timeout + 5)
+
+        if response.get('ok') and output_format in response:
+            return base64.b64decode(response[output_format])
+        if response.get('ok'):
+            raise MermaidDaemonError(f"Mermaid daemon cannot render {output_format}")
+        if response.get('kind') in ('render', 'timeout'):
+            raise MermaidRenderError(f"Mermaid rendering failed: {response.get('error')}")
+        with self._lock:
+            # Re-check health before trusting the daemon again
+            self._health_checked = 0.0
+        raise MermaidDaemonError(f"Mermaid daemon error: {response.get('error')}")
+
+
+_daemon_clients = {}
+_daemon_clients_lock = threading.Lock()
+
+
+def get_mermaid_daemon():
+    """Return a client of the running render daemon, or None when it is absent"""
+    socket_path = os.environ.get(MERMAID_DAEMON_SOCKET_ENV) or DEFAULT_MERMAID_DAEMON_SOCKET
+    with _daemon_clients_lock:
+        client = _daemon_clients.get(socket_path)
+        if client is None:
+            client = _daemon_clients[socket_path] = MermaidDaemonClient(socket_path)
+    return client if client.available() else None
+
+
+def get_renderer_version():
+    """Return the version of the renderer diagrams go to (daemon or mmdc), or None"""
+    daemon = get_mermaid_daemon()
+    version = daemon.version() if daemon is not None else None
+    return version or get_mermaid_cli_version()
+
+
+def render_mermaid_to_png(mermaid_code, output_path=None, scale=2, background='transparent',
+                          cache=None, use_cache=True):
     """
     Render Mermaid diagram code to PNG image
 
+    Renderings are looked up in (and added to) the persistent diagram cache,
+    so an unchanged diagram only renders once across conversions, and a
+    diagram already rendering for another request is awaited, not rendered
+    again. Diagrams go to the warm render daemon when it runs, to mmdc
+    otherwise.
+
     Args:
         mermaid_code: The Mermaid diagram code
         output_path: Optional output path. If None, returns BytesIO
+        scale: Render scale (2 produces 2x resolution for sharper images)
+        background: Background color
+        cache: DiskCache to use (default: the shared diagram cache)
+        use_cache: Whether to use the cache at all
 
     Returns:
         BytesIO buffer or path to saved PNG
@@ -22,61 +193,334 @@ def render_mermaid_to_png(mermaid_code, output_path=None):
         - Node.js installed
         - @mermaid-js/mermaid-cli installed (npm install -g @mermaid-js/mermaid-cli)
     """
+    return _render_cached(mermaid_code, output_path, 'png', scale, background, cache, use_cache)
+
+
+def render_mermaid_to_pdf(mermaid_code, output_path=None, background='transparent',
+                          cache=None, use_cache=True):
+    """
+    Render Mermaid diagram code to a vector PDF cropped to the diagram
+
+    The page (MediaBox) is the diagram's natural size in points, so LaTeX
+    can include it directly without any bitmap.
+
+    Args:
+        mermaid_code: The Mermaid diagram code
+        output_path: Optional output path. If None, returns BytesIO
+        background: Background color
+        cache: DiskCache to use (default: the shared diagram cache)
+        use_cache: Whether to use the cache at all
+
+    Returns:
+        BytesIO buffer or path to saved PDF
+    """
+    return _render_cached(mermaid_code, output_path, 'pdf', 1, background, cache, use_cache)
+
+
+def _render_cached(mermaid_code, output_path, output_format, scale, background, cache, use_cache):
+    """Render one diagram through the persistent cache (see render_mermaid_to_png)"""
+    # The key includes the renderer version, so the cache is only used when
+    # a renderer is installed and a new version never serves stale images
+    version = get_renderer_version() if use_cache else None
+    mermaid_code = normalize_mermaid_source(mermaid_code)
+    key = mermaid_cache_key(mermaid_code, scale, background, version or '', output_format)
+
+    if version is None:
+        data = _render_flights.do(key, lambda: _render_image(mermaid_code, scale, background, output_format))
+    else:
+        cache = cache or get_mermaid_cache(output_format)
+        data = cache.get(key)
+        if data is None:
+            def render():
+                data = _render_image(mermaid_code, scale, background, output_format)
+                cache.put(key, data)
+                return data
+            data = _render_flights.do(key, render)
+
+    if output_path is None:
+        return BytesIO(data)
+    with open(output_path, 'wb') as output_file:
+        output_file.write(data)
+    return output_path
+
+
+def _render_image(mermaid_code, scale, background, output_format='png'):
+    """
+    Render a diagram on the render daemon, or with mmdc when it is absent
+
+    Returns:
+        Image bytes in output_format (PNG by default)
+    """
+    daemon = get_mermaid_daemon()
+    if daemon is not None:
+        try:
+            with _render_slots:
+                return daemon.render(mermaid_code, scale, background, output_format=output_format)
+        except MermaidDaemonError as e:
+            print(f"Warning: {e}; falling back to mmdc")
+    return _run_mmdc(mermaid_code, scale, background, output_format)
+
+
+def _mmdc_format_args(output_format):
+    """Extra mmdc arguments for an output format"""
+    # Without --pdfFit the diagram sits on a whole Letter page
+    return ['--pdfFit'] if output_format == 'pdf' else []
+
+
+def _run_mmdc(mermaid_code, scale, background, output_format='png'):
+    """
+    Render a diagram with mmdc
+
+    Returns:
+        Image bytes in output_format (PNG by default)
+    """
     # Create temporary file for mermaid code
     with tempfile.NamedTemporaryFile(mode='w', suffix='.mmd', delete=False, encoding='utf-8') as temp_mmd:
         temp_mmd.write(mermaid_code)
         temp_mmd_path = temp_mmd.name
 
     # Create temporary output file
-    if output_path is None:
-        temp_png = tempfile.NamedTemporaryFile(suffix='.png', delete=False)
-        temp_png_path = temp_png.name
-        temp_png.close()
-    else:
-        temp_png_path = output_path
+    temp_image = tempfile.NamedTemporaryFile(suffix='.' + output_format, delete=False)
+    temp_image_path = temp_image.name
+    temp_image.close()
 
     try:
-        # Try to render using mmdc (mermaid-cli) with high scale for better quality
-        # Scale 2 produces 2x resolution for sharper images
-        result = subprocess.run(
-            ['mmdc', '-i', temp_mmd_path, '-o', temp_png_path, '-b', 'transparent', '-s', '2'],
-            capture_output=True,
-            text=True,
-            timeout=30
-        )
+        with _render_slots:
+            result = subprocess.run(
+                ['mmdc', '-i', temp_mmd_path, '-o', temp_image_path, '-b', background, '-s', str(scale)]
+                + _mmdc_format_args(output_format),
+                capture_output=True,
+                text=True,
+                timeout=30
+            )
 
         if result.returncode != 0:
             raise Exception(f"Mermaid rendering failed: {result.stderr}")
 
-        # Read the PNG into a buffer
-        if output_path is None:
-            with open(temp_png_path, 'rb') as png_file:
-                buffer = BytesIO(png_file.read())
-            buffer.seek(0)
-            return buffer
-        else:
-            return temp_png_path
+        with open(temp_image_path, 'rb') as image_file:
+            return image_file.read()
 
     finally:
         # Clean up temporary files
-        if os.path.exists(temp_mmd_path):
-            os.remove(temp_mmd_path)
-        if output_path is None and os.path.exists(temp_png_path):
-            os.remove(temp_png_path)
+        for path in (temp_mmd_path, temp_image_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def render_mermaid_batch(mermaid_codes, scale=2, background='transparent', cache=None, use_cache=True,
+                         output_format='png'):
+    """
+    Render many Mermaid diagrams, running mmdc as few times as possible
+
+    Cached diagrams are reused, and identical diagrams (in the batch, or
+    rendering for a concurrent request) render once. The others go to the
+    warm render daemon when it runs, else through one mmdc invocation in
+    markdown mode (one Chromium start for the whole batch). A diagram that fails does not fail the batch:
+    the invocation is split in halves until every bad diagram is isolated
+    and gets its own error.
+
+    Args:
+        mermaid_codes: Diagram sources, e.g. every diagram of a document or of
+            a whole batch job
+        scale: Render scale
+        background: Background color
+        cache: DiskCache to use (default: the shared diagram cache)
+        use_cache: Whether to use the cache at all
+        output_format: 'png', or 'pdf' for vector diagrams (scale is ignored)
+
+    Returns:
+        List with, for each diagram in order, its image bytes or the Exception
+        raised while rendering it
+    """
+    if output_format not in MERMAID_OUTPUT_FORMATS:
+        raise ValueError(f"Unsupported Mermaid output format: {output_format}")
+    if output_format == 'pdf':
+        scale = 1
+
+    version = get_renderer_version() if use_cache else None
+    if version is not None:
+        cache = cache or get_mermaid_cache(output_format)
+
+    results = [None] * len(mermaid_codes)
+    # Diagram key -> positions still to render (identical diagrams render once)
+    pending = {}
+    codes = {}
+    for index, code in enumerate(mermaid_codes):
+        code = normalize_mermaid_source(code)
+        key = mermaid_cache_key(code, scale, background, version or '', output_format)
+        if key in pending:
+            pending[key].append(index)
+            continue
+        if version is not None:
+            results[index] = cache.get(key)
+            if results[index] is not None:
+                continue
+        pending[key] = [index]
+        codes[key] = code
+    _render_flights.record_shared(sum(len(indices) - 1 for indices in pending.values()))
+
+    # Render the diagrams no concurrent request is rendering already
+    owned, waiting = _render_flights.begin(pending)
+    rendered = {}
+    try:
+        batch = _render_batch([codes[key] for key in owned], scale, background, output_format) if owned else []
+    except BaseException as e:
+        for key in owned:
+            _render_flights.finish(key, error=e)
+        raise
+    for key, result in zip(owned, batch):
+        try:
+            if version is not None and not isinstance(result, Exception):
+                cache.put(key, result)
+        finally:
+            _render_flights.finish(key, result)
+        rendered[key] = result
+
+    for key, flight in waiting.items():
+        try:
+            rendered[key] = flight.wait()
+        except Exception as e:
+            rendered[key] = e
+
+    for key, indices in pending.items():
+        for index in indices:
+            results[index] = rendered[key]
+    return results
+
+
+def mermaid_render_stats():
+    """
+    Return the render deduplication counters
+
+    Returns:
+        Dict with 'executed' (diagrams actually rendered), 'shared' (renders
+        avoided by reusing an identical diagram in progress or in the same
+        batch) and 'in_flight'
+    """
+    return _render_flights.stats()
+
+
+def _run_in_pool(function, items):
+    """
+    Apply function to every item on the shared render thread pool
+
+    Called from a pool thread, the items run in that thread instead, so
+    nested batches never wait on their own pool.
+
+    Returns:
+        Results in item order
+    """
+    global _render_pool
+    if len(items) < 2 or getattr(_pool_thread, 'active', False):
+        return [function(item) for item in items]
+
+    with _render_pool_lock:
+        if _render_pool is None:
+            _render_pool = ThreadPoolExecutor(max_workers=MERMAID_MAX_CONCURRENCY,
+                                              thread_name_prefix='mermaid-render',
+                                              initializer=setattr, initargs=(_pool_thread, 'active', True))
+    return list(_render_pool.map(function, items))
+
+
+def _render_batch(mermaid_codes, scale, background, output_format='png'):
+    """
+    Render diagrams concurrently, on the render daemon or in mmdc batches
+
+    Daemon requests go out one per diagram. Without the daemon the diagrams
+    are split into at most MERMAID_MAX_CONCURRENCY mmdc batches.
+
+    Returns:
+        List of image bytes or Exception per diagram
+    """
+    if get_mermaid_daemon() is None:
+        count = min(MERMAID_MAX_CONCURRENCY, -(-len(mermaid_codes) // MIN_DIAGRAMS_PER_MMDC))
+        size = -(-len(mermaid_codes) // count) if count else 0
+        chunks = [mermaid_codes[start:start + size] for start in range(0, len(mermaid_codes), size or 1)]
+        rendered = _run_in_pool(lambda chunk: _run_mmdc_batch(chunk, scale, background, output_format), chunks)
+        return [result for chunk in rendered for result in chunk]
+
+    def render(code):
+        try:
+            return _render_image(code, scale, background, output_format)
+        except Exception as e:
+            return e
+    return _run_in_pool(render, mermaid_codes)
+
+
+def _run_mmdc_batch(mermaid_codes, scale, background, output_format='png'):
+    """
+    Render diagrams with one mmdc run, splitting the batch when it fails
+
+    Returns:
+        List of image bytes or Exception per diagram
+    """
+    if not mermaid_codes:
+        return []
+    if len(mermaid_codes) == 1:
+        try:
+            return [_run_mmdc(mermaid_codes[0], scale, background, output_format)]
+        except Exception as e:
+            return [e]
+
+    temp_dir = tempfile.mkdtemp(prefix='mermaid-batch-')
+    input_path = os.path.join(temp_dir, 'diagrams.md')
+    output_path = os.path.join(temp_dir, 'rendered.md')
+    try:
+        with open(input_path, 'w', encoding='utf-8') as batch_file:
+            for code in mermaid_codes:
+                batch_file.write(f"```mermaid\n{code}\n```\n\n")
+
+        # In markdown mode mmdc writes the n-th diagram to rendered-<n>.<format>
+        try:
+            with _render_slots:
+                result = subprocess.run(
+                    ['mmdc', '-i', input_path, '-o', output_path, '-e', output_format,
+                     '-b', background, '-s', str(scale)] + _mmdc_format_args(output_format),
+                    capture_output=True,
+                    text=True,
+                    timeout=30 + 10 * len(mermaid_codes)
+                )
+            succeeded = result.returncode == 0
+        except subprocess.TimeoutExpired:
+            succeeded = False
+
+        images = []
+        if succeeded:
+            for number in range(1, len(mermaid_codes) + 1):
+                image_path = os.path.join(temp_dir, f'rendered-{number}.{output_format}')
+                if not os.path.exists(image_path):
+                    break
+                with open(image_path, 'rb') as png_file:
+                    images.append(png_file.read())
+        if len(images) == len(mermaid_codes):
+            return images
+
+    except FileNotFoundError as e:
+        # mmdc is not installed: every diagram fails the same way
+        return [e] * len(mermaid_codes)
+
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    # Isolate the failing diagrams
+    middle = len(mermaid_codes) // 2
+    return (_run_mmdc_batch(mermaid_codes[:middle], scale, background, output_format)
+            + _run_mmdc_batch(mermaid_codes[middle:], scale, background, output_format))
+
+
+def get_mermaid_cli_version():
+    """Return the installed mermaid-cli version, or None if mmdc is unavailable (cached with a TTL)"""
+    return get_capabilities().version('mmdc')
 
 
 def check_mermaid_cli_installed():
     """Check if mermaid-cli is installed"""
-    try:
-        result = subprocess.run(
-            ['mmdc', '--version'],
-            capture_output=True,
-            text=True,
-            timeout=5
-        )
-        return result.returncode == 0
-    except (subprocess.SubprocessError, FileNotFoundError):
-        return False
+    return get_capabilities().available('mmdc')
+
+
+def mermaid_renderer_available():
+    """Whether diagrams can be rendered at all (render daemon or mmdc)"""
+    return get_mermaid_daemon() is not None or get_mermaid_cli_version() is not None
 
 
 def get_mermaid_installation_instructions():
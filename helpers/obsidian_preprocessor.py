@@ -5,9 +5,24 @@ that can be properly rendered by Pandoc.
 """
 
 import re
-from typing import Tuple, List
+from typing import FrozenSet, Iterable, Iterator, List, Optional, TextIO, Tuple, Union
 from .table_width_optimizer import optimize_table_widths
 from .page_break_handler import convert_page_breaks_to_latex
+from .line_engine import iter_fused_lines, iter_source_lines, wrap_code_line
+from .block_cache import BlockCache
+from .feature_sniffer import record_report, sniff_features
+from .inline_scanner import convert_inline, replace_links
+from .document_ir import (
+    CHECKBOX_PATTERN,
+    Callout,
+    Checkbox,
+    CodeBlock,
+    LineBreak,
+    MarkdownEmitter,
+    MermaidRenderer,
+    PageBreak,
+    conversion_stages,
+)
 
 
 # Callout type mapping to colors and icons
@@ -97,73 +112,71 @@ CHECKBOX_TYPES = {
 }
 
 
+# LaTeX markup of inline spans (opening, closing)
+LATEX_HIGHLIGHT = ('\\hl{', '}')
+LATEX_UNDERLINE = ('\\underline{', '}')
+
+
 def convert_highlighting(content: str) -> str:
     """Convert ==highlighted text== to LaTeX highlighting"""
     # Replace ==text== with \hl{text} for LaTeX soul package
-    content = re.sub(r'==([^=]+)==', r'\\hl{\1}', content)
-    return content
+    return convert_inline(content, LATEX_HIGHLIGHT, links=False)
 
 
 def convert_underline(content: str) -> str:
     """Convert <u>text</u> to LaTeX underline"""
-    content = re.sub(r'<u>([^<]+)</u>', r'\\underline{\1}', content)
-    return content
+    return convert_inline(content, None, LATEX_UNDERLINE, links=False)
 
 
 def convert_obsidian_images(content: str) -> str:
     """Convert ![[image.png]] to standard markdown ![](image.png)"""
     # Handle images with optional sizing and alignment
-    content = re.sub(
-        r'!\[\[([^\]|]+?)(?:\|([^\]]+))?\]\]',
-        lambda m: f'![]({m.group(1)})',
-        content
-    )
-    return content
+    return replace_links(content, sections=False, wikilinks=False)
 
 
 def convert_wikilinks(content: str) -> str:
     """Convert [[wikilink]] to plain text or standard links"""
     # Remove section links like [[Note#Section]]
-    content = re.sub(r'!\[\[([^\]]+?)#([^\]]+?)\]\]', r'', content)
+    content = replace_links(content, images=False, wikilinks=False)
 
     # Convert regular wikilinks to plain text
     # (could be enhanced to actual links if we had a mapping)
-    content = re.sub(r'\[\[([^\]|]+?)(?:\|([^\]]+))?\]\]', r'\2' if r'\2' else r'\1', content)
-    return content
+    return replace_links(content, images=False, sections=False)
 
 
-def convert_extended_checkboxes(content: str) -> str:
-    """Convert Obsidian extended checkboxes to standard checkboxes with text labels"""
-    lines = content.split('\n')
-    converted_lines = []
+def _convert_checkbox_line(line: str) -> str:
+    """Convert a single extended checkbox line, other lines are returned unchanged"""
+    # Match extended checkbox patterns: - [X] text
+    match = CHECKBOX_PATTERN.match(line)
+    if not match:
+        return line
 
-    for line in lines:
-        # Match extended checkbox patterns: - [X] text
-        match = re.match(r'^(\s*)- \[(.)\] (.+)$', line)
-        if match:
-            indent, checkbox_type, text = match.groups()
-            checkbox_info = CHECKBOX_TYPES.get(checkbox_type, ('[ ]', ''))
-
-            if isinstance(checkbox_info, tuple):
-                checkbox_symbol, label = checkbox_info
-            else:
-                # Fallback for old format
-                checkbox_symbol = '[ ]'
-                label = ''
+    return _format_checkbox(*match.groups())
 
-            # For standard checkboxes, keep them as-is
-            if checkbox_type in [' ', 'x', 'X']:
-                converted_lines.append(line)
-            else:
-                # Convert to standard checkbox with text label
-                if label:
-                    converted_lines.append(f'{indent}- {checkbox_symbol} {label} {text}')
-                else:
-                    converted_lines.append(f'{indent}- {checkbox_symbol} {text}')
-        else:
-            converted_lines.append(line)
 
-    return '\n'.join(converted_lines)
+def _format_checkbox(indent: str, checkbox_type: str, text: str) -> str:
+    """Format a checkbox line from its indent, type character and text"""
+    # For standard checkboxes, keep them as-is
+    if checkbox_type in [' ', 'x', 'X']:
+        return f'{indent}- [{checkbox_type}] {text}'
+
+    checkbox_info = CHECKBOX_TYPES.get(checkbox_type, ('[ ]', ''))
+    if isinstance(checkbox_info, tuple):
+        checkbox_symbol, label = checkbox_info
+    else:
+        # Fallback for old format
+        checkbox_symbol = '[ ]'
+        label = ''
+
+    # Convert to standard checkbox with text label
+    if label:
+        return f'{indent}- {checkbox_symbol} {label} {text}'
+    return f'{indent}- {checkbox_symbol} {text}'
+
+
+def convert_extended_checkboxes(content: str) -> str:
+    """Convert Obsidian extended checkboxes to standard checkboxes with text labels"""
+    return '\n'.join(_convert_checkbox_line(line) for line in content.split('\n'))
 
 
 def convert_callouts(content: str) -> str:
@@ -389,8 +402,6 @@ def wrap_code_block_lines(content: str, max_width: int = 100) -> str:
     Returns:
         Markdown content with wrapped code block lines
     """
-    import textwrap
-
     lines = content.split('\n')
     result = []
     in_code_block = False
@@ -412,30 +423,7 @@ def wrap_code_block_lines(content: str, max_width: int = 100) -> str:
 
         # If we're in a code block and the line is too long, wrap it
         if in_code_block and len(line) > max_width:
-            # Preserve leading whitespace
-            leading_space = len(line) - len(line.lstrip())
-            indent = line[:leading_space]
-            content_part = line[leading_space:]
-
-            # Wrap the content part
-            # Use break_long_words=False to avoid breaking in the middle of words
-            # Use break_on_hyphens=False to keep hyphenated words together
-            wrapped = textwrap.wrap(
-                content_part,
-                width=max_width - leading_space,
-                break_long_words=False,
-                break_on_hyphens=False,
-                replace_whitespace=False,
-                drop_whitespace=False
-            )
-
-            # If wrapping produced multiple lines, add them with original indentation
-            if wrapped:
-                for wrapped_line in wrapped:
-                    result.append(indent + wrapped_line)
-            else:
-                # If wrapping failed (e.g., single word longer than max_width), keep original
-                result.append(line)
+            result.extend(wrap_code_line(line, max_width))
         else:
             # Not in code block or line is short enough
             result.append(line)
@@ -443,71 +431,238 @@ def wrap_code_block_lines(content: str, max_width: int = 100) -> str:
     return '\n'.join(result)
 
 
-def preprocess_obsidian_syntax(content: str) -> str:
+def preprocess_obsidian_syntax(content: str, cache: Optional[BlockCache] = None,
+                               report: Optional[dict] = None) -> str:
     """Main preprocessing function that converts all Obsidian syntax
 
+    Runs the PDF path's conversion in a single pass over the lines (see
+    line_engine.iter_fused_lines): each block is parsed into the document IR
+    and emitted by LatexMarkdownEmitter, so this is exactly the markdown
+    Pandoc receives (without Mermaid rendering).
+
     Args:
         content: Raw markdown content with Obsidian syntax
+        cache: Optional block cache; unchanged blocks reuse their output
+        report: Optional dict receiving the detected 'features' and the
+            'stages' that ran (stages whose trigger never appears are skipped)
 
     Returns:
         Preprocessed markdown content compatible with Pandoc
     """
-    # Order matters! Process in this sequence:
+    features = sniff_features(content)
+    record_report(report, features, conversion_stages(features, render_mermaid=False))
+    return '\n'.join(iter_fused_lines(content.split('\n'), LatexMarkdownEmitter(cache=cache), features))
+
+
+
+def iter_preprocess_obsidian_syntax(source: Union[str, TextIO, Iterable[str]],
+                                    cache: Optional[BlockCache] = None) -> Iterator[str]:
+    """Streaming version of preprocess_obsidian_syntax
 
-    # 0. Optimize table column widths (do this first, before other processing)
-    content = optimize_table_widths(content)
+    Only the block being collected (a paragraph, table, callout or code
+    block) is held in memory, so large exports can be written straight to
+    the file handed to Pandoc. Every stage runs, as the features of a stream
+    are not known up front; the output matches the batch function.
 
-    # 1. Wrap long lines in code blocks to prevent PDF overflow
-    content = wrap_code_block_lines(content)
+    Args:
+        source: Document string, text file object or iterable of lines
+        cache: Optional block cache; unchanged blocks reuse their output
 
-    # 2. Convert page break markers (HTML comments, \newpage, ---) to \newpage
-    # Do this early but after code block wrapping to preserve code block tracking
-    content = convert_page_break_markers(content)
+    Yields:
+        Preprocessed lines without trailing newlines
+    """
+    yield from iter_fused_lines(iter_source_lines(source), LatexMarkdownEmitter(cache=cache))
 
-    # 3. Fix consecutive bold label lines first
-    content = fix_consecutive_bold_lines(content)
+class LatexMarkdownEmitter(MarkdownEmitter):
+    """Emit a parsed document as Pandoc markdown with raw LaTeX (PDF path)
 
-    # 4. Fix missing blank lines before lists (for proper Pandoc parsing)
-    content = fix_list_blank_lines(content)
+    Converts the document IR (see document_ir.py) like the staged functions
+    above: tcolorbox callouts, \\hl highlights, \\newpage page breaks and
+    wrapped code block lines.
+    """
 
-    # 5. Convert callouts (they contain other syntax)
-    content = convert_callouts(content)
+    HIGHLIGHT = LATEX_HIGHLIGHT
+    UNDERLINE = LATEX_UNDERLINE
+
+    def __init__(self, obsidian: bool = True, mermaid: Optional[MermaidRenderer] = None,
+                 cache: Optional[BlockCache] = None, max_width: int = 100):
+        """
+        Initialize emitter
+
+        Args:
+            obsidian: Whether Obsidian syntax is converted (must match the parse)
+            mermaid: Optional callback replacing Mermaid diagrams
+            cache: Optional block cache; unchanged blocks reuse their output
+            max_width: Maximum code line width before wrapping
+        """
+        super().__init__(obsidian=obsidian, mermaid=mermaid, cache=cache)
+        self.max_width = max_width
+
+    def cache_scope(self) -> str:
+        return f'{super().cache_scope()}:{self.max_width}'
+
+    def emit_line_break(self, node: LineBreak) -> List[str]:
+        return ['\\']
+
+    def emit_checkbox(self, node: Checkbox) -> List[str]:
+        return [_format_checkbox(node.indent, node.mark, self.render_inline(node.parts))]
+
+    def emit_callout(self, node: Callout) -> List[str]:
+        content = self.render_inline(node.content).split('\n') if node.content else []
+        lines = []
+        for block in _format_callout(node.kind, self.render_inline(node.title), content):
+            for line in block.split('\n'):
+                lines.append(_convert_checkbox_line(line) if '- [' in line else line)
+        return lines
+
+    def emit_page_break(self, node: PageBreak) -> List[str]:
+        if not self.obsidian:
+            return [node.marker]
+        return ['', '\\newpage', '']
+
+    def emit_code_block(self, node: CodeBlock) -> List[str]:
+        if not self.obsidian:
+            return node.lines
+        return list(self._iter_wrapped_lines(node.lines))
+
+    def table_lines(self, lines: Iterable[str]) -> Iterator[str]:
+        # Long rows of the raw LaTeX block are wrapped like code lines
+        return self._iter_wrapped_lines(lines)
+
+    def _iter_wrapped_lines(self, lines: Iterable[str]) -> Iterator[str]:
+        """Wrap lines longer than max_width, leaving fence lines alone"""
+        for line in lines:
+            if len(line) > self.max_width and not line.strip().startswith(('```', '~~~')):
+                yield from wrap_code_line(line, self.max_width)
+            else:
+                yield line
+
+
+# Preamble features: each optional part of the enhanced LaTeX header is only
+# loaded when the preprocessed document (or the header/footer LaTeX) matches
+HEADER_FEATURE_PATTERNS = {
+    'callouts': re.compile(r'\\begin\{callout'),
+    'icons': re.compile(r'\\fa[A-Z]'),
+    'highlights': re.compile(r'\\hl\{'),
+    # ulem makes \emph underline, so emphasis must keep loading it
+    'emphasis': re.compile(r'[*_]|\\emph\b|<em>|<i>'),
+    'code_blocks': re.compile(r'^\s*(?:```|~~~)(?!\{=)|^(?: {4}|\t)\S|\\begin\{(?:verbatim|Highlighting)\}'),
+    # Pipe, grid and simple/multiline (dashed rule) tables
+    'tables': re.compile(r'^\s*(?:\||\+[-=])|^\s*-{3,}(?:\s+-+)*\s*$|\\begin\{longtable\}'),
+    'tabularx': re.compile(r'\\begin\{tabularx\}'),
+    'quotes': re.compile(r'^\s*>'),
+    # Bullets and (fancy) numbered lists: 1. a) (iv) #.
+    'lists': re.compile(r'^\s*(?:[-*+]|\(?(?:\d+|[A-Za-z]|[ivxlcdmIVXLCDM]+|#)[.)])\s'
+                        r'|\\begin\{(?:itemize|enumerate)\}'),
+    'figures': re.compile(r'!\[|\\includegraphics|<img'),
+    # Symbols and emoji, which Helvetica Neue lacks
+    'emoji': re.compile('[\u2100-\U0010FFFF]'),
+}
 
-    # 6. Convert Obsidian-specific links and embeds
-    content = convert_obsidian_images(content)
-    content = convert_wikilinks(content)
+# Callout environments with their color and title prefix
+CALLOUT_ENVIRONMENTS = {
+    'calloutNote': ('calloutblue', 'NOTE'),
+    'calloutInfo': ('calloutblue', 'INFO'),
+    'calloutTodo': ('calloutblue', 'TODO'),
+    'calloutTip': ('calloutgreen', 'TIP'),
+    'calloutSuccess': ('calloutgreen', 'SUCCESS'),
+    'calloutQuestion': ('calloutyellow', 'QUESTION'),
+    'calloutWarning': ('calloutorange', 'WARNING'),
+    'calloutDanger': ('calloutred', 'DANGER'),
+    'calloutError': ('calloutred', 'ERROR'),
+    'calloutBug': ('calloutred', 'BUG'),
+    'calloutExample': ('calloutpurple', 'EXAMPLE'),
+}
+# Opening fence of a raw block (```{=latex}), which is not code
+RAW_BLOCK_PATTERN = re.compile(r'^\s*(?:```|~~~)\{=')
+CALLOUT_ENVIRONMENT_PATTERN = re.compile(r'\\begin\{(callout[A-Za-z]+)\}')
 
-    # 7. Convert extended checkboxes
-    content = convert_extended_checkboxes(content)
+CALLOUT_ENVIRONMENT_TEMPLATE = r'''\newtcolorbox{%s}[1]{
+    colback=%s!5!white,
+    colframe=%s!75!black,
+    fonttitle=\bfseries,
+    title={%s: #1},
+    arc=2mm,
+    boxrule=1pt,
+    left=3mm,
+    right=3mm,
+    top=2mm,
+    bottom=2mm
+}
+'''
 
-    # 8. Convert text formatting
-    content = convert_highlighting(content)
-    content = convert_underline(content)
 
-    return content
+def detect_header_features(lines: Iterable[str]) -> FrozenSet[str]:
+    """Detect which parts of the enhanced LaTeX header a document needs
 
+    Args:
+        lines: Lines of the preprocessed Markdown, and of any LaTeX added to
+            the preamble (header/footer)
 
-def get_enhanced_latex_header(use_lualatex=False) -> str:
+    Returns:
+        Names from HEADER_FEATURE_PATTERNS, plus the callout environments
+        used (keys of CALLOUT_ENVIRONMENTS)
+    """
+    features = set()
+    pending = dict(HEADER_FEATURE_PATTERNS)
+    in_raw_block = False
+    for line in lines:
+        # The closing fence of a raw LaTeX block is not code either
+        fence = line.lstrip().startswith(('```', '~~~'))
+        if in_raw_block and fence:
+            in_raw_block = False
+            continue
+        if fence and RAW_BLOCK_PATTERN.match(line):
+            in_raw_block = True
+        for name, pattern in list(pending.items()):
+            if pattern.search(line):
+                features.add(name)
+                del pending[name]
+        if '\\begin{callout' in line:
+            features.update(CALLOUT_ENVIRONMENT_PATTERN.findall(line))
+    return frozenset(features)
+
+
+def get_enhanced_latex_header(use_lualatex=False, features=None, fonts=None, sans_serif=False) -> str:
     """Generate enhanced LaTeX header for better Obsidian feature support
 
     Args:
         use_lualatex: If True, generate LuaLaTeX-compatible header (avoids soul package)
+        features: Features from detect_header_features; only the packages and
+            definitions they need are emitted. None emits the full header
+        fonts: FontMap from font_resolver.get_font_map, loading the LuaLaTeX
+            fonts by file; None asks for them by name
+        sans_serif: pdfLaTeX header only: set the text in a Helvetica clone,
+            closer to the LuaLaTeX output, instead of the default Computer
+            Modern (default: False)
 
     Returns:
         LaTeX header content as string
     """
+    def uses(feature):
+        return features is None or feature in features
+
     # Engine-specific packages
     if use_lualatex:
         engine_specific = r'''
 % Obsidian formatting support for LuaLaTeX
 \usepackage{etoolbox}      % For code hooks
 \usepackage{xcolor}        % For colors
-\usepackage{tcolorbox}     % For callout boxes
-\usepackage{fontawesome5}  % For icons (if available)
-\usepackage{enumitem}      % For better list control
-\usepackage{fontspec}      % For font configuration
-\usepackage{ulem}          % For underline support
-
+'''
+        if uses('callouts'):
+            engine_specific += '\\usepackage{tcolorbox}     % For callout boxes\n'
+        if uses('icons'):
+            engine_specific += '\\usepackage{fontawesome5}  % For icons (if available)\n'
+        if uses('lists'):
+            engine_specific += '\\usepackage{enumitem}      % For better list control\n'
+        engine_specific += '\\usepackage{fontspec}      % For font configuration\n'
+        if uses('emphasis'):
+            engine_specific += '\\usepackage{ulem}          % For underline support\n'
+
+        if fonts is not None:
+            engine_specific += fonts.latex(emoji=uses('emoji'))
+        elif uses('emoji'):
+            engine_specific += r'''
 % Configure fallback font for emoji support
 \directlua{
   luaotfload.add_fallback("emojifallback", {
@@ -517,11 +672,20 @@ def get_enhanced_latex_header(use_lualatex=False) -> str:
 
 % Set main font with emoji fallback
 \setmainfont{Helvetica Neue}[RawFeature={fallback=emojifallback}]
-
+'''
+        else:
+            engine_specific += r'''
+% Set main font
+\setmainfont{Helvetica Neue}
+'''
+        if fonts is None:
+            engine_specific += r'''
 % Use default monospace font for better line breaking in code blocks
 % Custom fonts can interfere with fvextra's character width calculations
 \setmonofont{Latin Modern Mono}[Scale=0.9]
-
+'''
+        if uses('highlights'):
+            engine_specific += r'''
 % Define custom highlight command using colorbox (replacement for soul's \hl)
 \definecolor{highlightyellow}{RGB}{255, 255, 0}
 \providecommand{\hl}{}
@@ -531,13 +695,26 @@ def get_enhanced_latex_header(use_lualatex=False) -> str:
         engine_specific = r'''
 % Obsidian formatting support
 \usepackage{etoolbox}      % For code hooks
-\usepackage{soul}          % For highlighting
-\usepackage{xcolor}        % For colors
-\usepackage{tcolorbox}     % For callout boxes
-\usepackage{fontawesome5}  % For icons (if available)
-\usepackage{enumitem}      % For better list control
-\usepackage{ulem}          % For underline support
-
+'''
+        if uses('highlights'):
+            engine_specific += '\\usepackage{soul}          % For highlighting\n'
+        engine_specific += '\\usepackage{xcolor}        % For colors\n'
+        if uses('callouts'):
+            engine_specific += '\\usepackage{tcolorbox}     % For callout boxes\n'
+        if uses('icons'):
+            engine_specific += '\\usepackage{fontawesome5}  % For icons (if available)\n'
+        if uses('lists'):
+            engine_specific += '\\usepackage{enumitem}      % For better list control\n'
+        if uses('emphasis'):
+            engine_specific += '\\usepackage{ulem}          % For underline support\n'
+        if sans_serif:
+            engine_specific += r'''
+% Helvetica (clone) as the main font, like Helvetica Neue under LuaLaTeX
+\usepackage{helvet}
+\renewcommand{\familydefault}{\sfdefault}
+'''
+        if uses('highlights'):
+            engine_specific += r'''
 % Define highlight color
 \sethlcolor{yellow}
 '''
@@ -555,7 +732,13 @@ def get_enhanced_latex_header(use_lualatex=False) -> str:
 
 % Note: Code blocks are automatically wrapped during preprocessing at ~100 characters
 % so aggressive LaTeX line breaking is not needed and would break table formatting
+'''
 
+    if uses('code_blocks'):
+        if not uses('quotes'):
+            # Otherwise loaded with the quote styling below
+            common_header += '\n\\usepackage{framed}\n'
+        common_header += r'''
 % Code block styling with light gray background (using framed package like quotes)
 \definecolor{codebg}{gray}{0.95}
 
@@ -590,11 +773,16 @@ def get_enhanced_latex_header(use_lualatex=False) -> str:
     }%
   \fi
 }
+'''
 
+    if uses('tables') or uses('tabularx'):
+        common_header += r'''
 % Enhanced table support with smart column widths
 \usepackage{booktabs}       % Professional table styling
-\usepackage{tabularx}       % Smart column width distribution
-\usepackage{array}          % Enhanced column formatting
+'''
+        if uses('tabularx'):
+            common_header += '\\usepackage{tabularx}       % Smart column width distribution\n'
+        common_header += r'''\usepackage{array}          % Enhanced column formatting
 \usepackage{longtable}      % Multi-page tables
 
 % Configure longtable to use content-based column widths
@@ -604,7 +792,10 @@ def get_enhanced_latex_header(use_lualatex=False) -> str:
 
 % Allow tables to use full text width
 \setlength{\tabcolsep}{6pt}
+'''
 
+    if uses('quotes'):
+        common_header += r'''
 % Configure blockquote styling
 \usepackage{xcolor}
 \usepackage{framed}
@@ -622,7 +813,10 @@ def get_enhanced_latex_header(use_lualatex=False) -> str:
 }{%
   \endMakeFramed
 }
+'''
 
+    if uses('lists'):
+        common_header += r'''
 % Fix "too deeply nested" error by increasing list nesting depth
 \setlistdepth{9}
 \renewlist{itemize}{itemize}{9}
@@ -638,13 +832,20 @@ def get_enhanced_latex_header(use_lualatex=False) -> str:
 \setlist[itemize,7]{label=$\star$}
 \setlist[itemize,8]{label=$\dagger$}
 \setlist[itemize,9]{label=$\bullet$}
+'''
 
+    if uses('figures'):
+        common_header += r'''
 % Configure figure placement
 \usepackage{float}
 \let\origfigure\figure
 \let\endorigfigure\endfigure
 \renewenvironment{figure}[1][]{\origfigure[H]}{\endorigfigure}
+'''
 
+    callouts = [name for name in CALLOUT_ENVIRONMENTS if uses('callouts') and uses(name)]
+    if callouts:
+        common_header += r'''
 % Define Obsidian-style callout colors
 \definecolor{calloutblue}{RGB}{8, 109, 221}
 \definecolor{calloutcyan}{RGB}{0, 191, 188}
@@ -656,148 +857,11 @@ def get_enhanced_latex_header(use_lualatex=False) -> str:
 \definecolor{calloutgray}{RGB}{120, 120, 120}
 
 % Define individual callout environments with proper styling
-\newtcolorbox{calloutNote}[1]{
-    colback=calloutblue!5!white,
-    colframe=calloutblue!75!black,
-    fonttitle=\bfseries,
-    title={NOTE: #1},
-    arc=2mm,
-    boxrule=1pt,
-    left=3mm,
-    right=3mm,
-    top=2mm,
-    bottom=2mm
-}
-
-\newtcolorbox{calloutInfo}[1]{
-    colback=calloutblue!5!white,
-    colframe=calloutblue!75!black,
-    fonttitle=\bfseries,
-    title={INFO: #1},
-    arc=2mm,
-    boxrule=1pt,
-    left=3mm,
-    right=3mm,
-    top=2mm,
-    bottom=2mm
-}
-
-\newtcolorbox{calloutTodo}[1]{
-    colback=calloutblue!5!white,
-    colframe=calloutblue!75!black,
-    fonttitle=\bfseries,
-    title={TODO: #1},
-    arc=2mm,
-    boxrule=1pt,
-    left=3mm,
-    right=3mm,
-    top=2mm,
-    bottom=2mm
-}
-
-\newtcolorbox{calloutTip}[1]{
-    colback=calloutgreen!5!white,
-    colframe=calloutgreen!75!black,
-    fonttitle=\bfseries,
-    title={TIP: #1},
-    arc=2mm,
-    boxrule=1pt,
-    left=3mm,
-    right=3mm,
-    top=2mm,
-    bottom=2mm
-}
-
-\newtcolorbox{calloutSuccess}[1]{
-    colback=calloutgreen!5!white,
-    colframe=calloutgreen!75!black,
-    fonttitle=\bfseries,
-    title={SUCCESS: #1},
-    arc=2mm,
-    boxrule=1pt,
-    left=3mm,
-    right=3mm,
-    top=2mm,
-    bottom=2mm
-}
-
-\newtcolorbox{calloutQuestion}[1]{
-    colback=calloutyellow!5!white,
-    colframe=calloutyellow!75!black,
-    fonttitle=\bfseries,
-    title={QUESTION: #1},
-    arc=2mm,
-    boxrule=1pt,
-    left=3mm,
-    right=3mm,
-    top=2mm,
-    bottom=2mm
-}
-
-\newtcolorbox{calloutWarning}[1]{
-    colback=calloutorange!5!white,
-    colframe=calloutorange!75!black,
-    fonttitle=\bfseries,
-    title={WARNING: #1},
-    arc=2mm,
-    boxrule=1pt,
-    left=3mm,
-    right=3mm,
-    top=2mm,
-    bottom=2mm
-}
-
-\newtcolorbox{calloutDanger}[1]{
-    colback=calloutred!5!white,
-    colframe=calloutred!75!black,
-    fonttitle=\bfseries,
-    title={DANGER: #1},
-    arc=2mm,
-    boxrule=1pt,
-    left=3mm,
-    right=3mm,
-    top=2mm,
-    bottom=2mm
-}
-
-\newtcolorbox{calloutError}[1]{
-    colback=calloutred!5!white,
-    colframe=calloutred!75!black,
-    fonttitle=\bfseries,
-    title={ERROR: #1},
-    arc=2mm,
-    boxrule=1pt,
-    left=3mm,
-    right=3mm,
-    top=2mm,
-    bottom=2mm
-}
-
-\newtcolorbox{calloutBug}[1]{
-    colback=calloutred!5!white,
-    colframe=calloutred!75!black,
-    fonttitle=\bfseries,
-    title={BUG: #1},
-    arc=2mm,
-    boxrule=1pt,
-    left=3mm,
-    right=3mm,
-    top=2mm,
-    bottom=2mm
-}
-
-\newtcolorbox{calloutExample}[1]{
-    colback=calloutpurple!5!white,
-    colframe=calloutpurple!75!black,
-    fonttitle=\bfseries,
-    title={EXAMPLE: #1},
-    arc=2mm,
-    boxrule=1pt,
-    left=3mm,
-    right=3mm,
-    top=2mm,
-    bottom=2mm
-}
 '''
+        common_header += '\n'.join(
+            CALLOUT_ENVIRONMENT_TEMPLATE % (name, CALLOUT_ENVIRONMENTS[name][0],
+                                            CALLOUT_ENVIRONMENTS[name][0], CALLOUT_ENVIRONMENTS[name][1])
+            for name in callouts
+        )
 
     return engine_specific + common_header
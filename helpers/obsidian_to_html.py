@@ -5,28 +5,76 @@ unlike obsidian_preprocessor.py which outputs LaTeX.
 """
 
 import re
-from typing import List
-from .table_width_optimizer import optimize_table_widths
+from typing import Iterable, Iterator, List, Optional, TextIO, Union
+from .block_cache import BlockCache
+from .inline_scanner import convert_inline, replace_links
+from .feature_sniffer import record_report, sniff_features
+from .line_engine import iter_fused_lines, iter_source_lines
+from .document_ir import (
+    CHECKBOX_PATTERN,
+    Callout,
+    Checkbox,
+    LineBreak,
+    MarkdownEmitter,
+    MermaidRenderer,
+    PageBreak,
+    conversion_stages,
+)
+
+
+# HTML markup of highlights (opening, closing)
+HTML_HIGHLIGHT = ('<mark>', '</mark>')
 
 
 def convert_obsidian_images_html(content: str) -> str:
     """Convert ![[image.png]] to standard markdown ![](image.png)"""
-    content = re.sub(
-        r'!\[\[([^\]|]+?)(?:\|([^\]]+))?\]\]',
-        lambda m: f'![]({m.group(1)})',
-        content
-    )
-    return content
+    return replace_links(content, sections=False, wikilinks=False)
 
 
 def convert_wikilinks_html(content: str) -> str:
     """Convert [[wikilink]] to plain text or standard links"""
     # Remove section links like [[Note#Section]]
-    content = re.sub(r'!\[\[([^\]]+?)#([^\]]+?)\]\]', r'', content)
+    content = replace_links(content, images=False, wikilinks=False)
 
     # Convert regular wikilinks to plain text
-    content = re.sub(r'\[\[([^\]|]+?)(?:\|([^\]]+))?\]\]', r'\2' if r'\2' else r'\1', content)
-    return content
+    return replace_links(content, images=False, sections=False)
+
+
+# Simple checkbox emoji mapping
+CHECKBOX_EMOJI = {
+    '!': '⚠️',  # Important
+    '/': '🔄',  # In Progress
+    'd': '💪',  # Doing
+    '-': '❌',  # Dropped
+    '>': '➡️',  # Forwarded
+    '?': '❓',  # Question
+    'R': '🔍',  # Research
+    '+': '➕',  # To Add
+    'i': '💡',  # Idea
+    'P': '✅',  # Pro
+    'C': '❌',  # Con
+    'N': '📝',  # Note
+    'D': '📅',  # Date
+}
+
+
+def _convert_checkbox_line_html(line: str) -> str:
+    """Convert a single extended checkbox line, other lines are returned unchanged"""
+    # Match extended checkbox patterns: - [X] text
+    match = CHECKBOX_PATTERN.match(line)
+    if not match:
+        return line
+
+    return _format_checkbox_html(*match.groups())
+
+
+def _format_checkbox_html(indent: str, checkbox_type: str, text: str) -> str:
+    """Format a checkbox line from its indent, type character and text"""
+    # Convert extended checkboxes to standard checkbox + emoji
+    # (standard and unknown types are kept as-is)
+    if checkbox_type in CHECKBOX_EMOJI:
+        return f'{indent}- [x] {CHECKBOX_EMOJI[checkbox_type]} {text}'
+    return f'{indent}- [{checkbox_type}] {text}'
 
 
 def convert_extended_checkboxes_html(content: str) -> str:
@@ -35,46 +83,7 @@ def convert_extended_checkboxes_html(content: str) -> str:
     Uses the same emoji mapping as the LaTeX version but outputs
     markdown-compatible format.
     """
-    # Simple checkbox emoji mapping
-    CHECKBOX_EMOJI = {
-        '!': '⚠️',  # Important
-        '/': '🔄',  # In Progress
-        'd': '💪',  # Doing
-        '-': '❌',  # Dropped
-        '>': '➡️',  # Forwarded
-        '?': '❓',  # Question
-        'R': '🔍',  # Research
-        '+': '➕',  # To Add
-        'i': '💡',  # Idea
-        'P': '✅',  # Pro
-        'C': '❌',  # Con
-        'N': '📝',  # Note
-        'D': '📅',  # Date
-    }
-
-    lines = content.split('\n')
-    result = []
-
-    for line in lines:
-        # Match extended checkbox patterns: - [X] text
-        match = re.match(r'^(\s*)- \[(.)\] (.+)$', line)
-        if match:
-            indent, checkbox_type, text = match.groups()
-
-            # Keep standard checkboxes as-is
-            if checkbox_type in [' ', 'x', 'X']:
-                result.append(line)
-            # Convert extended checkboxes to standard checkbox + emoji
-            elif checkbox_type in CHECKBOX_EMOJI:
-                emoji = CHECKBOX_EMOJI[checkbox_type]
-                result.append(f'{indent}- [x] {emoji} {text}')
-            else:
-                # Unknown type, keep as-is
-                result.append(line)
-        else:
-            result.append(line)
-
-    return '\n'.join(result)
+    return '\n'.join(_convert_checkbox_line_html(line) for line in content.split('\n'))
 
 
 def convert_callouts_html(content: str) -> str:
@@ -190,8 +199,7 @@ def convert_highlighting_html(content: str) -> str:
     The markdown library will convert <mark> tags to proper HTML.
     """
     # Replace ==text== with <mark>text</mark>
-    content = re.sub(r'==([^=]+)==', r'<mark>\1</mark>', content)
-    return content
+    return convert_inline(content, HTML_HIGHLIGHT, links=False)
 
 
 def convert_underline_html(content: str) -> str:
@@ -261,40 +269,85 @@ def fix_list_blank_lines(content: str) -> str:
     return '\n'.join(result)
 
 
-def preprocess_obsidian_for_html(content: str) -> str:
+def preprocess_obsidian_for_html(content: str, cache: Optional[BlockCache] = None,
+                                 report: Optional[dict] = None) -> str:
     """Main preprocessing function for HTML/DOCX output
 
-    Converts Obsidian syntax to HTML-friendly Markdown (not LaTeX).
+    Converts Obsidian syntax to HTML-friendly Markdown (not LaTeX), the same
+    way the DOCX path does, in a single pass over the lines (see
+    line_engine.iter_fused_lines): each block is parsed into the document IR
+    and emitted by HtmlMarkdownEmitter. Page break markers are kept.
 
     Args:
         content: Raw markdown content with Obsidian syntax
+        cache: Optional block cache; unchanged blocks reuse their output
+        report: Optional dict receiving the detected 'features' and the
+            'stages' that ran (stages whose trigger never appears are skipped)
 
     Returns:
         Preprocessed markdown content compatible with HTML converters
     """
-    # Order matters! Process in this sequence:
+    features = sniff_features(content)
+    record_report(report, features, conversion_stages(features, render_mermaid=False))
+    return '\n'.join(iter_fused_lines(content.split('\n'), HtmlMarkdownEmitter(cache=cache), features))
 
-    # 0. Optimize table column widths
-    content = optimize_table_widths(content)
 
-    # 1. Fix consecutive bold lines first (before other processing)
-    content = fix_consecutive_bold_lines(content)
 
-    # 2. Fix missing blank lines before lists
-    content = fix_list_blank_lines(content)
+def iter_preprocess_obsidian_for_html(source: Union[str, TextIO, Iterable[str]],
+                                      cache: Optional[BlockCache] = None) -> Iterator[str]:
+    """Streaming version of preprocess_obsidian_for_html
 
-    # 3. Convert callouts to blockquotes
-    content = convert_callouts_html(content)
+    Only the block being collected is held in memory; the output matches
+    the batch function.
 
-    # 4. Convert Obsidian-specific links and embeds
-    content = convert_obsidian_images_html(content)
-    content = convert_wikilinks_html(content)
+    Args:
+        source: Document string, text file object or iterable of lines
+        cache: Optional block cache; unchanged blocks reuse their output
 
-    # 5. Convert extended checkboxes
-    content = convert_extended_checkboxes_html(content)
+    Yields:
+        Preprocessed lines without trailing newlines
+    """
+    yield from iter_fused_lines(iter_source_lines(source), HtmlMarkdownEmitter(cache=cache))
 
-    # 6. Convert text formatting (HTML-safe)
-    content = convert_highlighting_html(content)
-    content = convert_underline_html(content)
+class HtmlMarkdownEmitter(MarkdownEmitter):
+    """Emit a parsed document as HTML-friendly markdown (DOCX path)
 
-    return content
+    Converts the document IR (see document_ir.py) like the staged functions
+    above: blockquote callouts, <mark> highlights and <br> line breaks.
+    """
+
+    HIGHLIGHT = HTML_HIGHLIGHT
+
+    def __init__(self, obsidian: bool = True, mermaid: Optional[MermaidRenderer] = None,
+                 cache: Optional[BlockCache] = None, page_break: Optional[str] = None):
+        """
+        Initialize emitter
+
+        Args:
+            obsidian: Whether Obsidian syntax is converted (must match the parse)
+            mermaid: Optional callback replacing Mermaid diagrams
+            cache: Optional block cache; unchanged blocks reuse their output
+            page_break: Line replacing page break markers (None keeps the marker)
+        """
+        super().__init__(obsidian=obsidian, mermaid=mermaid, cache=cache)
+        self.page_break = page_break
+
+    def emit_line_break(self, node: LineBreak) -> List[str]:
+        return ['<br>']
+
+    def emit_checkbox(self, node: Checkbox) -> List[str]:
+        return [_format_checkbox_html(node.indent, node.mark, self.render_inline(node.parts))]
+
+    def emit_callout(self, node: Callout) -> List[str]:
+        content = self.render_inline(node.content).split('\n') if node.content else []
+        lines = []
+        for line in _format_callout_html(node.kind, self.render_inline(node.title), content):
+            lines.append(_convert_checkbox_line_html(line) if '- [' in line else line)
+        return lines
+
+    def emit_page_break(self, node: PageBreak) -> List[str]:
+        lines = [node.marker if self.page_break is None else self.page_break]
+        if node.list_follows:
+            # The marker line is text, so the list needs its blank line
+            lines.append('')
+        return lines
@@ -8,6 +8,11 @@ import re
 from typing import Tuple, List
 
 
+# Page break marker patterns, applied to the stripped line
+PAGE_BREAK_COMMENT_PATTERN = re.compile(r'^\s*<!--\s*(page[-_\s]?break|newpage)\s*-->\s*$', re.IGNORECASE)
+PAGE_BREAK_NEWPAGE_PATTERN = re.compile(r'^\\newpage\s*$')
+
+
 def is_in_code_block_or_yaml(line_index: int, line: str, state: dict) -> Tuple[bool, dict]:
     """Track whether we're inside a code block or YAML frontmatter
 
@@ -75,11 +80,11 @@ def is_page_break_marker(line: str) -> bool:
     stripped = line.strip()
 
     # Check for HTML comment page breaks
-    if re.match(r'^\s*<!--\s*(page[-_\s]?break|newpage)\s*-->\s*$', stripped, re.IGNORECASE):
+    if PAGE_BREAK_COMMENT_PATTERN.match(stripped):
         return True
 
     # Check for raw LaTeX \newpage
-    if re.match(r'^\\newpage\s*$', stripped):
+    if PAGE_BREAK_NEWPAGE_PATTERN.match(stripped):
         return True
 
     return False
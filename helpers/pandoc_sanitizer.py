@@ -1,35 +1,38 @@
 """Pandoc content sanitization"""
 
-from .yaml_stripper import strip_yaml_frontmatter
+from typing import Iterable, Iterator
+from .yaml_stripper import iter_yaml_stripped_lines
 from .emoji_remover import remove_emojis
 
 
-def sanitize_for_pandoc(markdown_content):
-    """Sanitize markdown content to avoid Pandoc YAML parsing issues"""
-    # First strip YAML frontmatter
-    content = strip_yaml_frontmatter(markdown_content)
+# Raw LaTeX block replacing a standalone --- (explicit horizontal rule)
+HORIZONTAL_RULE_LINES = (
+    '',
+    '```{=latex}',
+    '\\vspace{0.5em}',
+    '\\noindent\\rule{\\textwidth}{0.4pt}',
+    '\\vspace{0.5em}',
+    '```',
+    '',
+)
 
-    # Remove emojis that LaTeX can't handle
-    content = remove_emojis(content)
 
-    # Replace any standalone --- with explicit LaTeX horizontal rule
-    # This prevents Pandoc from trying to parse them as YAML delimiters
-    # and ensures they render properly in PDF
-    lines = content.split('\n')
-    sanitized_lines = []
+def iter_sanitized_lines(lines: Iterable[str]) -> Iterator[str]:
+    """Streaming version of sanitize_for_pandoc"""
+    # First strip YAML frontmatter
+    for line in iter_yaml_stripped_lines(lines):
+        # Remove emojis that LaTeX can't handle
+        line = remove_emojis(line)
 
-    for line in lines:
-        # If line is exactly ---, replace with LaTeX hrule
+        # Replace any standalone --- with explicit LaTeX horizontal rule
+        # This prevents Pandoc from trying to parse them as YAML delimiters
+        # and ensures they render properly in PDF
         if line.strip() == '---':
-            # Use raw LaTeX block for explicit horizontal rule
-            sanitized_lines.append('')
-            sanitized_lines.append('```{=latex}')
-            sanitized_lines.append('\\vspace{0.5em}')
-            sanitized_lines.append('\\noindent\\rule{\\textwidth}{0.4pt}')
-            sanitized_lines.append('\\vspace{0.5em}')
-            sanitized_lines.append('```')
-            sanitized_lines.append('')
+            yield from HORIZONTAL_RULE_LINES
         else:
-            sanitized_lines.append(line)
+            yield line
 
-    return '\n'.join(sanitized_lines)
+
+def sanitize_for_pandoc(markdown_content):
+    """Sanitize markdown content to avoid Pandoc YAML parsing issues"""
+    return '\n'.join(iter_sanitized_lines(markdown_content.split('\n')))
@@ -0,0 +1,316 @@
+"""Pandoc conversions through a long-lived `pandoc server`
+
+pypandoc starts a pandoc binary per conversion, which dominates small
+documents in batch jobs. With $PANDOC_ENGINE=server, conversions are sent
+over HTTP to one `pandoc server` process on localhost instead, through a
+small pool of keep-alive connections. The server is restarted if it dies,
+and any conversion it cannot take (an option the server API lacks, media to
+extract, the server failing) runs through pypandoc as before.
+
+`pandoc server` exists since pandoc 3.0. It only reads the request, never
+files, so file options (--include-in-header) are read here and sent inline.
+"""
+
+import http.client
+import json
+import os
+import queue
+import re
+import socket
+import subprocess
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+import pypandoc
+
+from .capabilities import get_capabilities
+
+
+# Environment variable: 'subprocess' (default) or 'server'
+PANDOC_ENGINE_ENV = 'PANDOC_ENGINE'
+PANDOC_ENGINES = ('subprocess', 'server')
+
+# Seconds a conversion may take on the server
+PANDOC_SERVER_TIMEOUT = 60
+
+# Seconds to wait for a started server to answer
+PANDOC_SERVER_STARTUP_TIMEOUT = 10.0
+
+# Seconds before retrying a server that could not be started
+PANDOC_SERVER_RETRY_INTERVAL = 60.0
+
+# Image targets: markdown ![alt](target) and HTML <img src="target">
+IMAGE_TARGET_PATTERN = re.compile(r'!\[[^\]]*\]\(\s*<?([^)\s>]+)|<img\b[^>]*\bsrc=["\']([^"\']+)')
+
+
+class PandocServerError(Exception):
+    """The pandoc server is unavailable or failed (callers fall back to pypandoc)"""
+
+
+def pandoc_engine() -> str:
+    """Return the configured pandoc engine ('subprocess' when unset or unknown)"""
+    engine = (os.environ.get(PANDOC_ENGINE_ENV) or 'subprocess').strip().lower()
+    return engine if engine in PANDOC_ENGINES else 'subprocess'
+
+
+def _needs_media_extraction(text: str) -> bool:
+    """Whether images would need --extract-media (anything but absolute local paths)"""
+    for match in IMAGE_TARGET_PATTERN.finditer(text):
+        target = match.group(1) or match.group(2)
+        if not os.path.isabs(target):
+            return True
+    return False
+
+
+def server_options(text: str, to: str, extra_args: Iterable[str]) -> Optional[Dict]:
+    """Translate pypandoc command line arguments into a server request
+
+    Args:
+        text: Markdown to convert
+        to: Output format
+        extra_args: Arguments as given to pypandoc (--name=value form)
+
+    Returns:
+        The JSON request, or None when an argument has no server equivalent
+    """
+    options = {'text': text, 'from': 'markdown', 'to': to}
+    variables: Dict[str, object] = {}
+    header_includes: List[str] = []
+    for arg in extra_args:
+        name, _, value = arg.partition('=')
+        if name == '--standalone':
+            options['standalone'] = True
+        elif name == '--from':
+            options['from'] = value
+        elif name == '--columns':
+            options['columns'] = int(value)
+        elif name == '--variable':
+            key, _, var_value = value.partition(':')
+            variables[key] = var_value if var_value else True
+        elif name == '--include-in-header':
+            with open(value, encoding='utf-8') as f:
+                header_includes.append(f.read())
+        elif name == '--extract-media':
+            # Images at absolute paths are referenced in place by the LaTeX
+            if _needs_media_extraction(text):
+                return None
+        else:
+            return None
+    if header_includes:
+        variables['header-includes'] = header_includes
+    if variables:
+        options['variables'] = variables
+    return options
+
+
+class PandocServer:
+    """A `pandoc server` child process and a pool of connections to it"""
+
+    def __init__(self, pandoc_path: Optional[str] = None, timeout: int = PANDOC_SERVER_TIMEOUT,
+                 pool_size: int = 4, max_restarts: int = 3):
+        """
+        Initialize server (it is started by start())
+
+        Args:
+            pandoc_path: Pandoc binary (default: the one pypandoc uses)
+            timeout: Seconds a conversion may take
+            pool_size: Idle connections kept open
+            max_restarts: Restarts allowed after the server dies
+        """
+        self.pandoc_path = pandoc_path
+        self.timeout = timeout
+        self.max_restarts = max_restarts
+        self.port = None
+        self.process = None
+        self._connections: 'queue.LifoQueue[http.client.HTTPConnection]' = queue.LifoQueue(pool_size)
+        self._lock = threading.Lock()
+        self.stats = {'requests': 0, 'restarts': 0}
+
+    def start(self):
+        """Start the server and wait until it answers
+
+        Raises:
+            PandocServerError: The server did not start
+        """
+        with socket.socket() as probe:
+            probe.bind(('127.0.0.1', 0))
+            self.port = probe.getsockname()[1]
+        command = [self.pandoc_path or pypandoc.get_pandoc_path(), 'server',
+                   '--port', str(self.port), '--timeout', str(self.timeout)]
+        try:
+            self.process = subprocess.Popen(command, stdin=subprocess.DEVNULL,
+                                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        except OSError as e:
+            raise PandocServerError(f"Cannot start pandoc server: {e}") from e
+
+        deadline = time.monotonic() + PANDOC_SERVER_STARTUP_TIMEOUT
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise PandocServerError(f"pandoc server exited with status {self.process.returncode}")
+            connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=1.0)
+            try:
+                connection.request('GET', '/version')
+                connection.getresponse().read()
+                return
+            except (OSError, http.client.HTTPException):
+                time.sleep(0.05)
+            finally:
+                connection.close()
+        self.close()
+        raise PandocServerError("pandoc server did not answer")
+
+    def alive(self) -> bool:
+        """Whether the server process is running"""
+        return self.process is not None and self.process.poll() is None
+
+    def convert(self, options: Dict) -> str:
+        """Run one conversion, restarting the server once if it died
+
+        Args:
+            options: JSON request (see server_options)
+
+        Returns:
+            The converted text
+
+        Raises:
+            PandocServerError: The server failed or rejected the conversion
+        """
+        body = json.dumps(options).encode('utf-8')
+        for attempt in range(2):
+            try:
+                status, data = self._request('POST', '/', body)
+                break
+            except (OSError, http.client.HTTPException) as e:
+                if attempt or not self._restart():
+                    raise PandocServerError(f"pandoc server request failed: {e}") from e
+        with self._lock:
+            self.stats['requests'] += 1
+
+        if status != 200:
+            raise PandocServerError(f"pandoc server error {status}: {data[:500].decode('utf-8', 'replace')}")
+        response = json.loads(data)
+        if response.get('base64'):
+            raise PandocServerError(f"pandoc server returned binary output for {options.get('to')}")
+        return response['output']
+
+    def _request(self, method: str, path: str, body: Optional[bytes] = None):
+        """Send one request on a pooled connection; return (status, body)"""
+        try:
+            connection = self._connections.get_nowait()
+        except queue.Empty:
+            connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=self.timeout + 5)
+        headers = {'Accept': 'application/json', 'Content-Type': 'application/json'}
+        try:
+            connection.request(method, path, body=body, headers=headers)
+            response = connection.getresponse()
+            data = response.read()
+        except BaseException:
+            # The connection state is unknown: never reuse it
+            connection.close()
+            raise
+        try:
+            self._connections.put_nowait(connection)
+        except queue.Full:
+            connection.close()
+        return response.status, data
+
+    def _restart(self) -> bool:
+        """Restart a dead server (at most max_restarts times); whether it runs again"""
+        with self._lock:
+            if self.alive():
+                return True
+            if self.stats['restarts'] >= self.max_restarts:
+                return False
+            self.stats['restarts'] += 1
+            print(f"Warning: pandoc server exited; restarting ({self.stats['restarts']}/{self.max_restarts})")
+            self._close_connections()
+            try:
+                self.start()
+            except PandocServerError as e:
+                print(f"Warning: {e}")
+                return False
+            return True
+
+    def _close_connections(self):
+        """Close the idle pooled connections"""
+        while True:
+            try:
+                self._connections.get_nowait().close()
+            except queue.Empty:
+                return
+
+    def close(self):
+        """Stop the server"""
+        self._close_connections()
+        if self.alive():
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+
+
+_server = None
+_server_failed_at = None
+_server_lock = threading.Lock()
+
+
+def get_pandoc_server() -> Optional[PandocServer]:
+    """Return the running pandoc server, or None when not enabled or not usable"""
+    global _server, _server_failed_at
+    if pandoc_engine() != 'server':
+        return None
+    with _server_lock:
+        if _server is not None:
+            if _server.alive() or _server._restart():
+                return _server
+            # Out of restarts: use processes until the retry interval has passed
+            _server.close()
+            _server = None
+            _server_failed_at = time.monotonic()
+            return None
+        if _server_failed_at is not None and time.monotonic() - _server_failed_at < PANDOC_SERVER_RETRY_INTERVAL:
+            return None
+
+        version = get_capabilities().version('pandoc')
+        major = version.split('.')[0] if version else ''
+        if not major.isdigit() or int(major) < 3:
+            print(f"Warning: pandoc server needs pandoc 3 or later (found {version}); using pandoc processes")
+            _server_failed_at = time.monotonic()
+            return None
+        server = PandocServer()
+        try:
+            server.start()
+        except PandocServerError as e:
+            print(f"Warning: {e}; using pandoc processes")
+            _server_failed_at = time.monotonic()
+            return None
+        _server = server
+        _server_failed_at = None
+        return _server
+
+
+def convert_file(source_file: str, to: str, extra_args: Iterable[str] = ()) -> str:
+    """Convert a Markdown file like pypandoc.convert_file, on the pandoc server when enabled
+
+    Args:
+        source_file: Markdown file to convert
+        to: Output format
+        extra_args: Pandoc arguments (--name=value form)
+
+    Returns:
+        The converted text
+    """
+    extra_args = list(extra_args)
+    server = get_pandoc_server()
+    if server is not None:
+        with open(source_file, encoding='utf-8') as f:
+            options = server_options(f.read(), to, extra_args)
+        if options is not None:
+            try:
+                return server.convert(options)
+            except PandocServerError as e:
+                print(f"Warning: {e}; converting with a pandoc process")
+    return pypandoc.convert_file(source_file, to, extra_args=extra_args)
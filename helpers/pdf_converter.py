@@ -1,116 +1,347 @@
 """PDF conversion functionality"""
 
-import pypandoc
 from io import BytesIO
+import itertools
+import json
 import tempfile
 import os
-from typing import Optional, Dict
-from .pandoc_sanitizer import sanitize_for_pandoc
-from .mermaid_pdf_handler import prepare_markdown_with_mermaid_images, cleanup_temp_images
-from .obsidian_preprocessor import preprocess_obsidian_syntax, get_enhanced_latex_header
+import shutil
+from typing import Optional, Dict, Iterable, Iterator, List
+from .pandoc_sanitizer import iter_sanitized_lines
+from .mermaid_pdf_handler import mermaid_reference_renderer, cleanup_temp_images
+from .mermaid_renderer import get_renderer_version, mermaid_renderer_available
+from .capabilities import get_capabilities, require_tools
+from .artifact_cache import artifact_cache_enabled, artifact_key, cached_artifact, clock_inputs, source_digest
+from .latex_compiler import compile_latex
+from .latex_engine import LATEX_ENGINE_ENV, requested_engine, select_engine
+from .font_resolver import get_font_map, warm_font_cache
+from .emoji_images import emoji_images_enabled, get_emoji_images
+from .latex_workers import get_worker_pool
+from .pandoc_server import convert_file as pandoc_convert_file
+from .obsidian_preprocessor import LatexMarkdownEmitter, detect_header_features, get_enhanced_latex_header
+from .document_ir import Document, conversion_stages, mermaid_codes, parse_document, prescan_mermaid_codes
+from .feature_sniffer import record_report
+from .line_engine import iter_fused_lines, iter_source_lines, write_lines
+from .yaml_stripper import FRONTMATTER_MAX_LINES
+from .block_cache import get_default_block_cache
 from .template_manager import TemplateManager
-from .header_footer_processor import HeaderFooterProcessor, create_processor_from_preset
+from .header_footer_processor import HeaderFooterProcessor, create_processor_from_preset, resolve_logo_path
+
+
+# Environment variable: '0' always includes the full Obsidian LaTeX header
+# instead of only the parts the document uses (for timing and output comparisons,
+# neither of which has been recorded yet)
+MINIMAL_PREAMBLE_ENV = 'LATEX_MINIMAL_PREAMBLE'
+
+# Environment variable: '1' sets pdfLaTeX documents in a Helvetica clone, like
+# the Helvetica Neue of LuaLaTeX documents (default: Computer Modern)
+PDFLATEX_SANS_SERIF_ENV = 'PDFLATEX_SANS_SERIF'
 
 
 def convert_to_pdf(markdown_content, render_mermaid=True, obsidian_mode=True,
                    use_header_footer=True, header_footer_preset=None,
-                   custom_variables=None):
+                   custom_variables=None, report=None, mermaid_format='pdf'):
     """Convert Markdown content to PDF format using pypandoc
 
     Args:
-        markdown_content: The markdown content to convert
+        markdown_content: The markdown content to convert, or a Document parsed
+            with document_ir.parse_document (its obsidian setting is used). A
+            text file object or an iterable of lines is streamed through the
+            pipeline straight into the temporary file handed to Pandoc, with
+            bounded memory.
         render_mermaid: Whether to render Mermaid diagrams (default: True)
         obsidian_mode: Whether to preprocess Obsidian syntax (default: True)
         use_header_footer: Whether to include headers/footers (default: True)
         header_footer_preset: Preset name to use (default: None, uses current preset)
         custom_variables: Dictionary of custom variables for header/footer (default: None)
+        report: Optional dict receiving the detected 'features' and the 'stages'
+            that ran (features is None for streamed input, which runs every stage),
+            'latex_passes': one record per LuaLaTeX pass (draft, seconds, ...),
+            'preamble_features': the header parts included (None for the
+            full header), 'latex_engine' with 'latex_engine_reason': the
+            engine that compiled the PDF and why it was chosen, and with
+            $PDF_EMOJI_IMAGES=1 'emoji_images': counts of the emoji 'replaced'
+            by images and 'kept' as text
+        mermaid_format: 'pdf' to include diagrams as vector PDFs (default),
+            'png' to embed 2x bitmaps
+
+    Finished PDFs of text sources are cached (see artifact_cache); the report
+    then also holds 'artifact_cache': 'hit', 'miss', 'shared' or 'bypass'.
     """
-    # Preprocess Obsidian syntax if enabled
-    if obsidian_mode:
-        markdown_content = preprocess_obsidian_syntax(markdown_content)
+    options = {
+        'render_mermaid': render_mermaid, 'obsidian_mode': obsidian_mode,
+        'use_header_footer': use_header_footer, 'header_footer_preset': header_footer_preset,
+        'custom_variables': custom_variables, 'mermaid_format': mermaid_format,
+    }
+    key = _pdf_artifact_key(markdown_content, options)
+    if key is None:
+        if report is not None:
+            report['artifact_cache'] = 'bypass'
+        return _convert_to_pdf(markdown_content, report=report, **options)
 
-    # Handle Mermaid diagrams if enabled
-    mermaid_image_files = []
-    if render_mermaid:
-        try:
-            markdown_content, mermaid_image_files = prepare_markdown_with_mermaid_images(markdown_content)
-        except Exception as e:
-            print(f"Warning: Mermaid rendering disabled due to error: {e}")
-
-    # Initialize header/footer processor if enabled
-    header_footer_latex = ""
-    if use_header_footer:
-        try:
-            template_manager = TemplateManager()
-
-            # Use specified preset or current default
-            if header_footer_preset:
-                template_manager.set_current_preset(header_footer_preset)
-
-            processor = create_processor_from_preset(
-                template_manager.get_current_preset(),
-                template_manager
-            )
+    def build():
+        build_report = {}
+        buffer = _convert_to_pdf(markdown_content, report=build_report, **options)
+        return buffer.getvalue(), build_report
+
+    return BytesIO(cached_artifact(key, build, report))
+
+
+def _pdf_artifact_key(markdown_content, options: Dict) -> Optional[str]:
+    """Return the artifact cache key of a conversion, or None when it is not cached"""
+    if not artifact_cache_enabled():
+        return None
+    digest = source_digest(markdown_content)
+    if digest is None:
+        return None
+
+    capabilities = get_capabilities()
+    inputs = {
+        'preamble': (_latex_preamble(options['obsidian_mode'])
+                     + _latex_preamble(options['obsidian_mode'], engine='pdflatex')),
+        'pandoc': capabilities.version('pandoc'),
+        'lualatex': capabilities.version('lualatex'),
+        'pdflatex': capabilities.version('pdflatex'),
+        'engine': os.environ.get(LATEX_ENGINE_ENV),
+        'minimal_preamble': str(minimal_preamble_enabled()),
+        'emoji_images': get_emoji_images().source_id() if emoji_images_enabled() else None,
+        'fonts': get_font_map().describe(),
+        'mermaid': get_renderer_version() if options['render_mermaid'] else None,
+    }
+    if options['use_header_footer']:
+        template_manager = TemplateManager()
+        preset_name = options['header_footer_preset']
+        if preset_name not in template_manager.get_preset_names():
+            preset_name = template_manager.get_current_preset()
+        preset = template_manager.get_preset(preset_name)
+        inputs['preset'] = json.dumps([preset, template_manager.get_default_variables()], sort_keys=True)
+
+        logo_path = resolve_logo_path(preset.get('logo', {}))[1]
+        if preset.get('logo', {}).get('enabled') and logo_path:
+            try:
+                with open(logo_path, 'rb') as f:
+                    inputs['logo'] = f.read()
+            except OSError:
+                inputs['logo'] = None
+        # The header may print the conversion date or time
+        inputs.update(clock_inputs(inputs['preset'], json.dumps(options['custom_variables'])))
+    return artifact_key('pdf', digest, options, inputs)
 
-            # Extract frontmatter from markdown
-            processor.extract_frontmatter(markdown_content)
 
-            # Generate header/footer LaTeX code
-            header_footer_latex = processor.generate_latex_header(custom_variables)
-        except Exception as e:
-            print(f"Warning: Header/footer generation failed: {e}")
-            header_footer_latex = ""
+def minimal_preamble_enabled() -> bool:
+    """Whether the Obsidian header only includes what the document uses"""
+    return os.environ.get(MINIMAL_PREAMBLE_ENV, '1') != '0'
 
-    # Sanitize content to avoid YAML parsing errors
-    cleaned_content = sanitize_for_pandoc(markdown_content)
 
-    # Create temporary files
-    with tempfile.NamedTemporaryFile(mode='w', suffix='.md', delete=False, encoding='utf-8') as temp_md:
-        temp_md.write(cleaned_content)
-        temp_md_path = temp_md.name
+def pdflatex_sans_serif_enabled() -> bool:
+    """Whether pdfLaTeX documents use the sans-serif font ($PDFLATEX_SANS_SERIF=1)"""
+    return os.environ.get(PDFLATEX_SANS_SERIF_ENV, '0') == '1'
 
-    # Create enhanced LaTeX header with Obsidian support
-    temp_header = tempfile.NamedTemporaryFile(mode='w', suffix='.tex', delete=False, encoding='utf-8')
+
+def _latex_preamble(obsidian_mode: bool, features=None, engine: str = 'lualatex', fonts=None) -> str:
+    """Return the LaTeX header included in Pandoc's preamble (without headers/footers)
+
+    Args:
+        obsidian_mode: Whether the Obsidian header is used
+        features: detect_header_features of the document, or None for the
+            full header
+        engine: 'lualatex' or 'pdflatex' (see latex_engine.select_engine)
+        fonts: Resolved FontMap (font_resolver.py), or None to name the fonts
+    """
     if obsidian_mode:
-        # Use LuaLaTeX-compatible header (avoids soul package conflict)
-        temp_header.write(get_enhanced_latex_header(use_lualatex=True))
+        # The LuaLaTeX header avoids the soul package conflict
+        return get_enhanced_latex_header(use_lualatex=engine == 'lualatex', features=features, fonts=fonts,
+                                         sans_serif=pdflatex_sans_serif_enabled())
+    # Basic header without Obsidian features
+    return ('\\usepackage{float}\n'
+            '\\let\\origfigure\\figure\n'
+            '\\let\\endorigfigure\\endfigure\n'
+            '\\renewenvironment{figure}[1][]{\\origfigure[H]}{\\endorigfigure}\n')
+
+
+def _convert_to_pdf(markdown_content, render_mermaid, obsidian_mode, use_header_footer,
+                    header_footer_preset, custom_variables, report, mermaid_format):
+    """Run the PDF pipeline (see convert_to_pdf)"""
+    # Fail before any work when the toolchain is missing (LuaLaTeX is only
+    # required once a document turns out to need it)
+    capabilities = get_capabilities()
+    if capabilities.available('pdflatex') and requested_engine() != 'lualatex':
+        require_tools('pandoc', purpose='PDF conversion')
     else:
-        # Basic header without Obsidian features
-        temp_header.write('\\usepackage{float}\n')
-        temp_header.write('\\let\\origfigure\\figure\n')
-        temp_header.write('\\let\\endorigfigure\\endfigure\n')
-        temp_header.write('\\renewenvironment{figure}[1][]{\\origfigure[H]}{\\endorigfigure}\n')
+        require_tools('pandoc', 'lualatex', purpose='PDF conversion')
+
+    mermaid_image_files = []
+
+    features = None
+    if isinstance(markdown_content, str):
+        markdown_content = parse_document(markdown_content, obsidian=obsidian_mode)
+    if isinstance(markdown_content, Document):
+        # A parsed document carries its own Obsidian setting and features
+        obsidian_mode = markdown_content.obsidian
+        features = markdown_content.features
+
+    stages = conversion_stages(features, obsidian_mode, render_mermaid)
+    if 'render_mermaid' in stages and not mermaid_renderer_available():
+        print("Warning: No Mermaid renderer available (mmdc not installed); diagrams are kept as code blocks")
+        stages.remove('render_mermaid')
+    record_report(report, features, stages)
+
+    # Obsidian syntax and Mermaid diagrams are converted by one walk of the IR.
+    # The diagrams of a parsed document or a seekable stream are rendered
+    # together up front
+    mermaid = None
+    if 'render_mermaid' in stages:
+        if isinstance(markdown_content, Document):
+            batch_codes = mermaid_codes(markdown_content)
+        else:
+            batch_codes = prescan_mermaid_codes(markdown_content, obsidian_mode)
+        mermaid = mermaid_reference_renderer(mermaid_image_files, batch_codes, mermaid_format)
+    emitter = LatexMarkdownEmitter(
+        obsidian=obsidian_mode,
+        mermaid=mermaid,
+        cache=get_default_block_cache()
+    )
+
+    if isinstance(markdown_content, Document):
+        markdown_content = emitter.emit(markdown_content)
 
-    # Add header/footer configuration if enabled
-    if header_footer_latex:
-        temp_header.write('\n')
-        temp_header.write(header_footer_latex)
+        lines = markdown_content.split('\n')
+        frontmatter_source = markdown_content
+    else:
+        # Streaming mode: blocks are parsed and emitted one at a time
+        lines = iter_fused_lines(iter_source_lines(markdown_content), emitter)
 
-    temp_header_path = temp_header.name
-    temp_header.close()
+        # Keep the frontmatter lines for the header/footer variables
+        frontmatter_lines = []
+        lines = _iter_capture_frontmatter(lines, frontmatter_lines)
+        frontmatter_source = None
 
-    # Create secure temporary file for PDF output
-    temp_pdf = tempfile.NamedTemporaryFile(suffix='.pdf', delete=False)
-    temp_pdf_path = temp_pdf.name
-    temp_pdf.close()
+    # Sanitize content to avoid YAML parsing errors and write it out
+    temp_md = tempfile.NamedTemporaryFile(mode='w', suffix='.md', delete=False, encoding='utf-8')
+    temp_md_path = temp_md.name
+    written_lines = iter_sanitized_lines(lines)
+    emoji_stats = None
+    if emoji_images_enabled():
+        # Emoji become cached images, so no emoji font fallback is needed
+        emoji_stats = {'replaced': 0, 'kept': 0}
+        written_lines = get_emoji_images().iter_lines(written_lines, emoji_stats)
+    try:
+        with temp_md:
+            write_lines(written_lines, temp_md)
+    except Exception:
+        os.remove(temp_md_path)
+        cleanup_temp_images(mermaid_image_files)
+        raise
 
+    # Everything from here on runs under the cleanup below
+    temp_header_path = temp_pdf_path = media_dir = None
     try:
-        # Convert using pypandoc with error handling
-        # Use lualatex for better Unicode/emoji support
-        pypandoc.convert_file(
-            temp_md_path,
-            'pdf',
-            outputfile=temp_pdf_path,
-            extra_args=[
-                '--pdf-engine=lualatex',
-                '--from=markdown-yaml_metadata_block',
-                '--variable=geometry:margin=0.75in',
-                '--variable=colorlinks:true',
-                '--include-in-header=' + temp_header_path,
-                '--columns=80'  # Help Pandoc calculate better column widths
-                # Note: No explicit syntax highlighting flag - Pandoc uses default
-            ]
-        )
+        if frontmatter_source is None:
+            frontmatter_source = '\n'.join(frontmatter_lines) + '\n'
+
+        # Initialize header/footer processor if enabled
+        header_footer_latex = ""
+        if use_header_footer:
+            try:
+                template_manager = TemplateManager()
+
+                # Use specified preset or current default
+                if header_footer_preset:
+                    template_manager.set_current_preset(header_footer_preset)
+
+                processor = create_processor_from_preset(
+                    template_manager.get_current_preset(),
+                    template_manager
+                )
+
+                # Extract frontmatter from markdown
+                processor.extract_frontmatter(frontmatter_source)
+
+                # Generate header/footer LaTeX code
+                header_footer_latex = processor.generate_latex_header(custom_variables)
+            except Exception as e:
+                print(f"Warning: Header/footer generation failed: {e}")
+                header_footer_latex = ""
+
+        # Create enhanced LaTeX header with Obsidian support, limited to the
+        # packages and definitions the written document and header/footer use
+        header_features = None
+        if obsidian_mode and minimal_preamble_enabled():
+            with open(temp_md_path, encoding='utf-8') as written:
+                header_features = detect_header_features(
+                    itertools.chain(written, header_footer_latex.splitlines()))
+        if report is not None:
+            report['preamble_features'] = sorted(header_features) if header_features is not None else None
+
+        # pdfLaTeX is much faster, and enough for plain Latin text
+        with open(temp_md_path, encoding='utf-8') as written:
+            engine, engine_reason = select_engine(itertools.chain(written, header_footer_latex.splitlines()))
+        require_tools(engine, purpose='PDF conversion')
+
+        temp_header = tempfile.NamedTemporaryFile(mode='w', suffix='.tex', delete=False, encoding='utf-8')
+        temp_header_path = temp_header.name
+        temp_header.close()
+
+        # Create secure temporary file for PDF output
+        temp_pdf = tempfile.NamedTemporaryFile(suffix='.pdf', delete=False)
+        temp_pdf_path = temp_pdf.name
+        temp_pdf.close()
+
+        # LuaLaTeX runs in its own directory: Pandoc copies linked and remote
+        # images here and points the LaTeX at them
+        media_dir = tempfile.mkdtemp(prefix='pandoc-media-')
+
+        while True:
+            fonts = None
+            if engine == 'lualatex':
+                # Fonts load by path, from a names database updated once
+                fonts = get_font_map()
+                if get_capabilities().available('lualatex'):
+                    warm_font_cache()
+            with open(temp_header_path, 'w', encoding='utf-8') as header_file:
+                header_file.write(_latex_preamble(obsidian_mode, header_features, engine, fonts))
+                if emoji_stats and emoji_stats['replaced']:
+                    # Pandoc only loads graphicx for Markdown images
+                    header_file.write('\\usepackage{graphicx}  % For emoji images\n')
+
+                # Add header/footer configuration if enabled
+                if header_footer_latex:
+                    header_file.write('\n')
+                    header_file.write(header_footer_latex)
+
+            # Pandoc writes the LaTeX (its template adapts to either engine),
+            # which LuaLaTeX compiles starting from the cached preamble format
+            latex = pandoc_convert_file(
+                temp_md_path,
+                'latex',
+                extra_args=[
+                    '--standalone',
+                    '--extract-media=' + media_dir,
+                    '--from=markdown-yaml_metadata_block',
+                    '--variable=geometry:margin=0.75in',
+                    '--variable=colorlinks:true',
+                    '--include-in-header=' + temp_header_path,
+                    '--columns=80'  # Help Pandoc calculate better column widths
+                    # Note: No explicit syntax highlighting flag - Pandoc uses default
+                ]
+            )
+            try:
+                latex_passes = compile_latex(latex, temp_pdf_path, engine=engine,
+                                             workers=get_worker_pool() if engine == 'lualatex' else None)
+                break
+            except RuntimeError as e:
+                # A document pdfLaTeX was picked for automatically still gets LuaLaTeX
+                if engine != 'pdflatex' or requested_engine() is not None:
+                    raise
+                print(f"Warning: pdfLaTeX failed, retrying with LuaLaTeX: {e}")
+                require_tools('lualatex', purpose='PDF conversion')
+                engine, engine_reason = 'lualatex', 'pdfLaTeX failed, fell back to LuaLaTeX'
+        if report is not None:
+            if emoji_stats is not None:
+                report['emoji_images'] = emoji_stats
+            report['latex_engine'] = engine
+            report['latex_engine_reason'] = engine_reason
+            report['latex_passes'] = latex_passes
 
         # Read PDF into buffer
         with open(temp_pdf_path, 'rb') as pdf_file:
@@ -121,11 +352,39 @@ def convert_to_pdf(markdown_content, render_mermaid=True, obsidian_mode=True,
 
     finally:
         # Clean up temporary files
-        if os.path.exists(temp_md_path):
-            os.remove(temp_md_path)
-        if os.path.exists(temp_header_path):
-            os.remove(temp_header_path)
-        if os.path.exists(temp_pdf_path):
-            os.remove(temp_pdf_path)
+        for temp_path in (temp_md_path, temp_header_path, temp_pdf_path):
+            if temp_path and os.path.exists(temp_path):
+                os.remove(temp_path)
+        if media_dir:
+            shutil.rmtree(media_dir, ignore_errors=True)
         # Clean up Mermaid image files
         cleanup_temp_images(mermaid_image_files)
+
+
+def _iter_capture_frontmatter(lines: Iterable[str], captured: List[str],
+                              max_lines: int = FRONTMATTER_MAX_LINES) -> Iterator[str]:
+    """Pass lines through, copying a leading YAML frontmatter block into captured
+
+    Frontmatter not closed within max_lines lines is not captured.
+    """
+    lines = iter(lines)
+    first_line = next(lines, None)
+    if first_line is None:
+        return
+    yield first_line
+
+    if first_line.strip() != '---':
+        yield from lines
+        return
+
+    block = [first_line]
+    for line in lines:
+        yield line
+        block.append(line)
+        if line.strip() == '---':
+            captured.extend(block)
+            break
+        if len(block) > max_lines:
+            break
+
+    yield from lines
@@ -0,0 +1,99 @@
+"""Single-flight deduplication of identical work running concurrently
+
+When several threads need the same result at once (ten users converting the
+same template render the same diagrams), the first one to ask becomes the
+leader and computes it; the others wait on its flight and share the result
+instead of repeating the work. A finished flight is forgotten: later requests
+are served by the persistent caches, not by this module.
+"""
+
+import threading
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+
+
+class Flight:
+    """One computation in progress, awaited by its followers"""
+
+    def __init__(self):
+        self._done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+    def wait(self) -> Any:
+        """Block until the leader finishes; return its result or raise its error"""
+        self._done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class SingleFlight:
+    """Registry of in-progress computations keyed by content hash"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights: Dict[Hashable, Flight] = {}
+        self._executed = 0
+        self._shared = 0
+
+    def begin(self, keys: Iterable[Hashable]) -> Tuple[List[Hashable], Dict[Hashable, Flight]]:
+        """Claim keys for computation
+
+        Every key returned as owned must be passed to finish() later, even
+        when the computation fails, or its followers wait forever.
+
+        Args:
+            keys: Distinct keys the caller needs
+
+        Returns:
+            (owned, waiting): keys the caller now leads, and the flights of
+            keys another caller is already computing
+        """
+        owned = []
+        waiting = {}
+        with self._lock:
+            for key in keys:
+                flight = self._flights.get(key)
+                if flight is None:
+                    self._flights[key] = Flight()
+                    owned.append(key)
+                else:
+                    waiting[key] = flight
+            self._executed += len(owned)
+            self._shared += len(waiting)
+        return owned, waiting
+
+    def finish(self, key: Hashable, result: Any = None, error: Optional[BaseException] = None):
+        """Publish the outcome of an owned key to its followers"""
+        with self._lock:
+            flight = self._flights.pop(key)
+        flight.result = result
+        flight.error = error
+        flight._done.set()
+
+    def do(self, key: Hashable, function: Callable[[], Any]) -> Any:
+        """Return function(), sharing one call among concurrent callers of a key"""
+        owned, waiting = self.begin([key])
+        if not owned:
+            return waiting[key].wait()
+        try:
+            result = function()
+        except BaseException as e:
+            self.finish(key, error=e)
+            raise
+        self.finish(key, result)
+        return result
+
+    def record_shared(self, count: int):
+        """Count duplicates the caller resolved itself (e.g. within one batch)"""
+        with self._lock:
+            self._shared += count
+
+    def stats(self) -> Dict[str, int]:
+        """Return the executed/shared counters and the number of flights in progress"""
+        with self._lock:
+            return {
+                'executed': self._executed,
+                'shared': self._shared,
+                'in_flight': len(self._flights),
+            }
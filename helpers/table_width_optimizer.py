@@ -5,12 +5,41 @@ based on content length, then converts them to LaTeX tables with proportional wi
 """
 
 import re
-from typing import List, Tuple, Dict
+from itertools import chain
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+
+# Tables with more data rows are emitted as chained longtables of this many
+# rows: one huge longtable makes LaTeX slow and memory hungry
+LONGTABLE_CHUNK_ROWS = 1000
+
+
+def _cell_length_matrix(rows: List[List[str]], num_cols: int) -> np.ndarray:
+    """Load the stripped cell lengths of a table into a (rows, columns) array
+
+    Cells past num_cols are ignored and missing cells count as empty.
+    """
+    if all(len(row) == num_cols for row in rows):
+        cells = chain.from_iterable(rows)
+        lengths = np.fromiter(map(len, map(str.strip, cells)), dtype=np.intp, count=len(rows) * num_cols)
+        return lengths.reshape(len(rows), num_cols)
+
+    lengths = np.zeros((len(rows), num_cols), dtype=np.intp)
+    for index, row in enumerate(rows):
+        row = row[:num_cols]
+        lengths[index, :len(row)] = [len(cell.strip()) for cell in row]
+    return lengths
 
 
 def calculate_column_widths(rows: List[List[str]], min_width: float = 0.1, max_width: float = 0.6) -> List[float]:
     """Calculate optimal column widths based on content length
 
+    The per-cell work runs as NumPy array operations. The power is taken
+    once per distinct length and rows are summed in order, so the ratios are
+    bit-for-bit those of the former per-cell Python loop.
+
     Args:
         rows: List of rows, where each row is a list of cell contents
         min_width: Minimum width ratio for any column (default 0.1 = 10%)
@@ -26,34 +55,31 @@ def calculate_column_widths(rows: List[List[str]], min_width: float = 0.1, max_w
     if num_cols == 0:
         return []
 
-    # Calculate average content length per column
-    col_lengths = [0] * num_cols
-    for row in rows:
-        for i, cell in enumerate(row):
-            if i < num_cols:
-                # Weight longer content more heavily (sqrt to avoid extreme dominance)
-                col_lengths[i] += len(cell.strip()) ** 0.7
+    # Weight longer content more heavily (power < 1 to avoid extreme dominance)
+    lengths = _cell_length_matrix(rows, num_cols)
+    distinct = np.flatnonzero(np.bincount(lengths.ravel()))
+    powers = np.zeros(distinct[-1] + 1)
+    powers[distinct] = [float(length) ** 0.7 for length in distinct.tolist()]
+    weights = powers[lengths]
 
-    # Average across rows
-    total_rows = len(rows)
-    col_lengths = [length / total_rows for length in col_lengths]
+    # Average across rows (reducing axis 0 adds the rows one after another)
+    col_lengths = weights.sum(axis=0) / len(rows)
 
-    # Convert to ratios
-    total_length = sum(col_lengths)
+    # Convert to ratios (column totals use Python's left-to-right sum)
+    total_length = sum(col_lengths.tolist())
     if total_length == 0:
         # Equal widths if no content
         return [1.0 / num_cols] * num_cols
 
-    ratios = [length / total_length for length in col_lengths]
+    ratios = col_lengths / total_length
 
     # Apply min/max constraints
-    ratios = [max(min_width, min(max_width, r)) for r in ratios]
+    ratios = np.maximum(min_width, np.minimum(max_width, ratios))
 
     # Renormalize to sum to 1.0
-    total_ratio = sum(ratios)
-    ratios = [r / total_ratio for r in ratios]
+    ratios = ratios / sum(ratios.tolist())
 
-    return ratios
+    return ratios.tolist()
 
 
 def parse_pipe_table(table_text: str) -> Tuple[List[str], List[List[str]]]:
@@ -73,6 +99,7 @@ def parse_pipe_table(table_text: str) -> Tuple[List[str], List[List[str]]]:
     header_line = lines[0]
     headers = [cell.strip() for cell in header_line.split('|')]
     headers = [h for h in headers if h]  # Remove empty strings from leading/trailing |
+    num_cols = len(headers)
 
     # Skip separator line (second line with dashes)
     # Parse data rows (remaining lines)
@@ -80,12 +107,14 @@ def parse_pipe_table(table_text: str) -> Tuple[List[str], List[List[str]]]:
     for line in lines[2:]:
         if line.strip():
             cells = [cell.strip() for cell in line.split('|')]
-            cells = [c for c in cells if c or cells.index(c) > 0]  # Keep empty cells except leading
+            if not cells[0]:
+                # A leading | drops every empty cell, not only the leading one
+                cells = [c for c in cells if c]
             if cells:
                 # Pad or trim to match header length
-                while len(cells) < len(headers):
-                    cells.append('')
-                data_rows.append(cells[:len(headers)])
+                if len(cells) < num_cols:
+                    cells.extend([''] * (num_cols - len(cells)))
+                data_rows.append(cells[:num_cols])
 
     return headers, data_rows
 
@@ -148,112 +177,198 @@ def escape_latex_chars(text: str) -> str:
     return text
 
 
+# LaTeX escapes of cell text; backslashes pass through so raw LaTeX survives
+CELL_ESCAPES = str.maketrans({
+    '&': r'\&',
+    '%': r'\%',
+    '$': r'\$',
+    '#': r'\#',
+    '{': r'\{',
+    '}': r'\}',
+    '~': r'\textasciitilde{}',
+    '^': r'\textasciicircum{}',
+    '_': r'\_',
+})
+
+# Emphasis delimiter runs and code span backticks
+CELL_TOKEN_PATTERN = re.compile(r'\*+|_+|`')
+
+# (opening, closing) markup of an emphasis by delimiter count
+EMPHASIS_MARKUP = {
+    1: ('\\textit{', '}'),
+    2: ('\\textbf{', '}'),
+    3: ('\\textbf{\\textit{', '}}'),
+}
+
+
+def _is_word_char(char: str) -> bool:
+    """Whether char matches the regex class \\w (an empty string does not)"""
+    return char.isalnum() or char == '_'
+
+
+def _delimiter_literal(char: str, count: int) -> str:
+    """Text of an unmatched delimiter run"""
+    return (r'\_' if char == '_' else char) * count
+
+
+def _emphasis_run(text: str, start: int, end: int, paired: bool,
+                  out: List[str], stack: List[List]) -> None:
+    """Close and/or open emphasis with the delimiter run text[start:end]
+
+    Like the former bold-before-italic regex passes, a run first closes an
+    open emphasis with the same delimiters, and waits for a later identical
+    run rather than closing a different one. Otherwise it closes the
+    innermost open emphasis of its character, splitting the longer of the two
+    runs. Openers above a closed one stay literal; what is left of the run
+    opens a new emphasis.
+
+    Args:
+        text: Cell text
+        start: Start of the run
+        end: End of the run
+        paired: Whether a later run has the same delimiters
+        out: Output pieces; an opener owns two slots, its outermost delimiter
+            text and the markup of emphases already closed inside it
+        stack: Open emphases as [char, count, slot index, whether the
+            innermost delimiter may open an italic]
+    """
+    char = text[start]
+    count = end - start
+    after = text[end] if end < len(text) else ''
+
+    while count:
+        opener = -1
+        for index in range(len(stack) - 1, -1, -1):
+            if stack[index][0] == char:
+                if opener == -1:
+                    opener = index
+                if stack[index][1] == count:
+                    opener = index
+                    break
+        else:
+            if opener == -1 or (paired and count <= 3):
+                break
+
+        _, open_count, slot, italic = stack[opener]
+        used = min(count, open_count)
+        # An italic needs no word character before its opening delimiter and
+        # none after its closing one (like (?<!\w)\*(.+?)\*(?!\w))
+        if used == 1 and not (italic and not _is_word_char(after if count == 1 else char)):
+            break
+
+        opening, closing = EMPHASIS_MARKUP[used]
+        del stack[opener + 1:]
+        if open_count > used:
+            # The innermost delimiters of the opener start this emphasis
+            out[slot + 1] = opening + out[slot + 1]
+            out[slot] = _delimiter_literal(char, open_count - used)
+            stack[opener][1] = open_count - used
+        else:
+            out[slot] = opening
+            stack.pop()
+        out.append(closing)
+        count -= used
+
+    if not count:
+        return
+    if count > 3:
+        # Only the innermost three delimiters can open an emphasis
+        out.append(_delimiter_literal(char, count - 3))
+        count = 3
+    if count == end - start == 1:
+        before = text[start - 1] if start else ''
+    else:
+        # The innermost delimiter follows another one of the run
+        before = char
+    italic = not _is_word_char(before)
+    if count == 1 and not italic:
+        out.append(_delimiter_literal(char, count))
+        return
+    stack.append([char, count, len(out), italic])
+    out.append(_delimiter_literal(char, count))
+    out.append('')
+
+
 def process_cell_content(text: str) -> str:
     """Process table cell content: escape special chars, then convert markdown to LaTeX
 
+    Bold (``**``/``__``), italic (``*``/``_``), bold italic (``***``/``___``)
+    and code spans are tokenized in one scan, then compiled left to right with
+    a stack of open emphases, so they nest in any order and every character is
+    escaped exactly once. Code span content is escaped but never formatted.
+
     Args:
         text: Raw cell content with potential markdown formatting
 
     Returns:
         LaTeX-ready cell content
     """
-    import re
-
-    # Strategy: Process markdown patterns one by one, escaping content before wrapping
-
-    # Define special char escaping (excluding markdown markers)
-    def escape_special_chars(s: str) -> str:
-        """Escape LaTeX special characters except markdown markers"""
-        replacements = [
-            ('&', r'\&'),
-            ('%', r'\%'),
-            ('$', r'\$'),
-            ('#', r'\#'),
-            ('{', r'\{'),
-            ('}', r'\}'),
-            ('~', r'\textasciitilde{}'),
-            ('^', r'\textasciicircum{}'),
-        ]
-        for old, new in replacements:
-            s = s.replace(old, new)
-        return s
-
-    # Process bold + italic: ***text*** or ___text___
-    def process_bold_italic(match):
-        content = escape_special_chars(match.group(1))
-        # Escape underscores for this specific case
-        content = content.replace('_', r'\_')
-        return f'\\textbf{{\\textit{{{content}}}}}'
-
-    text = re.sub(r'\*\*\*(.+?)\*\*\*', process_bold_italic, text)
-    text = re.sub(r'___(.+?)___', process_bold_italic, text)
-
-    # Process bold: **text** or __text__
-    def process_bold(match):
-        content = escape_special_chars(match.group(1))
-        # Escape underscores for this specific case
-        content = content.replace('_', r'\_')
-        return f'\\textbf{{{content}}}'
-
-    text = re.sub(r'\*\*(.+?)\*\*', process_bold, text)
-    text = re.sub(r'__(.+?)__', process_bold, text)
-
-    # Process italic: *text* or _text_
-    def process_italic(match):
-        content = escape_special_chars(match.group(1))
-        # Escape underscores for this specific case
-        content = content.replace('_', r'\_')
-        return f'\\textit{{{content}}}'
-
-    text = re.sub(r'(?<!\w)\*(.+?)\*(?!\w)', process_italic, text)
-    text = re.sub(r'(?<!\w)_(.+?)_(?!\w)', process_italic, text)
-
-    # Process inline code: `code`
-    def process_code(match):
-        content = escape_special_chars(match.group(1))
-        # Escape underscores for code
-        content = content.replace('_', r'\_')
-        return f'\\texttt{{{content}}}'
-
-    text = re.sub(r'`(.+?)`', process_code, text)
-
-    # Now we need to escape remaining special chars, but NOT the ones in our LaTeX commands
-    # Protect all LaTeX commands we just created
-    import re as re_module
-    latex_commands = []
-
-    def protect_latex(match):
-        latex_commands.append(match.group(0))
-        return f'<<<LATEX{len(latex_commands)-1}>>>'
-
-    # Protect all \textbf{...}, \textit{...}, \texttt{...} patterns (including nested ones)
-    # Use a more robust pattern that handles nested braces
-    text = re_module.sub(r'\\text(?:bf|it|tt)\{(?:[^{}]|\\text(?:bf|it|tt)\{[^{}]*\})*\}', protect_latex, text)
-
-    # Now escape any remaining special characters
-    text = escape_special_chars(text)
-    text = text.replace('_', r'\_')
-
-    # Restore LaTeX commands
-    for i, cmd in enumerate(latex_commands):
-        text = text.replace(f'<<<LATEX{i}>>>', cmd)
-
-    return text
-
-
-def convert_table_to_latex(headers: List[str], rows: List[List[str]], widths: List[float]) -> str:
-    """Convert table data to LaTeX longtable with specified widths
+    # Escaped text pieces and (start, end) emphasis runs
+    tokens = []
+    position = 0
+
+    match = CELL_TOKEN_PATTERN.search(text)
+    while match is not None:
+        start, end = match.span()
+        tokens.append(text[position:start].translate(CELL_ESCAPES))
+        position = end
+
+        if text[start] == '`':
+            # Like `(.+?)`: the code is at least one character long
+            close = text.find('`', end + 1)
+            if close != -1:
+                tokens.append('\\texttt{' + text[end:close].translate(CELL_ESCAPES) + '}')
+                position = close + 1
+            else:
+                tokens.append('`')
+        else:
+            tokens.append((start, end))
+
+        match = CELL_TOKEN_PATTERN.search(text, position)
+    tokens.append(text[position:].translate(CELL_ESCAPES))
+
+    if len(tokens) == 1:
+        return tokens[0]
+
+    # Whether each run has an identical run after it
+    paired = [False] * len(tokens)
+    seen = set()
+    for index in range(len(tokens) - 1, -1, -1):
+        token = tokens[index]
+        if isinstance(token, tuple):
+            run = text[token[0]:token[1]]
+            paired[index] = run in seen
+            seen.add(run)
+
+    out = []
+    stack = []
+    for index, token in enumerate(tokens):
+        if isinstance(token, tuple):
+            _emphasis_run(text, token[0], token[1], paired[index], out, stack)
+        else:
+            out.append(token)
+    return ''.join(out)
+
+
+def iter_longtable_lines(headers: List[str], rows: Iterable[List[str]], widths: List[float],
+                         chunk_rows: Optional[int] = LONGTABLE_CHUNK_ROWS) -> Iterator[str]:
+    """Yield the lines of a LaTeX longtable with specified widths, row by row
+
+    Tables with more than chunk_rows data rows are split into chained
+    longtables of chunk_rows rows, each repeating the header before its
+    \\endhead, so LaTeX never has to hold one giant table.
 
     Args:
         headers: List of header cell contents
-        rows: List of data rows
+        rows: Data rows, consumed lazily
         widths: List of column width ratios (should sum to ~1.0)
+        chunk_rows: Data rows per longtable, or None to never split
 
-    Returns:
-        LaTeX table code as string
+    Yields:
+        LaTeX table code lines (wrapped in a raw latex block)
     """
     if not headers or not widths:
-        return ""
+        return
 
     # Use 95% of textwidth to leave margins and prevent overflow
     total_width_ratio = 0.95
@@ -267,92 +382,126 @@ def convert_table_to_latex(headers: List[str], rows: List[List[str]], widths: Li
 
     col_spec_str = '|'.join(col_specs)
 
-    # Build LaTeX table
-    latex_lines = [
-        '',
-        '```{=latex}',
+    # Header row (process markdown and escape LaTeX special characters),
+    # repeated at the start of every chunk
+    processed_headers = [process_cell_content(h) for h in headers]
+    table_head = [
         '\\begin{longtable}[]{@{}' + col_spec_str + '@{}}',
         '\\toprule',
+        ' & '.join(processed_headers) + ' \\\\',
+        '\\midrule',
+        '\\endhead',
     ]
 
-    # Add header row (process markdown and escape LaTeX special characters)
-    processed_headers = [process_cell_content(h) for h in headers]
-    header_str = ' & '.join(processed_headers) + ' \\\\'
-    latex_lines.append(header_str)
-    latex_lines.append('\\midrule')
-    latex_lines.append('\\endhead')
+    yield ''
+    yield '```{=latex}'
+    yield from table_head
 
     # Add data rows (process markdown and escape LaTeX special characters)
-    for row in rows:
+    for index, row in enumerate(rows):
+        if chunk_rows and index and index % chunk_rows == 0:
+            # Chain the next chunk (the previous one ends without a bottom rule)
+            yield '\\end{longtable}'
+            yield from table_head
         processed_row = [process_cell_content(cell) for cell in row]
-        row_str = ' & '.join(processed_row) + ' \\\\'
-        latex_lines.append(row_str)
+        yield ' & '.join(processed_row) + ' \\\\'
 
     # Close table
-    latex_lines.append('\\bottomrule')
-    latex_lines.append('\\end{longtable}')
-    latex_lines.append('```')
-    latex_lines.append('')
+    yield '\\bottomrule'
+    yield '\\end{longtable}'
+    yield '```'
+    yield ''
 
-    return '\n'.join(latex_lines)
 
+def convert_table_to_latex(headers: List[str], rows: List[List[str]], widths: List[float],
+                           chunk_rows: Optional[int] = LONGTABLE_CHUNK_ROWS) -> str:
+    """Convert table data to LaTeX longtable with specified widths
 
-def optimize_table_widths(markdown_content: str) -> str:
+    Args:
+        headers: List of header cell contents
+        rows: List of data rows
+        widths: List of column width ratios (should sum to ~1.0)
+        chunk_rows: Data rows per longtable chunk, or None to never split
+
+    Returns:
+        LaTeX table code as string
+    """
+    return '\n'.join(iter_longtable_lines(headers, rows, widths, chunk_rows))
+
+
+def is_table_separator(line: str) -> bool:
+    """Check if a line is a pipe table separator (contains pipes and dashes or colons)"""
+    separator = line.strip()
+    return '|' in separator and ('-' in separator or ':' in separator)
+
+
+def iter_optimized_table_lines(lines: Iterable[str],
+                               chunk_rows: Optional[int] = LONGTABLE_CHUNK_ROWS) -> Iterator[str]:
+    """Yield lines with pipe tables replaced by optimized LaTeX tables
+
+    Streaming form of optimize_table_widths: only the rows of the table being
+    collected are held in memory, everything else passes straight through.
+
+    Args:
+        lines: Markdown lines (without trailing newlines)
+        chunk_rows: Data rows per longtable chunk of large tables, or None
+            to never split
+
+    Yields:
+        Output lines, with each converted table expanded into its LaTeX lines
+    """
+    lines = iter(lines)
+    line = next(lines, None)
+
+    while line is not None:
+        # Check if this line starts a pipe table
+        if not line.strip().startswith('|'):
+            # Not a table line, keep as-is
+            yield line
+            line = next(lines, None)
+            continue
+
+        # Look ahead for separator line
+        next_line = next(lines, None)
+        if next_line is None:
+            yield line
+            return
+
+        if not is_table_separator(next_line):
+            # Not a table: the look-ahead line may itself start one
+            yield line
+            line = next_line
+            continue
+
+        # Found a table! Collect separator and all subsequent table rows
+        table_lines = [line]
+        line = next_line
+        while line is not None and line.strip().startswith('|'):
+            table_lines.append(line)
+            line = next(lines, None)
+
+        # Parse and optimize the table
+        headers, data_rows = parse_pipe_table('\n'.join(table_lines))
+
+        if headers and data_rows:
+            # Calculate optimal widths and convert to LaTeX
+            widths = calculate_column_widths([headers] + data_rows)
+            yield from iter_longtable_lines(headers, data_rows, widths, chunk_rows)
+        else:
+            # Failed to parse, keep original
+            yield from table_lines
+
+
+def optimize_table_widths(markdown_content: str,
+                          chunk_rows: Optional[int] = LONGTABLE_CHUNK_ROWS) -> str:
     """Find all pipe tables in markdown and replace with optimized LaTeX tables
 
     Args:
         markdown_content: Full markdown document content
+        chunk_rows: Data rows per longtable chunk of large tables, or None
+            to never split
 
     Returns:
         Markdown content with tables replaced by LaTeX tables with optimal widths
     """
-    # Regex to match pipe tables (must have header, separator, and at least one row)
-    # Look for lines starting with | and containing |
-    lines = markdown_content.split('\n')
-    result_lines = []
-    i = 0
-
-    while i < len(lines):
-        line = lines[i]
-
-        # Check if this line starts a pipe table
-        if line.strip().startswith('|') and '|' in line:
-            # Look ahead for separator line
-            if i + 1 < len(lines):
-                next_line = lines[i + 1].strip()
-                # Check if next line is a separator (contains dashes and pipes)
-                if '|' in next_line and any(c in next_line for c in ['-', ':']):
-                    # Found a table! Collect all table lines
-                    table_lines = [line]
-                    j = i + 1
-
-                    # Collect separator and all subsequent table rows
-                    while j < len(lines) and lines[j].strip().startswith('|'):
-                        table_lines.append(lines[j])
-                        j += 1
-
-                    # Parse and optimize the table
-                    table_text = '\n'.join(table_lines)
-                    headers, data_rows = parse_pipe_table(table_text)
-
-                    if headers and data_rows:
-                        # Calculate optimal widths
-                        all_rows = [headers] + data_rows
-                        widths = calculate_column_widths(all_rows)
-
-                        # Convert to LaTeX
-                        latex_table = convert_table_to_latex(headers, data_rows, widths)
-                        result_lines.append(latex_table)
-                    else:
-                        # Failed to parse, keep original
-                        result_lines.extend(table_lines)
-
-                    # Skip past the table
-                    i = j
-                    continue
-
-        # Not a table line, keep as-is
-        result_lines.append(line)
-        i += 1
-
-    return '\n'.join(result_lines)
+    return '\n'.join(iter_optimized_table_lines(markdown_content.split('\n'), chunk_rows))
@@ -1,5 +1,14 @@
 """YAML frontmatter removal"""
 
+import itertools
+from typing import Iterable, Iterator
+
+
+# Lines searched for the closing --- of YAML frontmatter. A document whose
+# first line is --- without a closing line among the next FRONTMATTER_MAX_LINES
+# has no frontmatter (shared by the parser, the sanitizer and the PDF header)
+FRONTMATTER_MAX_LINES = 500
+
 
 def strip_yaml_frontmatter(markdown_content):
     """Remove YAML frontmatter from markdown content"""
@@ -8,10 +17,40 @@ def strip_yaml_frontmatter(markdown_content):
     # Check if content starts with YAML frontmatter (---)
     if lines and lines[0].strip() == '---':
         # Find the closing ---
-        for i in range(1, len(lines)):
+        for i in range(1, min(len(lines), FRONTMATTER_MAX_LINES + 1)):
             if lines[i].strip() == '---':
                 # Return content after the closing ---
                 return '\n'.join(lines[i+1:])
 
     # No frontmatter found, return original content
     return markdown_content
+
+
+def iter_yaml_stripped_lines(lines: Iterable[str]) -> Iterator[str]:
+    """Streaming version of strip_yaml_frontmatter
+
+    Only the frontmatter itself is buffered, at most FRONTMATTER_MAX_LINES
+    lines (it is kept if not closed within them).
+    """
+    lines = iter(lines)
+    first_line = next(lines, None)
+    if first_line is None:
+        return
+
+    # Check if content starts with YAML frontmatter (---)
+    if first_line.strip() != '---':
+        yield first_line
+        yield from lines
+        return
+
+    frontmatter = [first_line]
+    for line in itertools.islice(lines, FRONTMATTER_MAX_LINES):
+        if line.strip() == '---':
+            # Yield content after the closing ---
+            yield from lines
+            return
+        frontmatter.append(line)
+
+    # No closing --- found, keep original content
+    yield from frontmatter
+    yield from lines
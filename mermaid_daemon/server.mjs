@@ -0,0 +1,275 @@
+// Warm Mermaid render service
+//
+// Keeps one headless Chromium with a pool of pages that already have Mermaid
+// loaded, and renders diagrams to PNG for clients on a Unix socket. This
+// removes the browser startup that every mmdc run pays.
+//
+// Protocol: one JSON request line per connection, one JSON response line.
+//   {"op": "render", "code": "...", "scale": 2, "background": "transparent", "timeout_ms": 30000,
+//    "format": "png"|"pdf"}
+//     -> {"ok": true, "<format>": "<base64>"} or {"ok": false, "kind": "render"|"timeout", "error": "..."}
+//   PDFs are vector, one page cropped to the diagram.
+//   {"op": "health"}
+//     -> {"ok": true, "version": "<mermaid version>", "pool_size": 4, "idle": 3, ...}
+//
+// Restart policy: a page is replaced after --page-renders renders or after a
+// timeout; the browser is relaunched after --browser-renders renders, when
+// its resident memory exceeds --max-memory-mb, or when it crashes.
+
+import fs from 'node:fs';
+import net from 'node:net';
+import { createRequire } from 'node:module';
+import { parseArgs } from 'node:util';
+import puppeteer from 'puppeteer';
+
+const require = createRequire(import.meta.url);
+const MERMAID_PATH = require.resolve('mermaid/dist/mermaid.min.js');
+const MERMAID_VERSION = require('mermaid/package.json').version;
+
+const { values: options } = parseArgs({
+  options: {
+    socket: { type: 'string', default: '/tmp/markdown-converter-mermaid.sock' },
+    'pool-size': { type: 'string', default: '4' },
+    'timeout-ms': { type: 'string', default: '30000' },
+    'page-renders': { type: 'string', default: '200' },
+    'browser-renders': { type: 'string', default: '2000' },
+    'max-memory-mb': { type: 'string', default: '1024' },
+  },
+});
+
+const POOL_SIZE = Number(options['pool-size']);
+const DEFAULT_TIMEOUT_MS = Number(options['timeout-ms']);
+const PAGE_RENDERS = Number(options['page-renders']);
+const BROWSER_RENDERS = Number(options['browser-renders']);
+const MAX_MEMORY_MB = Number(options['max-memory-mb']);
+
+const PAGE_HTML = '<!doctype html><html><body style="margin:0"><div id="container"></div></body></html>';
+
+const stats = { renders: 0, failures: 0, timeouts: 0, page_restarts: 0, browser_restarts: 0 };
+const startedAt = Date.now();
+
+let browser = null;
+let browserRenders = 0;
+let idlePages = [];
+let busyPages = 0;
+const waiters = [];
+let restarting = null;
+
+async function newPage() {
+  const page = await browser.newPage();
+  page.renders = 0;
+  await page.setContent(PAGE_HTML);
+  await page.addScriptTag({ path: MERMAID_PATH });
+  await page.evaluate(() => window.mermaid.initialize({ startOnLoad: false }));
+  return page;
+}
+
+async function launchBrowser() {
+  browser = await puppeteer.launch({ headless: true, args: ['--no-sandbox'] });
+  browser.on('disconnected', () => {
+    // Crashed (or closed for a restart): pages are gone with it
+    if (!restarting) {
+      restartBrowser().catch((error) => console.error('browser restart failed:', error));
+    }
+  });
+  browserRenders = 0;
+  idlePages = await Promise.all(Array.from({ length: POOL_SIZE }, newPage));
+  wakeWaiters();
+}
+
+async function restartBrowser() {
+  if (!restarting) {
+    restarting = (async () => {
+      stats.browser_restarts += 1;
+      const old = browser;
+      idlePages = [];
+      try {
+        await old?.close();
+      } catch {
+        // Already dead
+      }
+      await launchBrowser();
+    })().finally(() => {
+      restarting = null;
+    });
+  }
+  return restarting;
+}
+
+function browserMemoryMb() {
+  // Linux only: resident set size of the browser process
+  const pid = browser?.process()?.pid;
+  try {
+    const status = fs.readFileSync(`/proc/${pid}/status`, 'utf8');
+    const match = status.match(/VmRSS:\s+(\d+) kB/);
+    return match ? Number(match[1]) / 1024 : 0;
+  } catch {
+    return 0;
+  }
+}
+
+function wakeWaiters() {
+  while (waiters.length && idlePages.length) {
+    busyPages += 1;
+    waiters.shift()(idlePages.pop());
+  }
+}
+
+function acquirePage() {
+  return new Promise((resolve) => {
+    waiters.push(resolve);
+    wakeWaiters();
+  });
+}
+
+async function releasePage(page, healthy) {
+  busyPages -= 1;
+  if (page.browser() !== browser) {
+    // Belongs to a browser that was restarted meanwhile
+    return;
+  }
+  if (!healthy || page.renders >= PAGE_RENDERS) {
+    stats.page_restarts += 1;
+    page.close().catch(() => {});
+    try {
+      page = await newPage();
+    } catch (error) {
+      console.error('page restart failed:', error);
+      await restartBrowser();
+      return;
+    }
+  }
+  idlePages.push(page);
+  wakeWaiters();
+
+  if (busyPages === 0 && (browserRenders >= BROWSER_RENDERS || browserMemoryMb() > MAX_MEMORY_MB)) {
+    await restartBrowser();
+  }
+}
+
+async function renderOnPage(page, code, scale, background, format) {
+  await page.setViewport({ width: 800, height: 600, deviceScaleFactor: scale });
+  const id = `diagram${stats.renders}`;
+  const error = await page.evaluate(async (id, code, background) => {
+    const container = document.getElementById('container');
+    container.innerHTML = '';
+    document.body.style.background = background;
+    try {
+      const { svg } = await window.mermaid.render(id, code);
+      container.innerHTML = svg;
+      return null;
+    } catch (error) {
+      return String(error?.message ?? error);
+    } finally {
+      // Mermaid leaves its scratch element behind when parsing fails
+      document.getElementById(`d${id}`)?.remove();
+    }
+  }, id, code, background);
+  if (error !== null) {
+    throw Object.assign(new Error(error), { kind: 'render' });
+  }
+  const svg = await page.$('#container svg');
+  if (format === 'pdf') {
+    // One page the size of the diagram (CSS px, i.e. 0.75pt each)
+    const box = await svg.boundingBox();
+    return page.pdf({
+      width: `${Math.ceil(box.width)}px`,
+      height: `${Math.ceil(box.height)}px`,
+      pageRanges: '1',
+      printBackground: background !== 'transparent',
+      omitBackground: background === 'transparent',
+    });
+  }
+  return svg.screenshot({ type: 'png', omitBackground: background === 'transparent' });
+}
+
+async function render(request) {
+  const timeoutMs = Number(request.timeout_ms ?? DEFAULT_TIMEOUT_MS);
+  const format = request.format === 'pdf' ? 'pdf' : 'png';
+  const page = await acquirePage();
+  let timer;
+  let healthy = true;
+  try {
+    const timeout = new Promise((_, reject) => {
+      timer = setTimeout(
+        () => reject(Object.assign(new Error(`render timed out after ${timeoutMs} ms`), { kind: 'timeout' })),
+        timeoutMs,
+      );
+    });
+    const image = await Promise.race([
+      renderOnPage(page, String(request.code ?? ''), Number(request.scale ?? 2),
+        String(request.background ?? 'transparent'), format),
+      timeout,
+    ]);
+    stats.renders += 1;
+    return { ok: true, [format]: Buffer.from(image).toString('base64') };
+  } catch (error) {
+    stats.failures += 1;
+    if (error.kind === 'timeout') {
+      stats.timeouts += 1;
+    }
+    // A page that timed out or crashed may be stuck: replace it
+    healthy = error.kind === 'render';
+    return { ok: false, kind: error.kind ?? 'internal', error: String(error.message ?? error) };
+  } finally {
+    clearTimeout(timer);
+    page.renders += 1;
+    browserRenders += 1;
+    releasePage(page, healthy).catch((error) => console.error('page release failed:', error));
+  }
+}
+
+function health() {
+  return {
+    ok: true,
+    version: MERMAID_VERSION,
+    pool_size: POOL_SIZE,
+    idle: idlePages.length,
+    busy: busyPages,
+    queued: waiters.length,
+    browser_memory_mb: Math.round(browserMemoryMb()),
+    uptime_s: Math.round((Date.now() - startedAt) / 1000),
+    ...stats,
+  };
+}
+
+function handle(connection) {
+  let buffer = '';
+  connection.setEncoding('utf8');
+  connection.on('data', async (chunk) => {
+    buffer += chunk;
+    const newline = buffer.indexOf('\n');
+    if (newline === -1) {
+      return;
+    }
+    connection.pause();
+    let response;
+    try {
+      const request = JSON.parse(buffer.slice(0, newline));
+      response = request.op === 'health' ? health() : await render(request);
+    } catch (error) {
+      response = { ok: false, kind: 'request', error: String(error.message ?? error) };
+    }
+    connection.end(JSON.stringify(response) + '\n');
+  });
+  connection.on('error', () => {});
+}
+
+await launchBrowser();
+
+if (fs.existsSync(options.socket)) {
+  fs.unlinkSync(options.socket);
+}
+const server = net.createServer(handle);
+server.listen(options.socket, () => {
+  console.log(`mermaid daemon: ${POOL_SIZE} pages on ${options.socket} (mermaid ${MERMAID_VERSION})`);
+});
+
+for (const signal of ['SIGINT', 'SIGTERM']) {
+  process.on(signal, async () => {
+    server.close();
+    restarting = Promise.resolve();
+    await browser?.close().catch(() => {});
+    process.exit(0);
+  });
+}
@@ -0,0 +1,136 @@
+"""Tests for the cache of finished PDF/DOCX artifacts"""
+
+import io
+import threading
+
+import pytest
+
+from helpers import artifact_cache, docx_converter, pandoc_server, pdf_converter
+from helpers.artifact_cache import artifact_key, cached_artifact, source_digest
+from helpers.disk_cache import DiskCache
+
+
+@pytest.fixture
+def cache(monkeypatch, tmp_path):
+    cache = DiskCache(tmp_path / 'artifacts', max_bytes=1 << 20, max_age=3600)
+    monkeypatch.setattr(artifact_cache, '_artifact_cache', cache)
+    monkeypatch.delenv(artifact_cache.ARTIFACT_CACHE_ENV, raising=False)
+    return cache
+
+
+@pytest.fixture
+def fake_pdf_pipeline(monkeypatch):
+    """Count Pandoc runs; the PDF holds the number of the run that made it"""
+    runs = []
+
+    def fake_convert_file(source_file, to, outputfile=None, extra_args=None):
+        runs.append(source_file)
+        return '\\documentclass{article}\n\\begin{document}\n\\end{document}\n'
+
+    def fake_compile_latex(latex, output_path, **kwargs):
+        with open(output_path, 'wb') as f:
+            f.write(b'%PDF-' + str(len(runs)).encode())
+        return [{'draft': False, 'seconds': 0.1, 'aux_changed': True, 'rerun_requested': False}]
+
+    monkeypatch.setattr(pandoc_server.pypandoc, 'convert_file', fake_convert_file)
+    monkeypatch.setattr(pdf_converter, 'require_tools', lambda *names, **kwargs: None)
+    monkeypatch.setattr(pdf_converter, 'compile_latex', fake_compile_latex)
+    return runs
+
+
+@pytest.mark.unit
+def test_source_digest_rewinds_streams():
+    stream = io.StringIO('# Title\nbody\n')
+    stream.readline()
+    assert source_digest(stream) == source_digest('body\n')
+    assert stream.read() == 'body\n'
+    assert source_digest(iter(['# Title'])) is None
+
+
+@pytest.mark.unit
+def test_source_digest_reads_binary_streams():
+    stream = io.BytesIO(b'abc')
+    assert source_digest(stream) == source_digest('abc')
+    assert stream.read() == b'abc'
+
+
+@pytest.mark.unit
+def test_key_covers_options_and_inputs():
+    base = artifact_key('pdf', 'abc', {'a': 1}, {'logo': b'PNG', 'pandoc': '3.1'})
+    assert base == artifact_key('pdf', 'abc', {'a': 1}, {'pandoc': '3.1', 'logo': b'PNG'})
+    assert base != artifact_key('docx', 'abc', {'a': 1}, {'logo': b'PNG', 'pandoc': '3.1'})
+    assert base != artifact_key('pdf', 'abc', {'a': 2}, {'logo': b'PNG', 'pandoc': '3.1'})
+    assert base != artifact_key('pdf', 'abc', {'a': 1}, {'logo': b'PNG2', 'pandoc': '3.1'})
+    assert base != artifact_key('pdf', 'abc', {'a': 1}, {'logo': None, 'pandoc': '3.1'})
+
+
+@pytest.mark.unit
+def test_concurrent_identical_builds_run_once(cache):
+    started = threading.Event()
+    release = threading.Event()
+    builds = []
+
+    def build():
+        builds.append(1)
+        started.set()
+        release.wait(5)
+        return b'artifact', {'stages': ['x']}
+
+    reports = [{}, {}]
+    leader = threading.Thread(target=cached_artifact, args=('k' * 64, build, reports[0]))
+    leader.start()
+    started.wait(5)
+    follower = threading.Thread(target=cached_artifact, args=('k' * 64, build, reports[1]))
+    follower.start()
+    release.set()
+    leader.join()
+    follower.join()
+
+    assert len(builds) == 1
+    assert reports[0] == {'stages': ['x'], 'artifact_cache': 'miss'}
+    assert reports[1]['artifact_cache'] in ('shared', 'hit')
+
+
+@pytest.mark.integration
+def test_repeat_pdf_conversion_is_a_hit(cache, fake_pdf_pipeline, monkeypatch):
+    report = {}
+    first = pdf_converter.convert_to_pdf('# Title\n**a** b', render_mermaid=False,
+                                         use_header_footer=False, report=report)
+    assert report['artifact_cache'] == 'miss'
+
+    report = {}
+    second = pdf_converter.convert_to_pdf(io.StringIO('# Title\n**a** b'), render_mermaid=False,
+                                          use_header_footer=False, report=report)
+    assert second.read() == first.read() == b'%PDF-1'
+    assert len(fake_pdf_pipeline) == 1
+    assert report['artifact_cache'] == 'hit'
+    assert report['stages'] == ['fix_consecutive_bold_lines', 'fix_list_blank_lines']
+
+    # Any option change is a different artifact
+    pdf_converter.convert_to_pdf('# Title\n**a** b', render_mermaid=False, use_header_footer=False,
+                                 mermaid_format='png')
+    assert len(fake_pdf_pipeline) == 2
+
+    # So is a different preamble
+    monkeypatch.setenv(pdf_converter.MINIMAL_PREAMBLE_ENV, '0')
+    pdf_converter.convert_to_pdf('# Title\n**a** b', render_mermaid=False, use_header_footer=False)
+    assert len(fake_pdf_pipeline) == 3
+
+    # Line iterators cannot be hashed up front and always convert
+    report = {}
+    pdf_converter.convert_to_pdf(iter(['# Title']), render_mermaid=False,
+                                 use_header_footer=False, report=report)
+    assert report['artifact_cache'] == 'bypass'
+
+
+@pytest.mark.integration
+def test_repeat_docx_conversion_is_a_hit(cache, monkeypatch):
+    report = {}
+    first = docx_converter.convert_to_docx('# Title\n\nbody', render_mermaid=False, report=report).read()
+    assert report['artifact_cache'] == 'miss'
+
+    monkeypatch.setattr(docx_converter, '_convert_to_docx', None)
+    report = {}
+    assert docx_converter.convert_to_docx('# Title\n\nbody', render_mermaid=False, report=report).read() == first
+    assert report['artifact_cache'] == 'hit'
+    assert cache.stats()['hits'] == 2  # the artifact and its report
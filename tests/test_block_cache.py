@@ -0,0 +1,125 @@
+"""Tests for block-level preprocessing memoization"""
+
+import glob
+import os
+
+import pytest
+
+from helpers.block_cache import BlockCache
+from helpers.disk_cache import DiskCache
+from helpers.document_ir import parse_document
+from helpers.obsidian_preprocessor import LatexMarkdownEmitter, preprocess_obsidian_syntax
+from helpers.obsidian_to_html import preprocess_obsidian_for_html
+
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CORPUS = sorted(glob.glob(os.path.join(REPO_ROOT, '**', '*.md'), recursive=True))
+
+DOCUMENT = '\n'.join([
+    '---',
+    'title: Cached',
+    '',
+    '---',
+    '# Heading',
+    '',
+    '| a | b |',
+    '|---|---|',
+    '| **x** | y |',
+    '',
+    '> [!note] Title',
+    '> body',
+    '',
+    '```',
+    'code',
+    '',
+    '---',
+    '```',
+    '',
+    '| c | d |',
+    '|---|---|',
+    '| 3 | 4 |',
+    '',
+    '---',
+    '**a** b',
+    '**c** d',
+    '- list',
+])
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize('preprocess', [preprocess_obsidian_syntax, preprocess_obsidian_for_html])
+def test_cached_output_matches_uncached(preprocess):
+    cache = BlockCache()
+    expected = preprocess(DOCUMENT)
+
+    assert preprocess(DOCUMENT, cache=cache) == expected
+    first = cache.stats()
+    assert first['misses'] == first['entries'] > 0
+
+    # Every block of an unchanged document is reused
+    assert preprocess(DOCUMENT, cache=cache) == expected
+    stats = cache.stats()
+    assert stats['misses'] == first['misses']
+    assert stats['hits'] - first['hits'] == first['hits'] + first['misses']
+
+
+@pytest.mark.unit
+def test_edit_only_converts_changed_blocks():
+    cache = BlockCache()
+    preprocess_obsidian_syntax(DOCUMENT, cache=cache)
+    before = cache.stats()
+
+    edited = DOCUMENT.replace('> body', '> edited body').replace('| 3 | 4 |', '| 3 | 5 |')
+    assert preprocess_obsidian_syntax(edited, cache=cache) == preprocess_obsidian_syntax(edited)
+    # The edited callout and the edited table's widths
+    assert cache.stats()['misses'] - before['misses'] == 2
+
+
+@pytest.mark.unit
+def test_emitter_settings_are_part_of_the_key():
+    cache = BlockCache()
+    long_code = '```\n' + ' '.join(['word'] * 40) + '\n```'
+    wide = LatexMarkdownEmitter(cache=cache, max_width=200).emit(parse_document(long_code))
+    narrow = LatexMarkdownEmitter(cache=cache).emit(parse_document(long_code))
+    assert wide == long_code and narrow == LatexMarkdownEmitter().emit(parse_document(long_code))
+
+
+@pytest.mark.unit
+def test_evicted_blocks_spill_to_disk(tmp_path):
+    cache = BlockCache(max_chars=1, spill_dir=tmp_path)
+    expected = preprocess_obsidian_syntax(DOCUMENT)
+
+    preprocess_obsidian_syntax(DOCUMENT, cache=cache)
+    assert preprocess_obsidian_syntax(DOCUMENT, cache=cache) == expected
+    stats = cache.stats()
+    assert stats['evictions'] > 0
+    assert stats['disk_hits'] > 0
+    assert stats['hits'] == 0
+
+
+@pytest.mark.integration
+@pytest.mark.parametrize('path', CORPUS, ids=[os.path.basename(p) for p in CORPUS])
+def test_cached_output_matches_uncached_on_corpus(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        content = f.read()
+
+    cache = BlockCache()
+    for _ in range(2):
+        assert preprocess_obsidian_syntax(content, cache=cache) == preprocess_obsidian_syntax(content)
+        assert preprocess_obsidian_for_html(content, cache=cache) == preprocess_obsidian_for_html(content)
+
+
+@pytest.mark.unit
+def test_disk_cache_evicts_least_recently_used(tmp_path):
+    cache = DiskCache(tmp_path, max_bytes=25)
+    cache.put('aa01', b'x' * 10)
+    cache.put('bb02', b'y' * 10)
+    os.utime(cache.path_for('aa01'), (1, 1))
+    os.utime(cache.path_for('bb02'), (2, 2))
+    assert cache.get('aa01') == b'x' * 10  # refreshes aa01
+
+    cache.put('cc03', b'z' * 10)
+    assert cache.get('bb02') is None
+    assert cache.get('aa01') == b'x' * 10
+    assert cache.get('cc03') == b'z' * 10
+    assert cache.stats()['evictions'] == 1
@@ -0,0 +1,75 @@
+"""Tests for the cached tool availability registry"""
+
+import pytest
+
+from helpers import capabilities, docx_converter, mermaid_renderer
+from helpers.capabilities import CapabilityRegistry, require_tools
+
+
+@pytest.fixture
+def probes():
+    calls = []
+
+    def probe(name, result):
+        def run():
+            calls.append(name)
+            return result
+        return run
+
+    return calls, {
+        'mmdc': probe('mmdc', (False, None, 'not installed')),
+        'pandoc': probe('pandoc', (True, '3.1.9', '')),
+    }
+
+
+@pytest.mark.unit
+def test_probes_run_once_within_ttl(probes, monkeypatch):
+    calls, table = probes
+    registry = CapabilityRegistry(table, ttl=60)
+
+    assert registry.version('pandoc') == '3.1.9' and registry.available('pandoc')
+    assert registry.version('mmdc') is None and not registry.available('mmdc')
+    assert sorted(registry.snapshot()) == ['mmdc', 'pandoc']
+    assert calls == ['pandoc', 'mmdc']
+
+    registry.invalidate('mmdc')
+    registry.available('mmdc')
+    assert calls == ['pandoc', 'mmdc', 'mmdc']
+
+    # Stale results are probed again
+    monkeypatch.setattr(capabilities.time, 'monotonic', lambda: 1e12)
+    registry.available('pandoc')
+    assert calls[-1] == 'pandoc'
+
+
+@pytest.mark.unit
+def test_missing_commands_are_reported():
+    assert capabilities._run_version(['markdown-converter-no-such-tool']) == (False, None, 'not installed')
+
+
+@pytest.mark.unit
+def test_require_tools_names_missing_tools(probes, monkeypatch):
+    monkeypatch.setattr(capabilities, '_registry', CapabilityRegistry(probes[1]))
+
+    require_tools('pandoc')
+    with pytest.raises(RuntimeError, match='mmdc: not installed'):
+        require_tools('pandoc', 'mmdc', purpose='PDF conversion')
+
+
+@pytest.mark.unit
+def test_conversion_skips_mermaid_without_renderer(probes, monkeypatch):
+    monkeypatch.setattr(capabilities, '_registry', CapabilityRegistry(probes[1]))
+    monkeypatch.setattr(mermaid_renderer, 'get_mermaid_daemon', lambda: None)
+
+    def fail(*args, **kwargs):
+        raise AssertionError('no render should be attempted')
+
+    monkeypatch.setattr(mermaid_renderer, 'render_mermaid_batch', fail)
+    monkeypatch.setattr('helpers.mermaid_docx_handler.render_mermaid_batch', fail)
+    monkeypatch.setenv('ARTIFACT_CACHE', '0')
+
+    report = {}
+    buffer = docx_converter.convert_to_docx('```mermaid\ngraph TD\n```\n', report=report)
+    assert buffer.read(2) == b'PK'
+    assert 'render_mermaid' not in report['stages']
+    assert probes[0] == ['mmdc']
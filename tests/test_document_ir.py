@@ -0,0 +1,316 @@
+"""Tests for the backend-neutral document IR and its emitters"""
+
+import glob
+import io
+import itertools
+import os
+
+import pytest
+
+from helpers import docx_converter, obsidian_to_html, pandoc_server, pdf_converter, table_width_optimizer
+from helpers.document_ir import (
+    Callout,
+    Checkbox,
+    CodeBlock,
+    FRONTMATTER_MAX_LINES,
+    Document,
+    Frontmatter,
+    Highlight,
+    LineBreak,
+    MarkdownEmitter,
+    Mermaid,
+    PageBreak,
+    Table,
+    Text,
+    Underline,
+    iter_blocks,
+    parse_document,
+    parse_inline,
+    prescan_mermaid_codes,
+)
+from helpers.obsidian_preprocessor import (
+    LatexMarkdownEmitter,
+    convert_callouts,
+    convert_extended_checkboxes,
+    convert_highlighting,
+    convert_obsidian_images,
+    convert_page_break_markers,
+    convert_underline,
+    convert_wikilinks,
+    fix_consecutive_bold_lines,
+    fix_list_blank_lines,
+    iter_preprocess_obsidian_syntax,
+    optimize_table_widths,
+    preprocess_obsidian_syntax,
+    wrap_code_block_lines,
+)
+from helpers.obsidian_to_html import (
+    HtmlMarkdownEmitter,
+    iter_preprocess_obsidian_for_html,
+    preprocess_obsidian_for_html,
+)
+from helpers.page_break_handler import convert_page_breaks_to_placeholder
+
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CORPUS = sorted(glob.glob(os.path.join(REPO_ROOT, '**', '*.md'), recursive=True))
+
+DOCUMENT = '\n'.join([
+    '# Title',
+    'Some ==highlighted <u>and underlined</u>== text and [[Page|a link]].',
+    '**First:** one',
+    '**Second:** two',
+    'Intro',
+    '- item',
+    '- [!] important task',
+    '',
+    '> [!warning] Careful',
+    '> Body with ==mark==',
+    '> - [?] question',
+    '',
+    '| a | b |',
+    '|---|---|',
+    '| 1 | 2 |',
+    '',
+    '<!-- pagebreak -->',
+    '- after break',
+    '',
+    '![[image.png]]',
+])
+
+
+EDGE_CASES = [
+    '',
+    '\n',
+    '---\ntitle: x\n---\n<!-- pagebreak -->\n---\n',
+    '```\n<!-- pagebreak -->\n~~~\n\\newpage\n```\n\\newpage',
+    '**a** b\n**c** d\n**e**\n- item\ntext\n1. one\n* two',
+    '> [!warning] Careful\n> - [!] flagged\n> body\n> [!tip]\n> more\nafter',
+    '> [!note]\n>\n> ==hl== and <u>u</u>',
+    '- [?] question\n  - [x] done\n- [R] research [[Link|alias]]',
+    '- [[[x|y]]] tricky\n![[img.png|300]] and [[Note#Section]]',
+    '| a | b |\n|---|---|\n| **x** | `y_z` |\ntext\n| lone |',
+    '```python\n' + 'word ' * 60 + '\n    ' + 'x' * 150 + '\n```',
+    '```\n' + 'a ```b ' * 30 + '\n```\n<!-- newpage -->',
+    '**bold** start\n\n**bold** again\n> [!info] t\n**in** callout\n> **x** y',
+]
+
+
+def staged_preprocess(content):
+    """Reference: run every LaTeX stage one after another"""
+    for stage in (optimize_table_widths, wrap_code_block_lines, convert_page_break_markers,
+                  fix_consecutive_bold_lines, fix_list_blank_lines, convert_callouts,
+                  convert_obsidian_images, convert_wikilinks, convert_extended_checkboxes,
+                  convert_highlighting, convert_underline):
+        content = stage(content)
+    return content
+
+
+def staged_preprocess_html(content):
+    """Reference: run every HTML stage one after another"""
+    for stage in (optimize_table_widths, obsidian_to_html.fix_consecutive_bold_lines,
+                  obsidian_to_html.fix_list_blank_lines, obsidian_to_html.convert_callouts_html,
+                  obsidian_to_html.convert_obsidian_images_html, obsidian_to_html.convert_wikilinks_html,
+                  obsidian_to_html.convert_extended_checkboxes_html,
+                  obsidian_to_html.convert_highlighting_html, obsidian_to_html.convert_underline_html):
+        content = stage(content)
+    return content
+
+
+def _strip_code_and_frontmatter(content):
+    """Drop fenced blocks and frontmatter, where the IR keeps text verbatim"""
+    lines = content.split('\n')
+    if lines and lines[0].strip() == '---':
+        end = next((i for i in range(1, len(lines)) if lines[i].strip() == '---'), len(lines) - 1)
+        lines = lines[end + 1:]
+
+    kept = []
+    fence = None
+    for line in lines:
+        stripped = line.strip()
+        if fence is None and stripped.startswith(('```', '~~~')):
+            fence = stripped[:3]
+        elif fence is not None and stripped.startswith(fence):
+            fence = None
+        elif fence is None:
+            kept.append(line)
+    return '\n'.join(kept)
+
+
+@pytest.mark.unit
+def test_nodes_are_slotted():
+    for node in (Text(['x']), Checkbox('', 'x', ['t']), LineBreak(), PageBreak('\\newpage')):
+        assert not hasattr(node, '__dict__')
+
+
+@pytest.mark.unit
+def test_parse_blocks():
+    blocks = parse_document(DOCUMENT).blocks
+    kinds = [type(block) for block in blocks]
+    assert LineBreak in kinds
+    assert Table in kinds
+    assert Checkbox('', '!', ['important task']) in blocks
+    assert PageBreak('<!-- pagebreak -->', list_follows=True) in blocks
+    callout = next(block for block in blocks if isinstance(block, Callout))
+    assert callout.kind == 'warning'
+    assert callout.title == ['Careful']
+
+
+@pytest.mark.unit
+def test_inline_spans_nest():
+    assert parse_inline('a ==b <u>c</u>== d') == [
+        'a ', Highlight(['b ', Underline(['c'])]), ' d']
+    assert parse_inline('<u>x ==y==</u>') == [Underline(['x ', Highlight(['y'])])]
+    assert parse_inline('plain') == ['plain']
+
+
+@pytest.mark.unit
+def test_frontmatter_and_code_blocks_are_verbatim():
+    content = '---\ntags:\n  - a\n---\n```\n==x== [[y]]\n- [!] z\n```\n```mermaid\ngraph TD\n```'
+    blocks = parse_document(content).blocks
+    assert blocks[0] == Frontmatter(['---', 'tags:', '  - a', '---'])
+    assert blocks[1] == CodeBlock(['```', '==x== [[y]]', '- [!] z', '```'])
+    assert blocks[2] == Mermaid('graph TD', ['```mermaid', 'graph TD', '```'])
+    assert HtmlMarkdownEmitter().emit(parse_document(content)) == content
+
+
+@pytest.mark.unit
+def test_unclosed_frontmatter_is_parsed_as_content():
+    content = '---\n# T\n\n> [!note] Hi\n> body\n\n- [!] task\n==hl=='
+    blocks = parse_document(content).blocks
+    assert not any(isinstance(block, Frontmatter) for block in blocks)
+    assert Callout('note', ['Hi'], ['body']) in blocks
+
+    output = preprocess_obsidian_syntax(content)
+    assert '\\begin{calloutNote}{Hi}' in output
+    assert output.endswith('- [x] ⚠️ task\n\\hl{hl}')
+    assert preprocess_obsidian_for_html(content).endswith('<mark>hl</mark>')
+
+    # A closing --- beyond the lookahead does not make frontmatter either
+    far = '---\n' + 'key: value\n' * FRONTMATTER_MAX_LINES + '---\n==hl=='
+    assert '\\hl{hl}' in preprocess_obsidian_syntax(far)
+
+
+@pytest.mark.unit
+def test_latex_emitter_wraps_long_code_lines():
+    long_line = ' '.join(['word'] * 40)
+    output = LatexMarkdownEmitter().emit(parse_document(f'```\n{long_line}\n```'))
+    assert all(len(line) <= 100 for line in output.split('\n'))
+
+
+@pytest.mark.unit
+def test_table_rows_stream_through_the_emitter(monkeypatch):
+    converted = []
+    process_cell_content = table_width_optimizer.process_cell_content
+    monkeypatch.setattr(table_width_optimizer, 'process_cell_content',
+                        lambda text: converted.append(text) or process_cell_content(text))
+    rows = '\n'.join(f'| ==r{number}== | x |' for number in range(2500))
+    table = parse_document('| a | b |\n|---|---|\n' + rows).blocks[0]
+
+    lines = LatexMarkdownEmitter().emit_table(table)
+    assert list(itertools.islice(lines, 8))[-2:] == ['\\endhead', '\\hl{r0} & x \\\\']
+    assert converted == ['a', 'b', '==r0==', 'x']
+
+    # Inline markup is applied per row, and large tables are chunked
+    output = list(lines)
+    assert output.count('\\begin{longtable}[]{@{}p{0.729\\textwidth}|p{0.221\\textwidth}@{}}') == 2
+    assert '\\hl{r2499} & x \\\\' in output
+
+
+@pytest.mark.unit
+def test_mermaid_callback_replaces_diagrams():
+    content = '```mermaid\nA\n```\ntext\n```mermaid\nB\n```'
+    seen = []
+
+    def render(code, diagram_id):
+        seen.append((code, diagram_id))
+        return None if code == 'B' else f'[diagram {diagram_id}]'
+
+    output = LatexMarkdownEmitter(mermaid=render).emit(parse_document(content))
+    assert seen == [('A', 0), ('B', 1)]
+    assert output == '[diagram 0]\ntext\n```mermaid\nB\n```'
+
+
+@pytest.mark.unit
+def test_prescan_collects_diagrams_and_rewinds():
+    content = 'intro\n```mermaid\nA\n```\n~~~\n```mermaid\nin code\n```\n~~~\n```mermaid\nB\n```\n'
+    stream = io.StringIO(content)
+    stream.readline()
+
+    assert prescan_mermaid_codes(stream) == ['A', 'B']
+    assert stream.read() == content[len('intro\n'):]
+    assert prescan_mermaid_codes(line for line in io.StringIO(content)) is None
+
+
+@pytest.mark.unit
+def test_streamed_blocks_match_parsed_document():
+    emitter = HtmlMarkdownEmitter()
+    streamed = '\n'.join(emitter.iter_lines(iter_blocks(DOCUMENT.split('\n'))))
+    assert streamed == HtmlMarkdownEmitter().emit(parse_document(DOCUMENT))
+
+
+@pytest.mark.unit
+def test_emitters_must_handle_every_obsidian_node():
+    class LineBreakOnlyEmitter(MarkdownEmitter):
+        def emit_line_break(self, node):
+            return ['']
+
+    with pytest.raises(TypeError, match='emit_callout'):
+        LineBreakOnlyEmitter()
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize('content', EDGE_CASES)
+def test_preprocessing_matches_staged_pipeline(content):
+    assert preprocess_obsidian_syntax(content) == staged_preprocess(content)
+    assert preprocess_obsidian_for_html(content) == staged_preprocess_html(content)
+
+    # Streamed from a file, with every stage running
+    assert '\n'.join(iter_preprocess_obsidian_syntax(io.StringIO(content))) == staged_preprocess(content)
+    assert '\n'.join(iter_preprocess_obsidian_for_html(io.StringIO(content))) == staged_preprocess_html(content)
+
+
+@pytest.mark.integration
+@pytest.mark.parametrize('path', CORPUS, ids=[os.path.basename(p) for p in CORPUS])
+def test_emitters_match_staged_pipeline(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        content = _strip_code_and_frontmatter(f.read())
+    document = parse_document(content)
+
+    assert LatexMarkdownEmitter().emit(document) == staged_preprocess(content)
+    expected_html = convert_page_breaks_to_placeholder(staged_preprocess_html(content))
+    assert HtmlMarkdownEmitter(page_break='|||PAGEBREAK|||').emit(document) == expected_html
+
+
+@pytest.mark.integration
+def test_one_document_converts_to_pdf_and_docx(monkeypatch):
+    captured = []
+
+    def fake_convert_file(source_file, to, outputfile=None, extra_args=None):
+        with open(source_file, 'r', encoding='utf-8') as f:
+            captured.append(f.read())
+        return '\\documentclass{article}\n\\begin{document}\n\\end{document}\n'
+
+    def fake_compile_latex(latex, output_path, **kwargs):
+        with open(output_path, 'wb') as f:
+            f.write(b'%PDF-fake')
+
+    monkeypatch.setattr(pandoc_server.pypandoc, 'convert_file', fake_convert_file)
+    monkeypatch.setattr(pdf_converter, 'require_tools', lambda *names, **kwargs: None)
+    monkeypatch.setattr(pdf_converter, 'compile_latex', fake_compile_latex)
+    monkeypatch.setenv('ARTIFACT_CACHE', '0')
+    document = parse_document(DOCUMENT)
+
+    pdf_converter.convert_to_pdf(document, render_mermaid=False, use_header_footer=False)
+    pdf_converter.convert_to_pdf(DOCUMENT, render_mermaid=False, use_header_footer=False)
+    assert captured[0] == captured[1]
+    assert '\\hl{' in captured[0]
+
+    buffer = docx_converter.convert_to_docx(document, render_mermaid=False)
+    assert buffer.read(2) == b'PK'
+
+
+@pytest.mark.unit
+def test_document_keeps_obsidian_setting():
+    document = parse_document('==x==', obsidian=False)
+    assert document == Document([Text(['==x=='])], obsidian=False, features=frozenset({'highlights'}))
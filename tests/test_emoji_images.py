@@ -0,0 +1,101 @@
+"""Tests for replacing emoji with cached images in PDFs"""
+
+import pytest
+from PIL import Image
+
+from helpers import emoji_images, pandoc_server, pdf_converter
+from helpers.disk_cache import DiskCache
+from helpers.emoji_images import EMOJI_IMAGE_SIZE, EMOJI_PATTERN, EmojiImages, find_emoji_image
+from helpers.obsidian_preprocessor import preprocess_obsidian_syntax
+
+
+@pytest.fixture
+def image_set(tmp_path):
+    """A Twemoji-style image set with a few emoji"""
+    directory = tmp_path / 'twemoji'
+    directory.mkdir()
+    for name in ('2705', '26a0', '1f4a1', '1f44d-1f3fb'):
+        Image.new('RGBA', (144, 144), (255, 200, 0, 255)).save(directory / f'{name}.png')
+    return directory
+
+
+@pytest.fixture
+def images(image_set, tmp_path):
+    return EmojiImages(DiskCache(tmp_path / 'emoji', suffix='.png'), str(image_set))
+
+
+@pytest.mark.unit
+def test_emoji_sequences_are_matched_whole():
+    text = 'ok ✅ warn ⚠️ thumbs 👍🏻 family 👨‍👩‍👧 flag 🇫🇷 key 1️⃣ arrow → © 2024'
+    assert EMOJI_PATTERN.findall(text) == ['✅', '⚠️', '👍🏻', '👨‍👩‍👧', '🇫🇷', '1️⃣']
+
+
+@pytest.mark.unit
+def test_image_set_names(image_set):
+    assert find_emoji_image('⚠️', str(image_set)).endswith('26a0.png')
+    assert find_emoji_image('👍🏻', str(image_set)).endswith('1f44d-1f3fb.png')
+    assert find_emoji_image('🎉', str(image_set)) is None
+
+
+@pytest.mark.unit
+def test_lines_get_image_includes(images):
+    # Checkbox and callout conversion inject emoji
+    markdown = preprocess_obsidian_syntax(
+        '- [!] check `✅` 🎉\n\n> [!tip] Idea\n> 💡 body\n\n```\nprint("✅")\n```')
+    stats = {}
+    lines = list(images.iter_lines(markdown.split('\n'), stats))
+    output = '\n'.join(lines)
+
+    warning = images.path('⚠️')
+    assert f'`\\texorpdfstring{{\\raisebox{{-0.15em}}{{\\includegraphics[height=1em]{{{warning}}}}}}}{{}}`{{=latex}}' in output
+    # Raw LaTeX blocks (callouts) take the LaTeX as is
+    assert f'\\texorpdfstring{{\\raisebox{{-0.15em}}{{\\includegraphics[height=1em]{{{images.path("💡")}}}}}}}{{}} body' in lines
+    # Code keeps its emoji, and emoji without an image stay text
+    assert '`✅`' in output and 'print("✅")' in output and '🎉' in output
+    assert stats == {'replaced': 2, 'kept': 1}
+
+    with Image.open(warning) as image:
+        assert image.height == EMOJI_IMAGE_SIZE
+
+
+@pytest.mark.unit
+def test_images_are_made_once(images, image_set, tmp_path, monkeypatch):
+    first = images.path('✅')
+    # Another process sharing the cache finds the image without making it
+    other = EmojiImages(DiskCache(tmp_path / 'emoji', suffix='.png'), str(image_set))
+    monkeypatch.setattr(other, '_make', None)
+    assert other.path('✅') == first
+
+
+@pytest.mark.integration
+def test_pdf_with_emoji_images_needs_no_emoji_font(image_set, tmp_path, monkeypatch):
+    headers = []
+
+    def fake_convert_file(source_file, to, outputfile=None, extra_args=None):
+        header_path = next(arg for arg in extra_args if arg.startswith('--include-in-header='))
+        with open(header_path.split('=', 1)[1], encoding='utf-8') as f:
+            headers.append(f.read())
+        return '\\documentclass{article}\n\\begin{document}\n\\end{document}\n'
+
+    def fake_compile_latex(latex, output_path, **kwargs):
+        with open(output_path, 'wb') as f:
+            f.write(b'%PDF-fake')
+        return []
+
+    monkeypatch.setattr(pandoc_server.pypandoc, 'convert_file', fake_convert_file)
+    monkeypatch.setattr(pdf_converter, 'require_tools', lambda *names, **kwargs: None)
+    monkeypatch.setattr(pdf_converter, 'compile_latex', fake_compile_latex)
+    monkeypatch.setattr(pdf_converter, 'warm_font_cache', lambda: True)
+    monkeypatch.setattr(emoji_images, '_emoji_images', None)
+    monkeypatch.setenv('ARTIFACT_CACHE', '0')
+    monkeypatch.setenv('LATEX_ENGINE', 'lualatex')
+    monkeypatch.setenv(emoji_images.EMOJI_IMAGES_ENV, '1')
+    monkeypatch.setenv(emoji_images.EMOJI_IMAGE_DIR_ENV, str(image_set))
+    monkeypatch.setenv(emoji_images.EMOJI_CACHE_DIR_ENV, str(tmp_path / 'emoji'))
+
+    report = {}
+    pdf_converter.convert_to_pdf('# Tasks\n\n- [!] urgent\n- done ✅', render_mermaid=False,
+                                 use_header_footer=False, report=report)
+    assert report['emoji_images'] == {'replaced': 2, 'kept': 0}
+    assert 'emoji' not in report['preamble_features']
+    assert 'emojifallback' not in headers[0] and '\\usepackage{graphicx}' in headers[0]
@@ -0,0 +1,138 @@
+"""Tests for feature sniffing and stage skipping"""
+
+import pytest
+
+from helpers import pandoc_server, pdf_converter
+from helpers.document_ir import IR_STAGES, parse_document
+from helpers.feature_sniffer import ALL_FEATURES, select_stages, sniff_features
+from helpers.obsidian_preprocessor import detect_header_features, get_enhanced_latex_header, preprocess_obsidian_syntax
+from helpers.obsidian_to_html import preprocess_obsidian_for_html
+
+
+@pytest.mark.unit
+def test_plain_document_has_no_features():
+    assert sniff_features('# Title\n\nJust text.\n- a list') == frozenset()
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize('content, feature', [
+    ('> [!note] x', 'callouts'),
+    ('a ==b== c', 'highlights'),
+    ('see [[Page]]', 'wikilinks'),
+    ('- [x] done', 'checkboxes'),
+    ('<u>u</u>', 'underline'),
+    ('**a** b', 'bold_lines'),
+    ('~~~\ncode\n~~~', 'code_blocks'),
+    ('```mermaid\ngraph TD\n```', 'mermaid'),
+    ('text\n\\newpage', 'page_breaks'),
+    ('text\n  | a | b |', 'tables'),
+])
+def test_sniff_detects_triggers(content, feature):
+    assert feature in sniff_features(content)
+
+
+@pytest.mark.unit
+def test_pipe_inside_a_line_is_not_a_table():
+    assert 'tables' not in sniff_features('a | b')
+
+
+@pytest.mark.unit
+def test_select_stages():
+    assert select_stages(IR_STAGES, None) == [name for name, _ in IR_STAGES]
+    assert select_stages(IR_STAGES, frozenset()) == ['fix_list_blank_lines']
+    assert select_stages(IR_STAGES, ALL_FEATURES) == [name for name, _ in IR_STAGES]
+
+
+@pytest.mark.unit
+def test_preprocess_reports_stages_that_ran():
+    report = {}
+    output = preprocess_obsidian_syntax('Some ==highlight==\n- item', report=report)
+    assert output == 'Some \\hl{highlight}\n\n- item'
+    assert report == {
+        'features': ['highlights'],
+        'stages': ['parse_inline', 'fix_list_blank_lines'],
+    }
+
+    report = {}
+    preprocess_obsidian_for_html('> [!tip] t\n> body', report=report)
+    assert report['stages'] == ['parse_callouts', 'fix_list_blank_lines']
+
+
+@pytest.mark.unit
+def test_wikilinks_keep_later_stages():
+    # Removing the links joins "=" and "=" into a highlight
+    report = {}
+    assert preprocess_obsidian_syntax('=[[a]]=x=[[b]]=', report=report) == '\\hl{x}'
+    assert 'parse_inline' in report['stages']
+
+
+@pytest.mark.unit
+def test_parsed_document_records_features():
+    document = parse_document('```mermaid\ngraph TD\n```')
+    assert document.features == frozenset({'code_blocks', 'mermaid'})
+
+
+@pytest.mark.unit
+def test_header_features_of_preprocessed_document():
+    latex_markdown = preprocess_obsidian_syntax('> [!tip] Hint\n> body\n\n- item ==hl==\n\n| a | b |\n|---|---|')
+    features = detect_header_features(latex_markdown.splitlines())
+    assert features == frozenset({'callouts', 'calloutTip', 'highlights', 'lists', 'tables'})
+    assert detect_header_features(['Plain text.']) == frozenset()
+    assert detect_header_features(['Done ✅', '```python']) == frozenset({'emoji', 'code_blocks'})
+
+
+@pytest.mark.unit
+def test_minimal_header_only_loads_used_parts():
+    plain = get_enhanced_latex_header(use_lualatex=True, features=frozenset())
+    for unused in ('tcolorbox', 'fontawesome5', 'enumitem', 'ulem', 'emojifallback', 'longtable',
+                   'codebg', 'quotebg', 'float', '\\hl'):
+        assert unused not in plain
+    assert '\\setmainfont{Helvetica Neue}\n' in plain
+
+    callouts = get_enhanced_latex_header(use_lualatex=True, features=frozenset({'callouts', 'calloutTip'}))
+    assert '\\newtcolorbox{calloutTip}' in callouts
+    assert callouts.count('\\newtcolorbox') == 1
+
+    # Every part of the full header is still reachable from some feature
+    full = get_enhanced_latex_header(use_lualatex=True)
+    everything = frozenset(['callouts', 'icons', 'highlights', 'emphasis', 'code_blocks', 'tables',
+                            'tabularx', 'quotes', 'lists', 'figures', 'emoji', 'calloutNote', 'calloutInfo',
+                            'calloutTodo', 'calloutTip', 'calloutSuccess', 'calloutQuestion',
+                            'calloutWarning', 'calloutDanger', 'calloutError', 'calloutBug', 'calloutExample'])
+    assert get_enhanced_latex_header(use_lualatex=True, features=everything) == full
+    assert get_enhanced_latex_header(features=everything) == get_enhanced_latex_header()
+
+
+@pytest.mark.integration
+def test_pdf_conversion_reports_stages(monkeypatch):
+    def fake_convert_file(source_file, to, outputfile=None, extra_args=None):
+        return '\\documentclass{article}\n\\begin{document}\n\\end{document}\n'
+
+    def fake_compile_latex(latex, output_path, **kwargs):
+        with open(output_path, 'wb') as f:
+            f.write(b'%PDF-fake')
+        return [{'draft': False, 'seconds': 0.5, 'aux_changed': True, 'rerun_requested': False}]
+
+    monkeypatch.setattr(pandoc_server.pypandoc, 'convert_file', fake_convert_file)
+    monkeypatch.setattr(pdf_converter, 'require_tools', lambda *names, **kwargs: None)
+    monkeypatch.setattr(pdf_converter, 'compile_latex', fake_compile_latex)
+    monkeypatch.setenv('ARTIFACT_CACHE', '0')
+    monkeypatch.setenv('LATEX_ENGINE', 'lualatex')
+
+    report = {}
+    pdf_converter.convert_to_pdf('# Title\n**a** b', use_header_footer=False, report=report)
+    assert report == {
+        'features': ['bold_lines'],
+        'stages': ['fix_consecutive_bold_lines', 'fix_list_blank_lines'],
+        'latex_passes': [{'draft': False, 'seconds': 0.5, 'aux_changed': True, 'rerun_requested': False}],
+        'preamble_features': ['emphasis'],
+        'latex_engine': 'lualatex',
+        'latex_engine_reason': 'LATEX_ENGINE=lualatex',
+        'artifact_cache': 'bypass',
+    }
+
+    report = {}
+    pdf_converter.convert_to_pdf(iter(['# Title']), render_mermaid=False,
+                                 use_header_footer=False, report=report)
+    assert report['features'] is None
+    assert 'render_mermaid' not in report['stages']
@@ -0,0 +1,88 @@
+"""Tests for font resolution and the shared luaotfload cache"""
+
+import subprocess
+
+import pytest
+
+from helpers import font_resolver
+from helpers.font_resolver import latex_environment, parse_font_list, resolve_fonts, warm_font_cache
+from helpers.obsidian_preprocessor import get_enhanced_latex_header
+
+
+# fc-list output of a Linux worker without the Apple fonts
+LINUX_FONTS = [
+    'TeX Gyre Heros\tRegular\t/usr/share/fonts/gyre/texgyreheros-regular.otf\t0',
+    'TeX Gyre Heros\tBold\t/usr/share/fonts/gyre/texgyreheros-bold.otf\t0',
+    'TeX Gyre Heros\tItalic,Oblique\t/usr/share/fonts/gyre/texgyreheros-italic.otf\t0',
+    'TeX Gyre Heros\tBold Italic\t/usr/share/fonts/gyre/texgyreheros-bolditalic.otf\t0',
+    'Noto Color Emoji\tRegular\t/usr/share/fonts/noto/NotoColorEmoji.ttf\t0',
+    'DejaVu Sans\tBook\t/usr/share/fonts/dejavu/DejaVuSans.ttf\t0',
+    'broken line',
+]
+
+
+@pytest.mark.unit
+def test_roles_resolve_to_installed_files():
+    font_map = resolve_fonts(parse_font_list(LINUX_FONTS))
+    assert font_map.problems() == [
+        'Helvetica Neue is missing, using TeX Gyre Heros',
+        'Apple Color Emoji is missing, using Noto Color Emoji',
+    ]
+
+    latex = font_map.latex()
+    assert '"[/usr/share/fonts/noto/NotoColorEmoji.ttf]:mode=harf"' in latex
+    assert ('\\setmainfont{texgyreheros-regular.otf}[Path=/usr/share/fonts/gyre/, '
+            'BoldFont=texgyreheros-bold.otf, ItalicFont=texgyreheros-italic.otf, '
+            'BoldItalicFont=texgyreheros-bolditalic.otf, RawFeature={fallback=emojifallback}]') in latex
+    # Latin Modern Mono ships with TeX and is found without a system font scan
+    assert '\\setmonofont{Latin Modern Mono}[Scale=0.9]' in latex
+
+    header = get_enhanced_latex_header(use_lualatex=True, features=frozenset(), fonts=font_map)
+    assert 'Helvetica Neue' not in header and 'emojifallback' not in header
+    assert '\\setmainfont{texgyreheros-regular.otf}[Path=/usr/share/fonts/gyre/, BoldFont=' in header
+
+
+@pytest.mark.unit
+def test_collections_and_missing_fonts():
+    font_map = resolve_fonts(parse_font_list([
+        'Helvetica Neue,Helvetica Neue Light\tRegular\t/System/Library/Fonts/HelveticaNeue.ttc\t0',
+        'Helvetica Neue\tBold\t/System/Library/Fonts/HelveticaNeue.ttc\t1',
+        'Apple Color Emoji\tRegular\t/System/Library/Fonts/Apple Color Emoji.ttc\t2',
+    ]))
+    assert font_map.problems() == []
+    latex = font_map.latex()
+    # Faces of a collection other than the regular one cannot be named by file
+    assert '\\setmainfont{HelveticaNeue.ttc}[Path=/System/Library/Fonts/, RawFeature=' in latex
+    assert '"[/System/Library/Fonts/Apple Color Emoji.ttc](2):mode=harf"' in latex
+
+    nothing = resolve_fonts({})
+    assert nothing.problems() == ['Helvetica Neue is missing', 'Apple Color Emoji is missing']
+    assert 'setmainfont' not in nothing.latex() and 'directlua' not in nothing.latex()
+
+
+@pytest.mark.unit
+def test_latex_runs_share_the_font_cache(monkeypatch, tmp_path):
+    monkeypatch.delenv('TEXMFCACHE', raising=False)
+    monkeypatch.setenv(font_resolver.FONT_CACHE_DIR_ENV, str(tmp_path / 'fonts'))
+    assert latex_environment()['TEXMFCACHE'] == str(tmp_path / 'fonts')
+
+    monkeypatch.setenv('TEXMFCACHE', '/srv/texmf-cache')
+    assert latex_environment()['TEXMFCACHE'] == '/srv/texmf-cache'
+
+
+@pytest.mark.unit
+def test_font_cache_is_updated_once(monkeypatch, tmp_path):
+    runs = []
+
+    def fake_run(args, env=None, **kwargs):
+        runs.append((args, env['TEXMFCACHE']))
+        return subprocess.CompletedProcess(args, 0, '', '')
+
+    monkeypatch.setattr(font_resolver.subprocess, 'run', fake_run)
+    monkeypatch.setattr(font_resolver, '_font_cache_state', None)
+    monkeypatch.delenv('TEXMFCACHE', raising=False)
+    monkeypatch.setenv(font_resolver.FONT_CACHE_DIR_ENV, str(tmp_path / 'fonts'))
+
+    assert warm_font_cache() and warm_font_cache()
+    assert runs == [(['luaotfload-tool', '--update'], str(tmp_path / 'fonts'))]
+    assert (tmp_path / 'fonts').is_dir()
@@ -0,0 +1,101 @@
+"""Tests for the linear-time inline scanner"""
+
+import random
+import re
+import time
+
+import pytest
+
+from helpers.inline_scanner import (
+    HIGHLIGHT,
+    UNDERLINE,
+    convert_inline,
+    find_spans,
+    replace_links,
+    resolve_links,
+)
+from helpers.obsidian_preprocessor import preprocess_obsidian_syntax
+from helpers.obsidian_to_html import preprocess_obsidian_for_html
+
+
+# The regexes the scanner replaces, used as the reference
+IMAGE_EMBED_PATTERN = re.compile(r'!\[\[([^\]|]+?)(?:\|([^\]]+))?\]\]')
+SECTION_EMBED_PATTERN = re.compile(r'!\[\[([^\]]+?)#([^\]]+?)\]\]')
+WIKILINK_PATTERN = re.compile(r'\[\[([^\]|]+?)(?:\|([^\]]+))?\]\]')
+HIGHLIGHT_PATTERN = re.compile(r'==([^=]+)==')
+UNDERLINE_PATTERN = re.compile(r'<u>([^<]+)</u>')
+
+
+def _random_strings(alphabet, count, seed):
+    rng = random.Random(seed)
+    for _ in range(count):
+        yield ''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 24)))
+
+
+@pytest.mark.unit
+def test_link_scanners_match_regexes():
+    for text in _random_strings(['[', ']', '|', '#', '!', 'a', ' ', '\n', '[[', ']]'], 20000, 1):
+        assert (replace_links(text, sections=False, wikilinks=False)
+                == IMAGE_EMBED_PATTERN.sub(lambda m: f'![]({m.group(1)})', text))
+        assert (replace_links(text, images=False, wikilinks=False)
+                == SECTION_EMBED_PATTERN.sub('', text))
+        assert (replace_links(text, images=False, sections=False)
+                == WIKILINK_PATTERN.sub(r'\2', text))
+
+
+@pytest.mark.unit
+def test_span_scanner_matches_regexes():
+    for text in _random_strings(['=', '==', '<', '<u>', '</u>', 'a', ' ', '\n'], 20000, 2):
+        spans = find_spans(text)
+        assert ([span[:4] for span in spans if span[4] == HIGHLIGHT]
+                == [m.span() + m.span(1) for m in HIGHLIGHT_PATTERN.finditer(text)])
+        assert ([span[:4] for span in spans if span[4] == UNDERLINE]
+                == [m.span() + m.span(1) for m in UNDERLINE_PATTERN.finditer(text)])
+
+
+@pytest.mark.unit
+def test_resolve_links():
+    text = '![[img.png|300]] see [[Note|the note]], [[Plain]] ![[Note#Part]] end'
+    assert resolve_links(text) == '![](img.png) see the note,  ![](Note#Part) end'
+    # Section embeds are only removed when they are not images
+    assert resolve_links('a ![[|x#y]] b') == 'a  b'
+
+
+@pytest.mark.unit
+def test_convert_inline_renders_crossing_spans_like_sequential_passes():
+    markup = (('\\hl{', '}'), ('\\underline{', '}'))
+    text = '==a <u>b== c</u> and <u>==d==</u>'
+    expected = re.sub(r'<u>([^<]+)</u>', r'\\underline{\1}',
+                      re.sub(r'==([^=]+)==', r'\\hl{\1}', text))
+    assert convert_inline(text, *markup) == expected
+    assert convert_inline(text, None, markup[1]) == re.sub(r'<u>([^<]+)</u>', r'\\underline{\1}', text)
+
+
+ADVERSARIAL_UNITS = {
+    'unclosed_wikilinks': '[[',
+    'unclosed_embeds': '![[a',
+    'section_embeds': '![[a#',
+    'stray_equals': '==a=',
+    'stray_tags': '<u>a<',
+    'mixed': '*_=[[|#]!<u ==_*',
+}
+
+
+def _preprocess_time(unit, length):
+    # A single closing "]]" at the very end is the worst case for lazy patterns
+    text = (unit * (length // len(unit) + 1))[:length] + ']]'
+    started = time.perf_counter()
+    preprocess_obsidian_syntax(text)
+    preprocess_obsidian_for_html(text)
+    return time.perf_counter() - started
+
+
+@pytest.mark.slow
+@pytest.mark.parametrize('name', sorted(ADVERSARIAL_UNITS))
+def test_adversarial_lines_scale_linearly(name):
+    """One-line paragraphs of stray delimiters: 8x the input must not cost
+    much more than 8x the time (the former regexes were quadratic or worse)"""
+    unit = ADVERSARIAL_UNITS[name]
+    small = min(_preprocess_time(unit, 25_000) for _ in range(3))
+    large = min(_preprocess_time(unit, 200_000) for _ in range(3))
+    assert large < max(small, 0.01) * 8 * 3
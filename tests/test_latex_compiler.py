@@ -0,0 +1,195 @@
+"""Tests for LuaLaTeX compiles from a precompiled preamble format"""
+
+import os
+import subprocess
+from pathlib import Path
+
+import pytest
+
+from helpers import latex_compiler
+from helpers.disk_cache import DiskCache
+from helpers.latex_compiler import compile_latex, format_document, split_format_preamble
+
+
+PANDOC_TEX = r'''\PassOptionsToPackage{dvipsnames,svgnames,x11names}{xcolor}
+\documentclass[
+]{article}
+\usepackage{amsmath,amssymb}
+\usepackage{iftex}
+\ifPDFTeX
+  \usepackage[T1]{fontenc}
+  \usepackage{textcomp} % provide euro and other symbols
+\else % if luatex or xetex
+  \usepackage{unicode-math} % this also loads fontspec
+\fi
+\usepackage{longtable,booktabs,array}
+\usepackage{fontspec}      % For font configuration
+\usepackage{tcolorbox}     % For callout boxes
+\usepackage{fontawesome5}  % For icons (if available)
+\IfFileExists{bookmark.sty}{\usepackage{bookmark}}{\usepackage{hyperref}}
+\setmainfont{Helvetica Neue}
+\begin{document}
+Body
+\end{document}
+'''
+
+
+@pytest.mark.unit
+def test_only_format_safe_top_level_packages_are_dumped():
+    dumped, rest = split_format_preamble(PANDOC_TEX)
+
+    # Options passed before the class, and the class statement spanning two lines
+    assert dumped.split('\n')[:3] == [PANDOC_TEX.split('\n')[0], r'\documentclass[', ']{article}']
+    assert r'\usepackage{amsmath,amssymb}' in dumped
+    assert r'\usepackage{longtable,booktabs,array}' in dumped
+    assert r'\usepackage{tcolorbox}     % For callout boxes' in dumped
+    for unsafe in ('unicode-math', 'fontspec', 'fontawesome5', 'fontenc', 'bookmark', 'setmainfont'):
+        assert unsafe not in dumped
+
+    assert r'\documentclass' not in rest and rest.endswith('\\begin{document}\nBody\n\\end{document}\n')
+    assert format_document(dumped, rest).startswith(dumped + '\\endofdump\n')
+    assert split_format_preamble('no document') is None
+    assert split_format_preamble('\\documentclass{article}\n\\begin{document}\n') is None
+
+
+@pytest.fixture
+def fake_lualatex(monkeypatch, tmp_path):
+    """Fake lualatex: -ini writes <jobname>.fmt, a compile writes document.pdf
+
+    The .aux holds the labels of the document plus, for 'UNSTABLE', the pass
+    number (it never settles). Like LaTeX, a pass asks for a rerun when the
+    .aux it wrote differs from the one it read; 'NAG' asks every time. A
+    document containing 'BROKEN' fails, and so does any compile with a
+    format when formats are 'bad'. Draft passes write no PDF.
+    """
+    runs = []
+    state = {'bad_format': False}
+
+    def fake_run(args, cwd=None, **kwargs):
+        runs.append(args)
+        if '-ini' in args:
+            jobname = next(arg for arg in args if arg.startswith('-jobname=')).split('=', 1)[1]
+            with open(os.path.join(cwd, jobname + '.fmt'), 'wb') as f:
+                f.write(b'FMT')
+            return subprocess.CompletedProcess(args, 0, '', '')
+
+        with open(os.path.join(cwd, 'document.tex'), encoding='utf-8') as f:
+            source = f.read()
+        with_format = any(arg.startswith('-fmt=') for arg in args)
+        if with_format:
+            assert os.path.exists(os.path.join(cwd, args[-2].split('=', 1)[1] + '.fmt'))
+            assert '\\endofdump' in source
+        if 'BROKEN' in source or (with_format and state['bad_format']):
+            with open(os.path.join(cwd, 'document.log'), 'w', encoding='utf-8') as f:
+                f.write('This is LuaHBTeX\n! Undefined control sequence.\nl.12 \\BROKEN\n')
+            return subprocess.CompletedProcess(args, 1, '', '')
+
+        aux = '\\relax\n'
+        if 'LastPage' in source:
+            aux += '\\newlabel{LastPage}{{}{1}}\n'
+        if 'UNSTABLE' in source:
+            aux += f'% pass {sum(1 for run in runs if "-ini" not in run)}\n'
+        aux_path = os.path.join(cwd, 'document.aux')
+        changed = not os.path.exists(aux_path) or Path(aux_path).read_text() != aux
+        with open(aux_path, 'w') as f:
+            f.write(aux)
+        with open(os.path.join(cwd, 'document.log'), 'w', encoding='utf-8') as f:
+            f.write('LaTeX Warning: Label(s) may have changed. Rerun to get cross-references right.\n'
+                    if (changed and aux != '\\relax\n') or 'NAG' in source else 'Output written\n')
+        if '-draftmode' not in args:
+            with open(os.path.join(cwd, 'document.pdf'), 'wb') as f:
+                f.write(b'%PDF-' + str(with_format).encode())
+        return subprocess.CompletedProcess(args, 0, '', '')
+
+    monkeypatch.setattr(latex_compiler.subprocess, 'run', fake_run)
+    monkeypatch.setattr(latex_compiler, 'tex_installation_id', lambda: 'LuaHBTeX 1.17|2024')
+    monkeypatch.setattr(latex_compiler, '_broken_formats', set())
+    return runs, state, DiskCache(tmp_path / 'formats', suffix='.fmt')
+
+
+@pytest.mark.unit
+def test_format_is_built_once_and_reused(fake_lualatex, tmp_path):
+    runs, _, cache = fake_lualatex
+    output = str(tmp_path / 'out.pdf')
+
+    assert len(compile_latex(PANDOC_TEX, output, use_format=True, cache=cache)) == 1
+    assert (tmp_path / 'out.pdf').read_bytes() == b'%PDF-True'
+    assert sum('-ini' in args for args in runs) == 1
+    assert 'mylatexformat.ltx' in runs[0]
+
+    # A different body reuses the format; a different preamble builds another
+    compile_latex(PANDOC_TEX.replace('Body', 'Other'), output, use_format=True, cache=cache)
+    compile_latex(PANDOC_TEX.replace('{tcolorbox}', '{tcolorbox,float}'), output, use_format=True, cache=cache)
+    assert sum('-ini' in args for args in runs) == 2
+
+    runs.clear()
+    compile_latex(PANDOC_TEX, output, use_format=False, cache=cache)
+    assert (tmp_path / 'out.pdf').read_bytes() == b'%PDF-False'
+    assert not any(arg.startswith('-fmt=') for args in runs for arg in args)
+
+
+@pytest.mark.unit
+def test_bad_format_falls_back_and_is_dropped(fake_lualatex, tmp_path):
+    runs, state, cache = fake_lualatex
+    output = str(tmp_path / 'out.pdf')
+    state['bad_format'] = True
+
+    compile_latex(PANDOC_TEX, output, use_format=True, cache=cache)
+    assert (tmp_path / 'out.pdf').read_bytes() == b'%PDF-False'
+    assert not list((tmp_path / 'formats').glob('*/*.fmt'))
+
+    # Not rebuilt for every document once known to be broken
+    runs.clear()
+    compile_latex(PANDOC_TEX, output, use_format=True, cache=cache)
+    assert not any('-ini' in args or any(arg.startswith('-fmt=') for arg in args) for args in runs)
+
+
+@pytest.mark.unit
+def test_document_errors_are_reported(fake_lualatex, tmp_path):
+    _, _, cache = fake_lualatex
+
+    with pytest.raises(RuntimeError, match='Undefined control sequence'):
+        compile_latex(PANDOC_TEX.replace('Body', '\\BROKEN'), str(tmp_path / 'out.pdf'),
+                      use_format=True, cache=cache)
+    # The document was at fault, not the format
+    assert list((tmp_path / 'formats').glob('*/*.fmt'))
+
+
+@pytest.mark.unit
+def test_pdflatex_compiles_without_format(fake_lualatex, tmp_path):
+    runs, _, cache = fake_lualatex
+
+    with pytest.raises(RuntimeError, match='^pdfLaTeX failed'):
+        compile_latex(PANDOC_TEX.replace('Body', '\\BROKEN'), str(tmp_path / 'out.pdf'),
+                      use_format=True, cache=cache, engine='pdflatex')
+    compile_latex(PANDOC_TEX, str(tmp_path / 'out.pdf'), use_format=True, cache=cache, engine='pdflatex')
+    assert (tmp_path / 'out.pdf').read_bytes() == b'%PDF-False'
+    assert [args[0] for args in runs] == ['pdflatex', 'pdflatex']
+
+
+@pytest.mark.unit
+def test_passes_follow_aux_changes_not_log_warnings(fake_lualatex, tmp_path):
+    runs, _, _ = fake_lualatex
+    output = tmp_path / 'out.pdf'
+
+    # Nothing reads the .aux back: one pass
+    passes = compile_latex(PANDOC_TEX, str(output), use_format=False)
+    assert [(p['draft'], p['rerun_requested']) for p in passes] == [(False, False)]
+
+    # A log asking for reruns is not followed once the .aux has settled
+    passes = compile_latex(PANDOC_TEX.replace('Body', 'NAG'), str(output), use_format=False)
+    assert [(p['aux_changed'], p['rerun_requested']) for p in passes] == [(True, True), (False, True)]
+
+    # LastPage: a draft pass writes the .aux, the final pass finds it settled
+    runs.clear()
+    footer = PANDOC_TEX.replace('Body', 'Page \\thepage\\ of \\pageref{LastPage}')
+    passes = compile_latex(footer, str(output), use_format=False)
+    assert [p['draft'] for p in passes] == [True, False]
+    assert [p['aux_changed'] for p in passes] == [True, False]
+    assert '-draftmode' in runs[0] and '-draftmode' not in runs[1]
+    assert output.read_bytes() == b'%PDF-False'
+    assert all(p['seconds'] >= 0 for p in passes)
+
+    # An .aux that never settles stops at MAX_LATEX_PASSES
+    passes = compile_latex(footer.replace('Page', 'UNSTABLE'), str(output), use_format=False)
+    assert len(passes) == latex_compiler.MAX_LATEX_PASSES
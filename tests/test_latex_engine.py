@@ -0,0 +1,151 @@
+"""Tests for choosing between pdfLaTeX and LuaLaTeX"""
+
+import pytest
+
+from helpers import latex_engine, pandoc_server, pdf_converter
+from helpers.capabilities import CapabilityRegistry
+from helpers.latex_engine import select_engine
+from helpers.obsidian_preprocessor import preprocess_obsidian_syntax
+
+
+@pytest.fixture
+def engines(monkeypatch):
+    """Both engines installed; the dict switches pdflatex off"""
+    installed = {'pdflatex': True}
+    registry = CapabilityRegistry({
+        'pandoc': lambda: (True, '3.1.9', ''),
+        'lualatex': lambda: (True, 'LuaHBTeX 1.17', ''),
+        'pdflatex': lambda: (installed['pdflatex'], 'pdfTeX 3.141592653', ''),
+    }, ttl=0)
+    monkeypatch.setattr(latex_engine, 'get_capabilities', lambda: registry)
+    monkeypatch.setattr(pdf_converter, 'get_capabilities', lambda: registry)
+    monkeypatch.delenv(latex_engine.LATEX_ENGINE_ENV, raising=False)
+    return installed
+
+
+@pytest.mark.unit
+def test_plain_latin_text_uses_pdflatex(engines):
+    assert select_engine(['# Café – naïve', 'Łódź, “quoted” … 5 €']) == ('pdflatex', 'plain Latin text')
+
+    engines['pdflatex'] = False
+    assert select_engine(['plain']) == ('lualatex', 'plain Latin text, but pdflatex is not installed')
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize('text, reason', [
+    ('- [?] question', 'uses U+2753 (❓), which pdfLaTeX cannot typeset'),
+    ('Greek λ', 'uses U+03BB (λ), which pdfLaTeX cannot typeset'),
+    ('a → b', 'uses U+2192 (→), which pdfLaTeX cannot typeset'),
+    ('x ≤ y', 'uses U+2264 (≤), which pdfLaTeX cannot typeset'),
+    ('done ✓', 'uses U+2713 (✓), which pdfLaTeX cannot typeset'),
+    ('Ħal Far', 'uses U+0126 (Ħ), which pdfLaTeX cannot typeset'),
+    ('\\directlua{tex.print("x")}', 'uses \\directlua, which needs LuaLaTeX'),
+    ('\\usepackage{fontspec}', 'uses \\usepackage{fontspec}, which needs LuaLaTeX'),
+])
+def test_lualatex_is_kept_when_needed(engines, text, reason):
+    # Checkbox icons are emoji injected by preprocessing
+    lines = preprocess_obsidian_syntax(text).splitlines()
+    assert select_engine(lines) == ('lualatex', reason)
+
+
+@pytest.mark.unit
+def test_engine_can_be_forced(engines, monkeypatch):
+    monkeypatch.setenv(latex_engine.LATEX_ENGINE_ENV, 'lualatex')
+    assert select_engine(['plain']) == ('lualatex', 'LATEX_ENGINE=lualatex')
+    monkeypatch.setenv(latex_engine.LATEX_ENGINE_ENV, 'pdflatex')
+    assert select_engine(['emoji 💡']) == ('pdflatex', 'LATEX_ENGINE=pdflatex')
+
+
+@pytest.fixture
+def fake_pdf_pipeline(engines, monkeypatch):
+    """Record the header Pandoc includes and the engine of each compile
+
+    pdfLaTeX fails on documents containing 'PDFTEX-FAILS'.
+    """
+    calls = []
+
+    def fake_convert_file(source_file, to, outputfile=None, extra_args=None):
+        header_path = next(arg for arg in extra_args if arg.startswith('--include-in-header='))
+        with open(header_path.split('=', 1)[1], encoding='utf-8') as f:
+            calls.append(['pandoc', f.read()])
+        with open(source_file, encoding='utf-8') as f:
+            return '\\documentclass{article}\n\\begin{document}\n' + f.read() + '\\end{document}\n'
+
+    def fake_compile_latex(latex, output_path, engine='lualatex', **kwargs):
+        calls.append([engine, kwargs['workers']])
+        if engine == 'pdflatex' and 'PDFTEX-FAILS' in latex:
+            raise RuntimeError('pdfLaTeX failed: ! TeX capacity exceeded')
+        with open(output_path, 'wb') as f:
+            f.write(b'%PDF-' + engine.encode())
+        return [{'draft': False, 'seconds': 0.1, 'aux_changed': True, 'rerun_requested': False}]
+
+    monkeypatch.setattr(pandoc_server.pypandoc, 'convert_file', fake_convert_file)
+    monkeypatch.setattr(pdf_converter, 'require_tools', lambda *names, **kwargs: None)
+    monkeypatch.setattr(pdf_converter, 'compile_latex', fake_compile_latex)
+    monkeypatch.setattr(pdf_converter, 'warm_font_cache', lambda: True)
+    monkeypatch.setenv('ARTIFACT_CACHE', '0')
+    return calls
+
+
+@pytest.mark.integration
+def test_plain_document_compiles_with_pdflatex(fake_pdf_pipeline):
+    report = {}
+    pdf = pdf_converter.convert_to_pdf('# Title\n\nSome ==text==', render_mermaid=False,
+                                       use_header_footer=False, report=report)
+    assert pdf.read() == b'%PDF-pdflatex'
+    assert (report['latex_engine'], report['latex_engine_reason']) == ('pdflatex', 'plain Latin text')
+
+    (_, header), (engine, workers) = fake_pdf_pipeline
+    assert (engine, workers) == ('pdflatex', None)
+    assert '\\usepackage{soul}' in header and 'fontspec' not in header
+    assert '\\usepackage{helvet}' not in header
+
+    report = {}
+    pdf = pdf_converter.convert_to_pdf('# Title\n\n- [i] idea', render_mermaid=False,
+                                       use_header_footer=False, report=report)
+    assert pdf.read() == b'%PDF-lualatex'
+    assert report['latex_engine_reason'] == 'uses U+1F4A1 (💡), which pdfLaTeX cannot typeset'
+    assert 'fontspec' in fake_pdf_pipeline[-2][1]
+
+
+@pytest.mark.integration
+@pytest.mark.parametrize('text', ['Flow: A → B', 'If x ≤ y', 'Done ✓'])
+def test_symbols_go_straight_to_lualatex(fake_pdf_pipeline, text):
+    # Characters outside PDFLATEX_CHARACTERS never cost a failed pdfLaTeX run
+    report = {}
+    pdf = pdf_converter.convert_to_pdf(text, render_mermaid=False, use_header_footer=False, report=report)
+    assert pdf.read() == b'%PDF-lualatex'
+    assert [call[0] for call in fake_pdf_pipeline] == ['pandoc', 'lualatex']
+    assert report['latex_engine_reason'].endswith('which pdfLaTeX cannot typeset')
+
+
+@pytest.mark.integration
+def test_pdflatex_sans_serif_is_opt_in(fake_pdf_pipeline, monkeypatch):
+    monkeypatch.setenv(pdf_converter.PDFLATEX_SANS_SERIF_ENV, '1')
+    pdf = pdf_converter.convert_to_pdf('# Title', render_mermaid=False, use_header_footer=False)
+    assert pdf.read() == b'%PDF-pdflatex'
+    assert '\\usepackage{helvet}\n\\renewcommand{\\familydefault}{\\sfdefault}' in fake_pdf_pipeline[0][1]
+
+
+@pytest.mark.integration
+def test_pdflatex_failure_falls_back_to_lualatex(fake_pdf_pipeline):
+    report = {}
+    pdf = pdf_converter.convert_to_pdf('PDFTEX-FAILS', render_mermaid=False,
+                                       use_header_footer=False, report=report)
+    assert pdf.read() == b'%PDF-lualatex'
+    assert [call[0] for call in fake_pdf_pipeline] == ['pandoc', 'pdflatex', 'pandoc', 'lualatex']
+    assert 'fontspec' in fake_pdf_pipeline[2][1]
+    assert report['latex_engine_reason'] == 'pdfLaTeX failed, fell back to LuaLaTeX'
+
+
+@pytest.mark.integration
+def test_missing_engine_leaves_no_temp_files(fake_pdf_pipeline, monkeypatch, tmp_path):
+    def require_tools(*names, **kwargs):
+        if 'lualatex' in names:
+            raise RuntimeError('LuaLaTeX is required for PDF conversion but is not installed')
+
+    monkeypatch.setattr(pdf_converter, 'require_tools', require_tools)
+    monkeypatch.setattr(pdf_converter.tempfile, 'tempdir', str(tmp_path))
+    with pytest.raises(RuntimeError, match='LuaLaTeX'):
+        pdf_converter.convert_to_pdf('# Title\n\n- [i] idea', render_mermaid=False, use_header_footer=False)
+    assert list(tmp_path.iterdir()) == []
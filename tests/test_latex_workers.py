@@ -0,0 +1,171 @@
+"""Tests for the pool of pre-started LuaLaTeX workers"""
+
+import os
+import shutil
+import subprocess
+
+import pytest
+
+from helpers import latex_compiler, latex_workers
+from helpers.latex_workers import LatexWorker, LatexWorkerPool, split_document_body
+
+
+DOCUMENT = '\\documentclass{article}\n\\begin{document}\nBody\n\\end{document}\n'
+
+
+class FakeStdin:
+    def __init__(self, process):
+        self.process = process
+        self.closed = False
+
+    def write(self, data):
+        self.process.received += data
+
+    def close(self):
+        self.closed = True
+
+
+class FakeProcess:
+    """A worker that 'typesets' the body it is sent when waited on"""
+
+    def __init__(self, args, cwd=None, **kwargs):
+        self.args = args
+        self.cwd = cwd
+        self.received = b''
+        self.stdin = FakeStdin(self)
+        self.returncode = None
+        self.killed = False
+        with open(os.path.join(cwd, 'document.tex'), encoding='utf-8') as f:
+            self.driver = f.read()
+        FakeProcess.started.append(self)
+
+    def poll(self):
+        return 1 if 'DEAD' in self.driver else self.returncode
+
+    def wait(self, timeout=None):
+        if self.returncode is None and not self.killed:
+            body_file = self.received.decode().strip()
+            with open(os.path.join(self.cwd, body_file), encoding='utf-8') as f:
+                body = f.read()
+            with open(os.path.join(self.cwd, 'document.log'), 'w', encoding='utf-8') as f:
+                f.write('LaTeX Warning: Label(s) may have changed. Rerun to get cross-references right.\n'
+                        if 'ref' in body else 'done\n')
+            with open(os.path.join(self.cwd, 'document.aux'), 'w', encoding='utf-8') as f:
+                f.write(body)
+            with open(os.path.join(self.cwd, 'document.pdf'), 'wb') as f:
+                f.write(b'%PDF-worker')
+            self.returncode = 0
+        return self.returncode
+
+    def kill(self):
+        self.killed = True
+        self.returncode = -9
+
+
+@pytest.fixture
+def fake_latex(monkeypatch):
+    """Fake Popen for workers and subprocess.run for rerun passes"""
+    FakeProcess.started = []
+    reruns = []
+
+    def fake_run(args, cwd=None, **kwargs):
+        reruns.append(cwd)
+        # A rerun must see the first pass's .aux
+        assert os.path.exists(os.path.join(cwd, 'document.aux'))
+        with open(os.path.join(cwd, 'document.pdf'), 'wb') as f:
+            f.write(b'%PDF-rerun')
+        with open(os.path.join(cwd, 'document.log'), 'w', encoding='utf-8') as f:
+            f.write('done\n')
+        return subprocess.CompletedProcess(args, 0, '', '')
+
+    monkeypatch.setattr(latex_workers.subprocess, 'Popen', FakeProcess)
+    monkeypatch.setattr(latex_compiler.subprocess, 'run', fake_run)
+    return reruns
+
+
+@pytest.mark.unit
+def test_split_document_body():
+    assert split_document_body(DOCUMENT) == ('\\documentclass{article}\n', '\nBody\n')
+    assert split_document_body('\\documentclass{article}\n') is None
+
+
+@pytest.mark.unit
+def test_first_compile_is_cold_and_starts_workers(fake_latex, tmp_path):
+    pool = LatexWorkerPool(size=2)
+    try:
+        assert pool.compile(DOCUMENT, str(tmp_path / 'out.pdf'), None) is None
+        assert len(FakeProcess.started) == 2
+        driver = FakeProcess.started[0].driver
+        assert driver.startswith('\\documentclass{article}\n\\begin{document}')
+        assert 'io.read' in driver and 'Body' not in driver
+        assert pool.stats == {'warm': 0, 'cold': 1}
+    finally:
+        pool.shutdown()
+    assert all(process.killed for process in FakeProcess.started)
+
+
+@pytest.mark.unit
+def test_warm_worker_runs_body_and_is_replaced(fake_latex, tmp_path):
+    pool = LatexWorkerPool(size=1)
+    output = tmp_path / 'out.pdf'
+    try:
+        pool.compile(DOCUMENT, str(output), None)
+        assert len(pool.compile(DOCUMENT, str(output), None)) == 1
+        assert output.read_bytes() == b'%PDF-worker'
+
+        # Body with a cross-reference: the worker's pass, then one rerun in its directory
+        tex = DOCUMENT.replace('Body', 'See \\ref{x}')
+        assert [p['draft'] for p in pool.compile(tex, str(output), None)] == [False, False]
+        worker = FakeProcess.started[1]
+        assert worker.received == b'body.tex\n' and worker.stdin.closed
+        assert fake_latex == [worker.cwd]
+        assert not os.path.exists(worker.cwd)
+        assert output.read_bytes() == b'%PDF-rerun'
+
+        # Each taken worker is replaced while its job runs
+        assert len(FakeProcess.started) == 3
+        assert pool.stats == {'warm': 2, 'cold': 1}
+    finally:
+        pool.shutdown()
+
+
+@pytest.mark.unit
+def test_failing_preamble_is_not_warmed_again(fake_latex, tmp_path):
+    pool = LatexWorkerPool(size=1)
+    tex = DOCUMENT.replace('article', 'DEAD')
+    try:
+        pool.compile(tex, str(tmp_path / 'out.pdf'), None)
+        assert pool.compile(tex, str(tmp_path / 'out.pdf'), None) is None
+        pool.compile(tex, str(tmp_path / 'out.pdf'), None)
+        assert len(FakeProcess.started) == 1
+    finally:
+        pool.shutdown()
+
+
+@pytest.mark.unit
+def test_least_recent_preamble_is_stopped(fake_latex, tmp_path):
+    pool = LatexWorkerPool(size=1, max_preambles=2)
+    try:
+        for cls in ('article', 'report', 'book'):
+            pool.compile(DOCUMENT.replace('article', cls), str(tmp_path / 'out.pdf'), None)
+        assert [process.killed for process in FakeProcess.started] == [True, False, False]
+    finally:
+        pool.shutdown()
+
+
+@pytest.mark.unit
+def test_pool_is_opt_in(monkeypatch):
+    monkeypatch.delenv(latex_workers.LATEX_WORKERS_ENV, raising=False)
+    assert latex_workers.get_worker_pool() is None
+
+
+@pytest.mark.integration
+@pytest.mark.skipif(shutil.which('lualatex') is None, reason='lualatex is not installed')
+def test_real_worker_inputs_the_body():
+    worker = LatexWorker('\\documentclass{article}\n', None)
+    try:
+        log = worker.typeset('Body from the worker\n')
+        assert 'body.tex' in log
+        assert os.path.getsize(os.path.join(worker.workdir, 'document.pdf')) > 0
+    finally:
+        worker.close()
@@ -0,0 +1,60 @@
+"""Tests for the fused line engine and the streaming line helpers"""
+
+import io
+
+import pytest
+
+from helpers.line_engine import iter_fused_lines, iter_source_lines, wrap_code_line, write_lines
+from helpers.obsidian_preprocessor import (
+    LatexMarkdownEmitter,
+    convert_callouts,
+    convert_extended_checkboxes,
+    convert_highlighting,
+    convert_page_break_markers,
+    fix_consecutive_bold_lines,
+    fix_list_blank_lines,
+)
+from helpers.obsidian_to_html import HtmlMarkdownEmitter
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize('content', ['', 'a', 'a\n', 'a\nb\n\n', '\n\n'])
+def test_source_lines_round_trip(content):
+    assert list(iter_source_lines(io.StringIO(content))) == content.split('\n')
+
+    out = io.StringIO()
+    write_lines(iter_source_lines(io.StringIO(content)), out)
+    assert out.getvalue() == content
+
+
+@pytest.mark.unit
+def test_code_lines_wrap_at_spaces_keeping_indentation():
+    line = '    ' + ' '.join(['word'] * 30)
+    wrapped = wrap_code_line(line, max_width=40)
+    assert all(len(piece) <= 40 and piece.startswith('    ') for piece in wrapped)
+    assert ''.join(piece[4:] for piece in wrapped) == line[4:]
+    assert wrap_code_line('x' * 150, max_width=40) == ['x' * 150]
+
+
+@pytest.mark.unit
+def test_fused_lines_match_the_staged_functions():
+    content = '**a** b\n**c** d\n- [!] flagged\n> [!tip] Tip\n> ==mark==\n<!-- pagebreak -->\ntext'
+    expected = content
+    for stage in (convert_page_break_markers, fix_consecutive_bold_lines, fix_list_blank_lines,
+                  convert_callouts, convert_extended_checkboxes, convert_highlighting):
+        expected = stage(expected)
+    assert '\n'.join(iter_fused_lines(content.split('\n'), LatexMarkdownEmitter())) == expected
+
+
+@pytest.mark.unit
+def test_fused_lines_are_emitted_block_by_block():
+    read = []
+
+    def source():
+        for number in range(1000):
+            read.append(number)
+            yield f'paragraph {number}' if number % 2 == 0 else ''
+
+    lines = iter_fused_lines(source(), HtmlMarkdownEmitter())
+    assert next(lines) == 'paragraph 0'
+    assert len(read) < 5
@@ -0,0 +1,249 @@
+"""Tests for batch Mermaid rendering through one mmdc session"""
+
+import os
+import re
+import subprocess
+import threading
+import time
+
+import pytest
+
+from helpers import mermaid_renderer
+from helpers.disk_cache import DiskCache
+from helpers.document_ir import mermaid_codes, parse_document
+from helpers.mermaid_docx_handler import extract_mermaid_and_render, mermaid_placeholder_renderer
+from helpers.mermaid_pdf_handler import (
+    cleanup_temp_images,
+    mermaid_reference_renderer,
+    pdf_page_width_pt,
+    prepare_markdown_with_mermaid_images,
+)
+from helpers.obsidian_preprocessor import LatexMarkdownEmitter
+from helpers.obsidian_to_html import HtmlMarkdownEmitter
+
+
+def _pdf(diagram):
+    """Minimal one-page PDF whose width is the diagram's length times 10 points"""
+    return b'%%PDF-1.4\n1 0 obj << /Type /Page /MediaBox [0 0 %d 80] >> endobj\n%%%%EOF' % (10 * len(diagram))
+
+
+def emit_docx(markdown):
+    """Emit a document for DOCX, its diagrams rendered in one batch"""
+    document = parse_document(markdown)
+    images = {}
+    emitter = HtmlMarkdownEmitter(mermaid=mermaid_placeholder_renderer(images, mermaid_codes(document)))
+    return emitter.emit(document), images
+
+
+def emit_pdf(markdown, output_format='png'):
+    """Emit a document for PDF, its diagrams rendered in one batch"""
+    document = parse_document(markdown)
+    image_files = []
+    renderer = mermaid_reference_renderer(image_files, mermaid_codes(document), output_format)
+    return LatexMarkdownEmitter(mermaid=renderer).emit(document), image_files
+
+
+@pytest.fixture
+def fake_mmdc(monkeypatch):
+    """Fake mmdc: renders each diagram as b'PNG:<source>' (a small PDF with -e pdf), fails on any 'BAD' diagram"""
+    runs = []
+
+    def fake_run(args, **kwargs):
+        with open(args[args.index('-i') + 1], encoding='utf-8') as f:
+            source = f.read()
+        output = args[args.index('-o') + 1]
+        if source.startswith('```mermaid'):
+            diagrams = re.findall(r'```mermaid\n(.*?)\n```', source, re.S)
+        else:
+            diagrams = [source]
+        runs.append(diagrams)
+        if any('BAD' in diagram for diagram in diagrams):
+            return subprocess.CompletedProcess(args, 1, '', 'Parse error')
+
+        if output.endswith('.md'):
+            output_format = args[args.index('-e') + 1]
+            for number, diagram in enumerate(diagrams, 1):
+                with open(output[:-3] + f'-{number}.{output_format}', 'wb') as f:
+                    f.write(_pdf(diagram) if output_format == 'pdf' else b'PNG:' + diagram.encode())
+        elif output.endswith('.pdf'):
+            with open(output, 'wb') as f:
+                f.write(_pdf(source))
+        else:
+            with open(output, 'wb') as f:
+                f.write(b'PNG:' + source.encode())
+        return subprocess.CompletedProcess(args, 0, '', '')
+
+    monkeypatch.setattr(mermaid_renderer.subprocess, 'run', fake_run)
+    monkeypatch.setattr(mermaid_renderer, 'get_mermaid_cli_version', lambda: '10.9.1')
+    return runs
+
+
+@pytest.mark.unit
+def test_batch_renders_all_diagrams_in_one_run(fake_mmdc, tmp_path, monkeypatch):
+    monkeypatch.setattr(mermaid_renderer, 'MERMAID_MAX_CONCURRENCY', 1)
+    codes = [f'graph TD\n A{i}-->B' for i in range(30)]
+    results = mermaid_renderer.render_mermaid_batch(codes, cache=DiskCache(tmp_path))
+
+    assert len(fake_mmdc) == 1
+    assert results == [b'PNG:' + code.encode() for code in codes]
+
+
+@pytest.mark.unit
+def test_failing_diagrams_are_isolated(fake_mmdc, tmp_path):
+    codes = [f'graph TD\n A{i}-->B' for i in range(8)]
+    codes[2] = 'BAD one'
+    codes[7] = 'BAD two'
+    results = mermaid_renderer.render_mermaid_batch(codes, cache=DiskCache(tmp_path))
+
+    for index, result in enumerate(results):
+        if index in (2, 7):
+            assert isinstance(result, Exception) and 'Parse error' in str(result)
+        else:
+            assert result == b'PNG:' + codes[index].encode()
+    # Far fewer runs than one per diagram would need after the batch failed
+    assert len(fake_mmdc) < 2 * len(codes)
+
+
+@pytest.mark.unit
+def test_batch_uses_cache_and_renders_duplicates_once(fake_mmdc, tmp_path):
+    cache = DiskCache(tmp_path)
+    mermaid_renderer.render_mermaid_batch(['graph A', 'graph B'], cache=cache)
+    results = mermaid_renderer.render_mermaid_batch(['graph A', 'graph C', 'graph C\n', 'graph B'], cache=cache)
+
+    assert fake_mmdc == [['graph A', 'graph B'], ['graph C']]
+    assert results == [b'PNG:graph A', b'PNG:graph C', b'PNG:graph C', b'PNG:graph B']
+
+
+@pytest.mark.unit
+def test_handlers_render_documents_in_one_session(fake_mmdc, tmp_path, monkeypatch):
+    monkeypatch.setattr(mermaid_renderer, 'get_mermaid_cache', lambda output_format='png': DiskCache(tmp_path))
+    markdown = '```mermaid\ngraph one\n```\n\n```mermaid\nBAD\n```\n\n```mermaid\ngraph two\n```\n'
+
+    content, images = emit_docx(markdown)
+    assert '__MERMAID_DIAGRAM_0__' in content and '__MERMAID_DIAGRAM_2__' in content
+    assert '```mermaid\nBAD\n```' in content
+    assert sorted(images) == ['mermaid_0', 'mermaid_2']
+
+    monkeypatch.setattr(mermaid_renderer, 'get_mermaid_cli_version', lambda: '11.0.0')
+    monkeypatch.setattr('helpers.mermaid_pdf_handler.Image.open', lambda path: type('Img', (), {
+        'width': 200, 'close': lambda self: None})())
+    content, image_files = emit_pdf(markdown)
+    try:
+        assert content.count('![Figure') == 2
+        assert 'Mermaid diagram rendering failed' in content
+        assert all(os.path.exists(path) for path in image_files)
+    finally:
+        cleanup_temp_images(image_files)
+    assert fake_mmdc[0] == ['graph one', 'BAD', 'graph two']
+
+
+@pytest.mark.unit
+def test_markdown_helpers_only_replace_diagrams(fake_mmdc, tmp_path, monkeypatch):
+    monkeypatch.setattr(mermaid_renderer, 'get_mermaid_cache', lambda output_format='png': DiskCache(tmp_path))
+    monkeypatch.setattr('helpers.mermaid_pdf_handler.Image.open', lambda path: type('Img', (), {
+        'width': 200, 'close': lambda self: None})())
+    long_line = 'x = ' + ' + '.join(['value'] * 40)
+    before = '**A**\n**B**\n==kept== [[link]]\n\n```python\n' + long_line + '\n```\n'
+    markdown = before + '\n```mermaid\ngraph one\n```\n\n```mermaid\ngraph two\n```\nEnd\n'
+
+    content, images = extract_mermaid_and_render(markdown)
+    assert content == before + '\n__MERMAID_DIAGRAM_0__\n\n__MERMAID_DIAGRAM_1__\nEnd\n'
+    assert sorted(images) == ['mermaid_0', 'mermaid_1']
+
+    content, image_files = prepare_markdown_with_mermaid_images(markdown)
+    try:
+        assert content.startswith(before) and content.endswith('\nEnd\n')
+        assert content.count('![Figure') == 2
+    finally:
+        cleanup_temp_images(image_files)
+    assert fake_mmdc == [['graph one', 'graph two']]
+
+    assert prepare_markdown_with_mermaid_images(before) == (before, [])
+    assert extract_mermaid_and_render(before) == (before, {})
+
+
+@pytest.mark.unit
+def test_concurrent_batches_respect_the_global_cap(fake_mmdc, tmp_path, monkeypatch):
+    monkeypatch.setattr(mermaid_renderer, 'MERMAID_MAX_CONCURRENCY', 3)
+    monkeypatch.setattr(mermaid_renderer, '_render_slots', threading.BoundedSemaphore(2))
+    monkeypatch.setattr(mermaid_renderer, '_render_pool', None)
+    render = mermaid_renderer.subprocess.run
+    active = []
+    peak = []
+
+    def slow_run(args, **kwargs):
+        active.append(args)
+        peak.append(len(active))
+        time.sleep(0.05)
+        active.pop()
+        return render(args, **kwargs)
+
+    monkeypatch.setattr(mermaid_renderer.subprocess, 'run', slow_run)
+    codes = [f'graph TD\n A{i}-->B' for i in range(30)]
+    results = mermaid_renderer.render_mermaid_batch(codes, cache=DiskCache(tmp_path))
+
+    # Split across three mmdc runs, never more than two at once, spliced back in order
+    assert len(fake_mmdc) == 3 and sorted(map(len, fake_mmdc)) == [10, 10, 10]
+    assert max(peak) <= 2
+    assert results == [b'PNG:' + code.encode() for code in codes]
+
+
+@pytest.mark.unit
+def test_small_batches_stay_in_one_run(fake_mmdc, tmp_path, monkeypatch):
+    monkeypatch.setattr(mermaid_renderer, 'MERMAID_MAX_CONCURRENCY', 4)
+    mermaid_renderer.render_mermaid_batch(['graph A', 'graph B', 'graph C'], cache=DiskCache(tmp_path))
+
+    assert fake_mmdc == [['graph A', 'graph B', 'graph C']]
+
+
+@pytest.mark.unit
+def test_handlers_splice_results_by_position(fake_mmdc, tmp_path, monkeypatch):
+    monkeypatch.setattr(mermaid_renderer, 'get_mermaid_cache', lambda output_format='png': DiskCache(tmp_path))
+    markdown = ''.join(f'Text {i}\n\n```mermaid\ngraph {i}\n```\n\n' for i in range(12)) + 'End\n'
+
+    content, images = emit_docx(markdown)
+
+    expected = ''.join(f'Text {i}\n\n__MERMAID_DIAGRAM_{i}__\n\n' for i in range(12)) + 'End\n'
+    assert content == expected
+    assert [images[f'mermaid_{i}'].read() for i in range(12)] == [f'PNG:graph {i}'.encode() for i in range(12)]
+
+
+@pytest.mark.unit
+def test_vector_batch_renders_cropped_pdfs(fake_mmdc, tmp_path, monkeypatch):
+    commands = []
+    render = mermaid_renderer.subprocess.run
+    monkeypatch.setattr(mermaid_renderer.subprocess, 'run',
+                        lambda args, **kwargs: commands.append(args) or render(args, **kwargs))
+    cache = DiskCache(tmp_path)
+
+    results = mermaid_renderer.render_mermaid_batch(['graph A', 'graph B'], cache=cache, output_format='pdf')
+    assert results == [_pdf('graph A'), _pdf('graph B')]
+    assert '--pdfFit' in commands[0] and commands[0][commands[0].index('-e') + 1] == 'pdf'
+
+    # PNG and PDF renderings of a diagram are cached separately
+    mermaid_renderer.render_mermaid_batch(['graph A'], cache=cache, output_format='pdf')
+    assert mermaid_renderer.render_mermaid_batch(['graph A'], cache=cache) == [b'PNG:graph A']
+    assert mermaid_renderer.render_mermaid_to_pdf('graph B', cache=cache).read() == _pdf('graph B')
+    assert fake_mmdc == [['graph A', 'graph B'], ['graph A']]
+
+    with pytest.raises(ValueError):
+        mermaid_renderer.render_mermaid_batch(['graph A'], output_format='svg')
+
+
+@pytest.mark.unit
+def test_vector_diagrams_are_sized_from_the_mediabox(fake_mmdc, tmp_path, monkeypatch):
+    monkeypatch.setattr(mermaid_renderer, 'get_mermaid_cache', lambda output_format='png': DiskCache(tmp_path))
+    monkeypatch.setattr('helpers.mermaid_pdf_handler.Image.open', None)
+    wide = 'graph ' + 'X' * 60
+    markdown = '```mermaid\ngraph A\n```\n\n```mermaid\n' + wide + '\n```\n'
+
+    content, image_files = emit_pdf(markdown, output_format='pdf')
+    try:
+        assert all(path.endswith('.pdf') for path in image_files) and len(image_files) == 2
+        assert f'({image_files[0]}){{width=70pt}}' in content
+        assert f'({image_files[1]}){{width=85%}}' in content
+    finally:
+        cleanup_temp_images(image_files)
+
+    assert pdf_page_width_pt(b'/MediaBox [ 12.5 0 212.5 100 ]') == 200
+    assert pdf_page_width_pt(b'no page here') is None
@@ -0,0 +1,98 @@
+"""Tests for the persistent Mermaid diagram cache"""
+
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+from helpers import mermaid_cache, mermaid_renderer
+from helpers.disk_cache import DiskCache
+from helpers.document_ir import parse_document
+from helpers.mermaid_cache import get_mermaid_cache, mermaid_cache_key, mermaid_cache_stats, normalize_mermaid_source
+from helpers.mermaid_docx_handler import mermaid_placeholder_renderer
+from helpers.mermaid_pdf_handler import cleanup_temp_images, mermaid_reference_renderer
+from helpers.obsidian_preprocessor import LatexMarkdownEmitter
+from helpers.obsidian_to_html import HtmlMarkdownEmitter
+
+
+def _png(width=400, height=100):
+    buffer = BytesIO()
+    Image.new('RGBA', (width, height)).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+PNG = _png()
+
+
+@pytest.fixture
+def fake_mmdc(monkeypatch):
+    """Count mmdc runs; each one 'renders' a small PNG"""
+    runs = []
+
+    def fake_run_mmdc(code, scale, background, output_format='png'):
+        runs.append((code, scale, background))
+        return PNG
+
+    monkeypatch.setattr(mermaid_renderer, '_run_mmdc', fake_run_mmdc)
+    monkeypatch.setattr(mermaid_renderer, 'get_mermaid_cli_version', lambda: '10.9.1')
+    return runs
+
+
+@pytest.mark.unit
+def test_normalization_ignores_cosmetic_differences():
+    assert normalize_mermaid_source('\r\ngraph TD  \r\n    A-->B\t\r\n\r\n') == 'graph TD\n    A-->B'
+    key = mermaid_cache_key('graph TD', 2, 'transparent', '10.9.1')
+    assert key != mermaid_cache_key('graph TD', 3, 'transparent', '10.9.1')
+    assert key != mermaid_cache_key('graph TD', 2, 'white', '10.9.1')
+    assert key != mermaid_cache_key('graph TD', 2, 'transparent', '11.0.0')
+    assert key != mermaid_cache_key('graph LR', 2, 'transparent', '10.9.1')
+    assert key != mermaid_cache_key('graph TD', 2, 'transparent', '10.9.1', 'pdf')
+
+
+@pytest.mark.unit
+def test_each_format_has_its_own_cache(monkeypatch, tmp_path):
+    monkeypatch.setattr(mermaid_cache, '_mermaid_caches', {})
+    monkeypatch.setenv(mermaid_cache.MERMAID_CACHE_DIR_ENV, str(tmp_path))
+
+    key = mermaid_cache_key('graph TD', 1, 'transparent', '10.9.1', 'pdf')
+    path = get_mermaid_cache('pdf').put(key, b'%PDF-1.5')
+    assert path.suffix == '.pdf' and get_mermaid_cache('pdf').get(key) == b'%PDF-1.5'
+    assert get_mermaid_cache('png').get(key) is None
+    assert get_mermaid_cache() is get_mermaid_cache('png')
+
+
+@pytest.mark.unit
+def test_render_reuses_cached_png(fake_mmdc, tmp_path):
+    cache = DiskCache(tmp_path, suffix='.png')
+
+    first = mermaid_renderer.render_mermaid_to_png('graph TD\n A-->B', cache=cache)
+    second = mermaid_renderer.render_mermaid_to_png('graph TD  \n A-->B\n', cache=cache)
+    output = mermaid_renderer.render_mermaid_to_png('graph TD\n A-->B', str(tmp_path / 'out.png'), cache=cache)
+
+    assert len(fake_mmdc) == 1
+    assert first.read() == second.read() == PNG
+    assert (tmp_path / 'out.png').read_bytes() == PNG and output == str(tmp_path / 'out.png')
+    assert mermaid_cache_stats(cache)['hit_rate'] == pytest.approx(2 / 3)
+
+    mermaid_renderer.render_mermaid_to_png('graph TD\n A-->B', cache=cache, use_cache=False)
+    assert len(fake_mmdc) == 2
+
+
+@pytest.mark.unit
+def test_pdf_and_docx_handlers_share_the_cache(fake_mmdc, tmp_path, monkeypatch):
+    monkeypatch.setattr(mermaid_renderer, 'get_mermaid_cache',
+                        lambda output_format: DiskCache(tmp_path, suffix='.' + output_format))
+    document = parse_document('Intro\n\n```mermaid\ngraph TD\n A-->B\n```\n')
+
+    image_files = []
+    content = LatexMarkdownEmitter(mermaid=mermaid_reference_renderer(image_files)).emit(document)
+    try:
+        assert '![Figure 1: Mermaid Diagram]' in content
+    finally:
+        cleanup_temp_images(image_files)
+    images = {}
+    content = HtmlMarkdownEmitter(mermaid=mermaid_placeholder_renderer(images)).emit(document)
+
+    assert '__MERMAID_DIAGRAM_0__' in content
+    assert images['mermaid_0'].read() == PNG
+    assert len(fake_mmdc) == 1
@@ -0,0 +1,120 @@
+"""Tests for the warm Mermaid render daemon client and its mmdc fallback"""
+
+import base64
+import json
+import socketserver
+import threading
+
+import pytest
+
+from helpers import mermaid_renderer
+from helpers.disk_cache import DiskCache
+
+
+class FakeDaemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Speaks the daemon protocol: renders b'<FORMAT>:<source>', fails on 'BAD' diagrams"""
+
+    daemon_threads = True
+
+    def __init__(self, path):
+        self.requests = []
+        self.broken = False
+        self.formats = ('png', 'pdf')
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(handler):
+                request = json.loads(handler.rfile.readline())
+                self.requests.append(request)
+                if request['op'] == 'health':
+                    response = {'ok': True, 'version': '10.9.1', 'pool_size': 2}
+                elif self.broken:
+                    response = {'ok': False, 'kind': 'internal', 'error': 'browser crashed'}
+                elif 'BAD' in request['code']:
+                    response = {'ok': False, 'kind': 'render', 'error': 'Parse error'}
+                else:
+                    # A daemon without PDF support answers with a PNG
+                    output_format = request['format'] if request['format'] in self.formats else 'png'
+                    image = f"{output_format.upper()}:{request['code']}".encode()
+                    response = {'ok': True, output_format: base64.b64encode(image).decode()}
+                handler.wfile.write(json.dumps(response).encode() + b'\n')
+
+        super().__init__(path, Handler)
+
+
+@pytest.fixture
+def daemon(tmp_path, monkeypatch):
+    path = str(tmp_path / 'mermaid.sock')
+    server = FakeDaemon(path)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setenv(mermaid_renderer.MERMAID_DAEMON_SOCKET_ENV, path)
+    monkeypatch.setattr(mermaid_renderer, '_daemon_clients', {})
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def mmdc_runs(monkeypatch):
+    runs = []
+
+    def fake_run_mmdc(code, scale, background, output_format='png'):
+        runs.append(code)
+        return b'MMDC:' + code.encode()
+
+    monkeypatch.setattr(mermaid_renderer, '_run_mmdc', fake_run_mmdc)
+    monkeypatch.setattr(mermaid_renderer, 'get_mermaid_cli_version', lambda: None)
+    return runs
+
+
+@pytest.mark.unit
+def test_renders_on_daemon_when_running(daemon, mmdc_runs, tmp_path):
+    client = mermaid_renderer.get_mermaid_daemon()
+    assert client is not None and client.health()['pool_size'] == 2
+
+    buffer = mermaid_renderer.render_mermaid_to_png('graph TD', cache=DiskCache(tmp_path / 'cache'))
+    assert buffer.read() == b'PNG:graph TD'
+    assert mmdc_runs == []
+    render = [r for r in daemon.requests if r['op'] == 'render'][0]
+    assert render['scale'] == 2 and render['background'] == 'transparent' and render['timeout_ms'] == 30000
+
+    # The daemon's renderer version keys the cache
+    assert mermaid_renderer.get_renderer_version() == 'daemon-mermaid-10.9.1'
+    mermaid_renderer.render_mermaid_to_png('graph TD', cache=DiskCache(tmp_path / 'cache'))
+    assert len([r for r in daemon.requests if r['op'] == 'render']) == 1
+
+
+@pytest.mark.unit
+def test_diagram_errors_do_not_fall_back(daemon, mmdc_runs):
+    results = mermaid_renderer.render_mermaid_batch(['graph A', 'BAD', 'graph B'], use_cache=False)
+
+    assert results[0] == b'PNG:graph A' and results[2] == b'PNG:graph B'
+    assert isinstance(results[1], mermaid_renderer.MermaidRenderError)
+    assert mmdc_runs == []
+
+
+@pytest.mark.unit
+def test_falls_back_to_mmdc_when_daemon_fails(daemon, mmdc_runs):
+    daemon.broken = True
+    assert mermaid_renderer.render_mermaid_to_png('graph A', use_cache=False).read() == b'MMDC:graph A'
+    assert mmdc_runs == ['graph A']
+
+
+@pytest.mark.unit
+def test_falls_back_to_mmdc_when_daemon_absent(tmp_path, monkeypatch, mmdc_runs):
+    monkeypatch.setenv(mermaid_renderer.MERMAID_DAEMON_SOCKET_ENV, str(tmp_path / 'missing.sock'))
+    monkeypatch.setattr(mermaid_renderer, '_daemon_clients', {})
+
+    assert mermaid_renderer.get_mermaid_daemon() is None
+    assert mermaid_renderer.render_mermaid_to_png('graph A').read() == b'MMDC:graph A'
+
+
+@pytest.mark.unit
+def test_renders_vector_pdfs_on_daemon(daemon, mmdc_runs):
+    assert mermaid_renderer.render_mermaid_to_pdf('graph A', use_cache=False).read() == b'PDF:graph A'
+    assert [r['format'] for r in daemon.requests if r['op'] == 'render'] == ['pdf']
+
+    # A daemon that cannot produce PDFs is skipped for mmdc
+    daemon.formats = ('png',)
+    assert mermaid_renderer.render_mermaid_to_pdf('graph B', use_cache=False).read() == b'MMDC:graph B'
+    assert mmdc_runs == ['graph B']
@@ -0,0 +1,125 @@
+"""Tests for conversions through a long-lived pandoc server"""
+
+import json
+import stat
+import sys
+
+import pytest
+
+from helpers import pandoc_server
+from helpers.pandoc_server import PandocServer, PandocServerError, convert_file, server_options
+
+
+# Stands in for `pandoc server --port N --timeout T`: echoes the request as
+# the output, and rejects a document whose text is 'BAD'
+FAKE_PANDOC = '''#!{python}
+import json, os, sys
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body):
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self._send(200, b'3.1.2')
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        if request['text'] == 'BAD':
+            return self._send(500, b'Unknown reader')
+        request['pid'] = os.getpid()
+        self._send(200, json.dumps({{'output': json.dumps(request), 'base64': False}}).encode())
+
+HTTPServer(('127.0.0.1', int(sys.argv[sys.argv.index('--port') + 1])), Handler).serve_forever()
+'''
+
+
+@pytest.fixture
+def fake_pandoc(tmp_path):
+    path = tmp_path / 'pandoc'
+    path.write_text(FAKE_PANDOC.format(python=sys.executable))
+    path.chmod(path.stat().st_mode | stat.S_IEXEC)
+    return str(path)
+
+
+@pytest.fixture
+def server(fake_pandoc):
+    server = PandocServer(pandoc_path=fake_pandoc, max_restarts=1)
+    server.start()
+    yield server
+    server.close()
+
+
+@pytest.mark.unit
+def test_server_options_translate_pypandoc_arguments(tmp_path):
+    header = tmp_path / 'header.tex'
+    header.write_text('\\usepackage{float}\n')
+    args = ['--standalone', '--from=markdown-yaml_metadata_block', '--variable=geometry:margin=0.75in',
+            '--variable=colorlinks:true', '--include-in-header=' + str(header), '--columns=80',
+            '--extract-media=/tmp/media']
+
+    options = server_options('![d](/tmp/diagram.pdf)', 'latex', args)
+    assert options == {
+        'text': '![d](/tmp/diagram.pdf)', 'from': 'markdown-yaml_metadata_block', 'to': 'latex',
+        'standalone': True, 'columns': 80,
+        'variables': {'geometry': 'margin=0.75in', 'colorlinks': 'true',
+                      'header-includes': ['\\usepackage{float}\n']},
+    }
+    # Relative or remote images need --extract-media, which the server cannot do
+    assert server_options('![d](images/a.png)', 'latex', args) is None
+    assert server_options('<img src="https://example.com/a.png">', 'latex', args) is None
+    assert server_options('text', 'latex', ['--lua-filter=f.lua']) is None
+
+
+@pytest.mark.integration
+def test_requests_reuse_pooled_connections(server):
+    first = json.loads(server.convert({'text': 'one', 'to': 'latex'}))
+    second = json.loads(server.convert({'text': 'two', 'to': 'latex'}))
+    assert (first['text'], second['text']) == ('one', 'two')
+    assert server._connections.qsize() == 1
+    assert server.stats == {'requests': 2, 'restarts': 0}
+
+
+@pytest.mark.integration
+def test_dead_server_is_restarted(server):
+    first_pid = json.loads(server.convert({'text': 'one'}))['pid']
+    server.process.kill()
+    server.process.wait()
+
+    # The next request finds it dead and restarts it, within max_restarts
+    assert json.loads(server.convert({'text': 'two'}))['pid'] != first_pid
+    assert server.stats['restarts'] == 1
+    server.process.kill()
+    server.process.wait()
+    with pytest.raises(PandocServerError):
+        server.convert({'text': 'three'})
+
+
+@pytest.mark.integration
+def test_convert_file_falls_back_to_pypandoc(server, monkeypatch, tmp_path):
+    calls = []
+    monkeypatch.setattr(pandoc_server.pypandoc, 'convert_file',
+                        lambda source, to, extra_args=(): calls.append(extra_args) or 'subprocess')
+    source = tmp_path / 'doc.md'
+
+    # Server disabled: always a pandoc process
+    monkeypatch.delenv(pandoc_server.PANDOC_ENGINE_ENV, raising=False)
+    source.write_text('hello')
+    assert convert_file(str(source), 'latex', ['--standalone']) == 'subprocess'
+
+    monkeypatch.setattr(pandoc_server, 'get_pandoc_server', lambda: server)
+    assert json.loads(convert_file(str(source), 'latex', ['--standalone']))['standalone'] is True
+
+    # The server rejects the document, or it uses an argument the server lacks
+    source.write_text('BAD')
+    assert convert_file(str(source), 'latex', ['--standalone']) == 'subprocess'
+    assert convert_file(str(source), 'latex', ['--lua-filter=f.lua']) == 'subprocess'
+    assert calls == [['--standalone'], ['--standalone'], ['--lua-filter=f.lua']]
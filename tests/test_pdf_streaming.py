@@ -0,0 +1,113 @@
+"""Tests for the streaming input mode of convert_to_pdf"""
+
+import glob
+import io
+import itertools
+import os
+
+import pytest
+
+from helpers import pandoc_server, pdf_converter
+from helpers.document_ir import Frontmatter, iter_blocks
+from helpers.yaml_stripper import FRONTMATTER_MAX_LINES, iter_yaml_stripped_lines
+
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CORPUS = sorted(glob.glob(os.path.join(REPO_ROOT, '**', '*.md'), recursive=True))
+
+
+@pytest.fixture
+def captured_markdown(monkeypatch):
+    """Replace the Pandoc call with one that records the temp markdown file"""
+    captured = []
+
+    def fake_convert_file(source_file, to, outputfile=None, extra_args=None):
+        with open(source_file, 'r', encoding='utf-8') as f:
+            captured.append(f.read())
+        return '\\documentclass{article}\n\\begin{document}\n\\end{document}\n'
+
+    def fake_compile_latex(latex, output_path, **kwargs):
+        with open(output_path, 'wb') as f:
+            f.write(b'%PDF-fake')
+
+    monkeypatch.setattr(pandoc_server.pypandoc, 'convert_file', fake_convert_file)
+    monkeypatch.setattr(pdf_converter, 'require_tools', lambda *names, **kwargs: None)
+    monkeypatch.setattr(pdf_converter, 'compile_latex', fake_compile_latex)
+    monkeypatch.setenv('ARTIFACT_CACHE', '0')
+    return captured
+
+
+@pytest.mark.integration
+@pytest.mark.parametrize('path', CORPUS, ids=[os.path.basename(p) for p in CORPUS])
+def test_streamed_file_produces_same_pandoc_input(path, captured_markdown):
+    with open(path, 'r', encoding='utf-8') as f:
+        content = f.read()
+
+    pdf_converter.convert_to_pdf(content, render_mermaid=False, use_header_footer=False)
+    with open(path, 'r', encoding='utf-8') as f:
+        buffer = pdf_converter.convert_to_pdf(f, render_mermaid=False, use_header_footer=False)
+
+    assert buffer.read() == b'%PDF-fake'
+    assert captured_markdown[0] == captured_markdown[1]
+
+
+@pytest.mark.unit
+def test_streaming_captures_frontmatter():
+    captured = []
+    lines = ['---', 'title: Report', '---', 'body']
+    assert list(pdf_converter._iter_capture_frontmatter(iter(lines), captured)) == lines
+    assert captured == ['---', 'title: Report', '---']
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize('key_lines, closed', [
+    (FRONTMATTER_MAX_LINES - 1, True),
+    (FRONTMATTER_MAX_LINES, False),
+])
+def test_frontmatter_limit_is_shared(key_lines, closed):
+    lines = ['---'] + ['key: value'] * key_lines + ['---', 'body']
+
+    assert isinstance(next(iter_blocks(lines)), Frontmatter) == closed
+    assert list(iter_yaml_stripped_lines(lines)) == (['body'] if closed else lines)
+    captured = []
+    list(pdf_converter._iter_capture_frontmatter(iter(lines), captured))
+    assert captured == (lines[:-1] if closed else [])
+
+
+@pytest.mark.unit
+def test_unclosed_frontmatter_is_not_buffered():
+    endless = itertools.chain(['---'], itertools.repeat('key: value'))
+    assert next(iter_yaml_stripped_lines(endless)) == '---'
+
+
+@pytest.mark.integration
+def test_streamed_mermaid_blocks_match_batch(monkeypatch, captured_markdown):
+    from helpers import mermaid_pdf_handler
+
+    def fake_reference(image_data, diagram_id, image_files, output_format='png'):
+        return f'\n\n[diagram {diagram_id}: {image_data.decode()}]\n\n'
+
+    monkeypatch.setattr(mermaid_pdf_handler, '_mermaid_reference', fake_reference)
+    batches = []
+
+    def fake_batch(codes, output_format='png'):
+        batches.append(list(codes))
+        return [code.encode() for code in codes]
+
+    monkeypatch.setattr(mermaid_pdf_handler, 'render_mermaid_batch', fake_batch)
+    monkeypatch.setattr(mermaid_pdf_handler, 'render_mermaid_to_pdf', lambda code: io.BytesIO(code.encode()))
+    monkeypatch.setattr(pdf_converter, 'mermaid_renderer_available', lambda: True)
+    content = 'intro\n```mermaid\ngraph TD\n  A-->B\n```\ntail\n\n```mermaid\nx\n```\nend'
+    codes = ['graph TD\n  A-->B', 'x']
+
+    # A parsed document and a seekable stream (like an upload) render their
+    # diagrams in one batch, lines that cannot be re-read one by one
+    pdf_converter.convert_to_pdf(content, use_header_footer=False)
+    pdf_converter.convert_to_pdf(io.StringIO(content), use_header_footer=False)
+    upload = io.TextIOWrapper(io.BytesIO(content.encode('utf-8')), encoding='utf-8', newline='\n')
+    pdf_converter.convert_to_pdf(upload, use_header_footer=False)
+    pdf_converter.convert_to_pdf((line for line in io.StringIO(content)), use_header_footer=False)
+
+    assert batches == [codes, codes, codes]
+    assert len(set(captured_markdown)) == 1
+    assert '[diagram 0: graph TD\n  A-->B]' in captured_markdown[0] and '[diagram 1: x]' in captured_markdown[0]
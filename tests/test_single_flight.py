@@ -0,0 +1,99 @@
+"""Tests for single-flight deduplication of concurrent work"""
+
+import threading
+import time
+
+import pytest
+
+from helpers import mermaid_renderer
+from helpers.disk_cache import DiskCache
+from helpers.single_flight import SingleFlight
+
+
+def _wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.005)
+
+
+@pytest.mark.unit
+def test_concurrent_callers_share_one_call():
+    flights = SingleFlight()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        # Hold the flight until every other caller is waiting on it
+        _wait_for(lambda: flights.stats()['shared'] == 9)
+        return 'result'
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(flights.do('key', compute))) for _ in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert calls == [1] and results == ['result'] * 10
+    assert flights.stats() == {'executed': 1, 'shared': 9, 'in_flight': 0}
+
+    # Finished flights are forgotten
+    assert flights.do('key', lambda: 'again') == 'again'
+
+
+@pytest.mark.unit
+def test_errors_reach_every_waiter():
+    flights = SingleFlight()
+    owned, _ = flights.begin(['key'])
+    errors = []
+
+    def follow():
+        try:
+            flights.do('key', lambda: 'never')
+        except ValueError as e:
+            errors.append(e)
+
+    follower = threading.Thread(target=follow)
+    follower.start()
+    _wait_for(lambda: flights.stats()['shared'] == 1)
+    flights.finish('key', error=ValueError('broken'))
+    follower.join()
+
+    assert owned == ['key'] and len(errors) == 1 and str(errors[0]) == 'broken'
+
+
+@pytest.mark.unit
+def test_concurrent_conversions_render_a_diagram_once(tmp_path, monkeypatch):
+    flights = SingleFlight()
+    monkeypatch.setattr(mermaid_renderer, '_render_flights', flights)
+    monkeypatch.setattr(mermaid_renderer, 'get_mermaid_daemon', lambda: None)
+    monkeypatch.setattr(mermaid_renderer, 'get_mermaid_cli_version', lambda: '10.9.1')
+    renders = []
+
+    def slow_run_mmdc(code, scale, background, output_format='png'):
+        renders.append(code)
+        _wait_for(lambda: flights.stats()['shared'] == 4)
+        return b'PNG:' + code.encode()
+
+    monkeypatch.setattr(mermaid_renderer, '_run_mmdc', slow_run_mmdc)
+    cache = DiskCache(tmp_path)
+    results = []
+
+    def convert_single():
+        results.append(mermaid_renderer.render_mermaid_to_png('graph T\n', cache=cache).read())
+
+    def convert_batch():
+        results.extend(mermaid_renderer.render_mermaid_batch(['graph T', 'graph T  '], cache=cache))
+
+    threads = [threading.Thread(target=convert_single) for _ in range(3)]
+    threads.append(threading.Thread(target=convert_batch))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert renders == ['graph T']
+    assert results == [b'PNG:graph T'] * 5
+    # Three waiters on the flight plus the in-batch duplicate
+    assert mermaid_renderer.mermaid_render_stats() == {'executed': 1, 'shared': 4, 'in_flight': 0}
@@ -0,0 +1,112 @@
+"""Tests for the vectorized table width computation and the pipe table parser"""
+
+import random
+import time
+
+import pytest
+
+from helpers.table_width_optimizer import (
+    calculate_column_widths,
+    convert_table_to_latex,
+    iter_longtable_lines,
+    optimize_table_widths,
+    parse_pipe_table,
+)
+
+
+def _reference_widths(rows, min_width=0.1, max_width=0.6):
+    """The former per-cell Python loop, used as the reference"""
+    num_cols = len(rows[0])
+    col_lengths = [0] * num_cols
+    for row in rows:
+        for i, cell in enumerate(row):
+            if i < num_cols:
+                col_lengths[i] += len(cell.strip()) ** 0.7
+    col_lengths = [length / len(rows) for length in col_lengths]
+    total_length = sum(col_lengths)
+    if total_length == 0:
+        return [1.0 / num_cols] * num_cols
+    ratios = [max(min_width, min(max_width, length / total_length)) for length in col_lengths]
+    total_ratio = sum(ratios)
+    return [r / total_ratio for r in ratios]
+
+
+def _random_rows(rng):
+    num_cols = rng.randint(1, 14)
+    rows = []
+    for _ in range(rng.randint(1, 40)):
+        width = num_cols if rng.random() < 0.8 else rng.randint(0, num_cols + 2)
+        scale = rng.choice([3, 20, 200])
+        rows.append([' ' * rng.randint(0, 2) + 'x' * int(rng.expovariate(1 / scale)) for _ in range(width)])
+    rows[0] = rows[0] or ['header']
+    return rows
+
+
+@pytest.mark.unit
+def test_widths_match_former_loop_exactly():
+    rng = random.Random(3)
+    for _ in range(2000):
+        rows = _random_rows(rng)
+        for bounds in [(0.1, 0.6), (0.05, 0.9), (0.5, 0.2)]:
+            assert calculate_column_widths(rows, *bounds) == _reference_widths(rows, *bounds)
+
+
+@pytest.mark.unit
+def test_widths_edge_cases():
+    assert calculate_column_widths([]) == []
+    assert calculate_column_widths([[]]) == []
+    assert calculate_column_widths([['', ' '], ['', '']]) == [0.5, 0.5]
+    widths = calculate_column_widths([['a', 'b' * 100]])
+    assert all(isinstance(width, float) for width in widths)
+    assert sum(widths) == pytest.approx(1.0)
+
+
+@pytest.mark.unit
+def test_parse_pipe_table_empty_cells():
+    table = '| A | B | C |\n|---|---|---|\n| 1 |  | 3 |\n1 |  | 3\n| 1 | 2 | 3 | 4 | 5 |\n|\n'
+    headers, rows = parse_pipe_table(table)
+    assert headers == ['A', 'B', 'C']
+    # A leading | drops every empty cell; without it empty cells are kept
+    assert rows == [['1', '3', ''], ['1', '', '3'], ['1', '2', '3']]
+    assert parse_pipe_table('| A |') == ([], [])
+
+
+@pytest.mark.slow
+def test_large_table_sizes_quickly():
+    body = '\n'.join(f'| row {i} | {"x" * (i % 37)} | **b** {i} | `c` |' for i in range(100000))
+    headers, rows = parse_pipe_table('| A | B | C | D |\n|---|---|---|---|\n' + body)
+    assert len(rows) == 100000
+
+    start = time.perf_counter()
+    widths = calculate_column_widths([headers] + rows)
+    elapsed = time.perf_counter() - start
+    assert widths == _reference_widths([headers] + rows)
+    assert elapsed < 1.0
+
+
+@pytest.mark.unit
+def test_large_tables_are_chunked_with_repeated_header():
+    headers = ['A', 'B']
+    rows = [[str(i), 'x'] for i in range(25)]
+    lines = list(iter_longtable_lines(headers, iter(rows), [0.5, 0.5], chunk_rows=10))
+
+    assert lines.count('\\begin{longtable}[]{@{}p{0.475\\textwidth}|p{0.475\\textwidth}@{}}') == 3
+    assert lines.count('A & B \\\\') == 3
+    assert lines.count('\\endhead') == 3
+    assert lines.count('\\end{longtable}') == 3
+    assert lines.count('\\bottomrule') == 1
+    assert [line for line in lines if line.endswith('& x \\\\')] == [f'{i} & x \\\\' for i in range(25)]
+    # Chunks start right after every chunk_rows rows
+    assert lines[lines.index('9 & x \\\\') + 1] == '\\end{longtable}'
+
+    # Small tables (and chunk_rows=None) give a single longtable
+    single = convert_table_to_latex(headers, rows, [0.5, 0.5], chunk_rows=None)
+    assert single == convert_table_to_latex(headers, rows, [0.5, 0.5], chunk_rows=25)
+    assert single.count('\\begin{longtable}') == 1
+
+
+@pytest.mark.unit
+def test_optimize_table_widths_chunks_above_threshold():
+    table = '| A | B |\n|---|---|\n' + '\n'.join(f'| {i} | x |' for i in range(30))
+    assert optimize_table_widths(table, chunk_rows=12).count('\\begin{longtable}') == 3
+    assert optimize_table_widths(table).count('\\begin{longtable}') == 1